@@ -1,5 +1,7 @@
-from flask import Flask
-
 def create_app():
+    # Flask is imported here so that `python -m app.voice_assistant` and the
+    # other command-line modules don't pull it in just by importing `app`
+    from flask import Flask
+
     app = Flask(__name__)
     return app
@@ -0,0 +1,136 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from quart import Quart, Response, request, jsonify
+from app import metrics, startup, tracing
+from app.config import ASYNC_INFERENCE_WORKERS, MAX_PENDING_REQUESTS, WARM_UP
+from app.nlp import process_user_query, classify_intents, session_store, warm_up, prefetcher, DIALOGUE_INTENTS
+from app.batch_request import parse_batch_request
+from app.router import AutoGenRouter
+from app.log_util import log_query_response
+from app.tools import close_async_client
+
+# Asyncio-native serving mode with the same /predict_intent contract as
+# app/main.py. Run with: uvicorn app.asgi:app --port 5000
+
+app = Quart(__name__)
+
+router = AutoGenRouter()
+
+CONFIDENCE_THRESHOLD = 0.5  # Must match the threshold in your nlp.py
+
+# Model inference and Chroma I/O are blocking, so they run on a bounded pool
+inference_executor = ThreadPoolExecutor(max_workers=ASYNC_INFERENCE_WORKERS, thread_name_prefix="inference")
+
+# Requests currently admitted; only touched from the event loop thread
+pending_requests = 0
+
+# Serve straight away; /readyz reports 503 until the first inference has run
+if WARM_UP == "background":
+    startup.warm_up_in_background(warm_up)
+
+rejected_requests = metrics.counter("asgi_rejected_requests_total", "Requests refused with 503 because the backlog was full")
+metrics.gauge("asgi_pending_requests", "Requests currently being handled", fn=lambda: pending_requests)
+
+def process_turn(query, session_id):
+    # Runs on the inference pool; session state is read and written once per turn
+    with session_store.batch():
+        return process_user_query(query, session_id)
+
+@app.route("/predict_intent", methods=["POST"])
+async def predict_intent():
+    global pending_requests
+
+    # Admission control: fail fast instead of letting latency grow unbounded
+    if pending_requests >= MAX_PENDING_REQUESTS:
+        rejected_requests.inc()
+        return jsonify({"error": "Server is busy, please retry"}), 503
+
+    pending_requests += 1
+    try:
+        data = await request.get_json()
+        query = data.get("query")
+        session_id = data.get("session_id", "user-session")  # Retrieve session_id or use default
+
+        if not query:
+            return jsonify({"error": "Query is required"}), 400
+
+        with tracing.span("api.predict_intent", traceparent=data.get("traceparent")) as request_span:
+            # Step 1: Classify the query
+            started = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            intent, confidence, action_response = await loop.run_in_executor(
+                inference_executor, tracing.bind(process_turn), query, session_id
+            )
+            classified = time.perf_counter()
+
+            # Step 2: Route to tool if confidence is high. Multi-turn flows were
+            # already advanced by process_user_query, so they aren't routed again.
+            try:
+                if confidence >= CONFIDENCE_THRESHOLD and intent not in DIALOGUE_INTENTS:
+                    final_response = await router.aroute(query, intent, confidence, session_id, executor=inference_executor)
+                else:
+                    final_response = action_response  # fallback response
+            finally:
+                # Prefetches this turn didn't use must not reach the next one
+                if prefetcher:
+                    prefetcher.end_turn(session_id)
+            request_span.set("intent", intent)
+
+            # Step 3: Log and return the result
+            routed = time.perf_counter()
+            log_query_response(query, intent, final_response, confidence, session_id, latency_ms={
+                "classify": (classified - started) * 1000,
+                "route": (routed - classified) * 1000,
+                "total": (routed - started) * 1000,
+            })
+
+        return jsonify({
+            "query": query,
+            "intent": intent,
+            "confidence": confidence,
+            "response": final_response
+        })
+    finally:
+        pending_requests -= 1
+
+@app.route("/predict_intent/batch", methods=["POST"])
+async def predict_intent_batch():
+    global pending_requests
+
+    if pending_requests >= MAX_PENDING_REQUESTS:
+        rejected_requests.inc()
+        return jsonify({"error": "Server is busy, please retry"}), 503
+
+    pending_requests += 1
+    try:
+        queries, top_k, error = parse_batch_request(await request.get_json())
+        if error:
+            return jsonify({"error": error}), 400
+
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(inference_executor, classify_intents, queries, top_k)
+        return jsonify({"results": results})
+    finally:
+        pending_requests -= 1
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_endpoint():
+    return Response(metrics.render_prometheus(), mimetype="text/plain")
+
+@app.route("/healthz", methods=["GET"])
+async def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+async def readyz():
+    # Readiness: the model has answered its warm-up query (see IVR_WARM_UP)
+    if not startup.ready.is_set():
+        return jsonify({"status": "warming up"}), 503
+    return jsonify({"status": "ready"})
+
+@app.after_serving
+async def shutdown():
+    await close_async_client()
+    inference_executor.shutdown(wait=False)
@@ -0,0 +1,451 @@
+import argparse
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Inference backends for the intent classifier. Every backend takes a list of
+# texts and returns a (batch, num_labels) array of logits, so classify_intent
+# doesn't care which runtime produced them.
+
+MAX_SEQUENCE_LENGTH = 128
+ONNX_DIR = "onnx"
+ONNX_FILE = "model.onnx"
+ONNX_INT8_FILE = "model.int8.onnx"
+CALIBRATION_FILE = "calibration.json"
+SNAPSHOT_DIR = "snapshot"
+SNAPSHOT_WEIGHTS_FILE = "weights.bin"
+
+
+def softmax(logits, temperature=1.0):
+    scaled = logits / temperature
+    shifted = scaled - scaled.max(axis=-1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def load_temperature(model_path):
+    # Written by `python -m app.backends calibrate`; 1.0 leaves scores as-is
+    path = Path(model_path) / CALIBRATION_FILE
+    if not path.exists():
+        return 1.0
+    with open(path, "r") as f:
+        return float(json.load(f)["temperature"])
+
+
+def expected_calibration_error(probs, labels, bins=15):
+    confidence = probs.max(axis=-1)
+    correct = probs.argmax(axis=-1) == labels
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    error = 0.0
+    for low, high in zip(edges[:-1], edges[1:]):
+        in_bin = (confidence > low) & (confidence <= high)
+        if in_bin.any():
+            error += in_bin.mean() * abs(correct[in_bin].mean() - confidence[in_bin].mean())
+    return float(error)
+
+
+def fit_temperature(logits, labels):
+    """
+    Temperature scaling: the single T that minimises the negative
+    log-likelihood of softmax(logits / T) on held-out labels.
+    """
+    def nll(temperature):
+        probs = softmax(logits, temperature)
+        return -np.log(probs[np.arange(len(labels)), labels] + 1e-12).mean()
+
+    # Coarse log-spaced grid, then refine around the best point
+    grid = np.logspace(-1, 1, 41)
+    best = min(grid, key=nll)
+    fine = np.linspace(best / 1.12, best * 1.12, 41)
+    return float(min(fine, key=nll))
+
+
+class TorchBackend:
+    name = "pytorch"
+
+    def __init__(self, model_path, num_threads=0):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self._torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_path), local_files_only=True)
+        self.model = AutoModelForSequenceClassification.from_pretrained(str(model_path), local_files_only=True)
+        self.model.eval()
+
+    def after_fork(self, num_threads=0):
+        # Weights stay shared copy-on-write with the parent; only the thread
+        # pool is sized for this worker
+        if num_threads:
+            self._torch.set_num_threads(num_threads)
+
+    def logits(self, texts):
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=MAX_SEQUENCE_LENGTH, return_tensors="pt"
+        )
+        with self._torch.inference_mode():
+            return self.model(**encoded).logits.numpy()
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model_path, onnx_file=ONNX_FILE, num_threads=0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.onnx_path = Path(model_path) / ONNX_DIR / onnx_file
+        if not self.onnx_path.exists():
+            raise FileNotFoundError(
+                f"{self.onnx_path} not found. Export it first with: python -m app.backends export"
+            )
+        self._ort = ort
+        self._create_session(num_threads)
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_path), local_files_only=True)
+
+    def _create_session(self, num_threads):
+        options = self._ort.SessionOptions()
+        options.graph_optimization_level = self._ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = self._ort.InferenceSession(str(self.onnx_path), options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def after_fork(self, num_threads=0):
+        # ONNX Runtime thread pools don't survive fork(), so each worker
+        # builds its own session
+        self._create_session(num_threads)
+
+    def logits(self, texts):
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=MAX_SEQUENCE_LENGTH, return_tensors="np"
+        )
+        feed = {name: encoded[name].astype(np.int64) for name in self.input_names}
+        return self.session.run(["logits"], feed)[0]
+
+
+class SnapshotBackend:
+    """
+    Serves the startup snapshot written by `python -m app.backends snapshot`:
+    an ONNX graph that was already optimized offline (so session creation
+    skips graph optimization), weights in a separate file that ONNX Runtime
+    memory-maps, and a standalone tokenizer.json. Neither torch nor
+    transformers is imported, which is most of the cold-start time.
+    """
+
+    name = "snapshot"
+
+    def __init__(self, model_path, num_threads=0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.snapshot_dir = Path(model_path) / SNAPSHOT_DIR
+        if not (self.snapshot_dir / ONNX_FILE).exists():
+            raise FileNotFoundError(
+                f"{self.snapshot_dir / ONNX_FILE} not found. Write it first with: python -m app.backends snapshot"
+            )
+        self._ort = ort
+        self._create_session(num_threads)
+        self.tokenizer = Tokenizer.from_file(str(self.snapshot_dir / "tokenizer.json"))
+
+    def _create_session(self, num_threads):
+        options = self._ort.SessionOptions()
+        options.graph_optimization_level = self._ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = self._ort.InferenceSession(
+            str(self.snapshot_dir / ONNX_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def after_fork(self, num_threads=0):
+        self._create_session(num_threads)
+
+    def logits(self, texts):
+        encodings = self.tokenizer.encode_batch(list(texts))
+        encoded = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        return self.session.run(["logits"], {name: encoded[name] for name in self.input_names})[0]
+
+
+def load_backend(name, model_path, num_threads=0):
+    if name == "pytorch":
+        return TorchBackend(model_path, num_threads=num_threads)
+    if name == "onnx":
+        return OnnxBackend(model_path, ONNX_FILE, num_threads=num_threads)
+    if name == "onnx-int8":
+        backend = OnnxBackend(model_path, ONNX_INT8_FILE, num_threads=num_threads)
+        backend.name = "onnx-int8"
+        return backend
+    if name == "snapshot":
+        return SnapshotBackend(model_path, num_threads=num_threads)
+    if name == "cascade":
+        from app.config import CASCADE_TEACHER, CASCADE_THRESHOLD
+        from app.distill import CascadeBackend
+
+        return CascadeBackend(model_path, CASCADE_TEACHER, CASCADE_THRESHOLD, num_threads=num_threads)
+    if name == "knn":
+        from app.config import KNN_K
+        from app.knn import KnnBackend
+
+        return KnnBackend(model_path, KNN_K, num_threads=num_threads)
+    raise ValueError(
+        f"Unknown inference backend '{name}'. Use pytorch, onnx, onnx-int8, snapshot, cascade or knn."
+    )
+
+
+def backend_signature(name):
+    # The backend plus the settings besides the model files that change its
+    # predictions; part of the intent cache and rescore keys
+    if name == "cascade":
+        from app.config import CASCADE_TEACHER, CASCADE_THRESHOLD
+
+        return f"cascade:{CASCADE_TEACHER}:{CASCADE_THRESHOLD}"
+    if name == "knn":
+        from app.config import KNN_K
+
+        return f"knn:{KNN_K}"
+    return name
+
+
+def export_onnx(model_path, quantize=False, opset=17):
+    """
+    Export the fine-tuned model saved by model.py to ONNX, and optionally
+    write a dynamically int8-quantized copy next to it.
+    """
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+    model_path = Path(model_path)
+    out_dir = model_path / ONNX_DIR
+    out_dir.mkdir(parents=True, exist_ok=True)
+    onnx_path = out_dir / ONNX_FILE
+
+    tokenizer = AutoTokenizer.from_pretrained(str(model_path), local_files_only=True)
+    model = AutoModelForSequenceClassification.from_pretrained(str(model_path), local_files_only=True)
+    model.eval()
+    sample = tokenizer(["check my balance"], return_tensors="pt")
+
+    logger.info(f"Exporting {model_path} to {onnx_path}")
+    torch.onnx.export(
+        model,
+        (sample["input_ids"], sample["attention_mask"]),
+        str(onnx_path),
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch"},
+        },
+        opset_version=opset,
+        dynamo=False,
+    )
+    written = [onnx_path]
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = out_dir / ONNX_INT8_FILE
+        logger.info(f"Quantizing {onnx_path} to {int8_path}")
+        quantize_dynamic(str(onnx_path), str(int8_path), weight_type=QuantType.QInt8)
+        written.append(int8_path)
+    return written
+
+
+def write_snapshot(model_path, quantize=False):
+    """
+    Writes <model>/snapshot for the fast-start `snapshot` backend: the ONNX
+    model (exported first if missing) optimized offline, with its weights
+    in a separate memory-mappable file, plus a tokenizer.json that already
+    pads and truncates like the other backends.
+    """
+    import onnxruntime as ort
+    from transformers import AutoTokenizer
+
+    model_path = Path(model_path)
+    source = model_path / ONNX_DIR / (ONNX_INT8_FILE if quantize else ONNX_FILE)
+    if not source.exists():
+        export_onnx(model_path, quantize=quantize)
+
+    out_dir = model_path / SNAPSHOT_DIR
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for stale in (out_dir / ONNX_FILE, out_dir / SNAPSHOT_WEIGHTS_FILE):
+        stale.unlink(missing_ok=True)
+
+    # Creating a session with optimized_model_filepath saves the optimized
+    # graph; EXTENDED keeps it portable across CPUs (ALL adds layout changes
+    # specific to this machine)
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    options.optimized_model_filepath = str(out_dir / ONNX_FILE)
+    options.add_session_config_entry(
+        "session.optimized_model_external_initializers_file_name", SNAPSHOT_WEIGHTS_FILE
+    )
+    options.add_session_config_entry("session.optimized_model_external_initializers_min_size_in_bytes", "1024")
+    logger.info(f"Optimizing {source} into {out_dir}")
+    ort.InferenceSession(str(source), options, providers=["CPUExecutionProvider"])
+
+    tokenizer = AutoTokenizer.from_pretrained(str(model_path), local_files_only=True)
+    fast = tokenizer.backend_tokenizer
+    fast.enable_truncation(MAX_SEQUENCE_LENGTH)
+    fast.enable_padding(pad_id=tokenizer.pad_token_id, pad_token=tokenizer.pad_token)
+    fast.save(str(out_dir / "tokenizer.json"))
+
+    with open(out_dir / "manifest.json", "w") as f:
+        json.dump({"source": source.name, "quantized": quantize, "onnxruntime": ort.__version__,
+                   "max_sequence_length": MAX_SEQUENCE_LENGTH}, f, indent=2)
+    return [out_dir / ONNX_FILE, out_dir / SNAPSHOT_WEIGHTS_FILE, out_dir / "tokenizer.json"]
+
+
+def check_parity(model_path, csv_path, backend_name="onnx", batch_size=64, limit=None):
+    """
+    Compare a backend against the PyTorch model on a labeled CSV. Returns
+    accuracy for both, the prediction agreement rate and the largest
+    probability difference.
+    """
+    import pandas as pd
+
+    model_path = Path(model_path)
+    with open(model_path / "label2id.json", "r") as f:
+        label2id = json.load(f)
+
+    df = pd.read_csv(csv_path)
+    if limit:
+        df = df.head(limit)
+    queries = df["query"].astype(str).tolist()
+    expected = df["intent"].map(label2id).to_numpy()
+
+    reference = TorchBackend(model_path)
+    candidate = load_backend(backend_name, model_path)
+
+    ref_probs, cand_probs = [], []
+    timings = {"pytorch": 0.0, backend_name: 0.0}
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        t0 = time.perf_counter()
+        ref_probs.append(softmax(reference.logits(batch)))
+        t1 = time.perf_counter()
+        cand_probs.append(softmax(candidate.logits(batch)))
+        t2 = time.perf_counter()
+        timings["pytorch"] += t1 - t0
+        timings[backend_name] += t2 - t1
+
+    ref_probs = np.concatenate(ref_probs)
+    cand_probs = np.concatenate(cand_probs)
+    ref_pred = ref_probs.argmax(axis=-1)
+    cand_pred = cand_probs.argmax(axis=-1)
+
+    return {
+        "backend": backend_name,
+        "rows": len(queries),
+        "pytorch_accuracy": float((ref_pred == expected).mean()),
+        f"{backend_name}_accuracy": float((cand_pred == expected).mean()),
+        "agreement": float((ref_pred == cand_pred).mean()),
+        "max_prob_diff": float(np.abs(ref_probs - cand_probs).max()),
+        "pytorch_seconds": round(timings["pytorch"], 3),
+        f"{backend_name}_seconds": round(timings[backend_name], 3),
+    }
+
+
+def calibrate(model_path, csv_path=None, backend_name="pytorch", batch_size=64, train_csv=None):
+    """
+    Fit a softmax temperature on held-out labels and write it to
+    calibration.json next to the model. Without `csv_path` that is the test
+    split app/model.py kept out of training; a CSV the model was trained on
+    is refused, since memorised rows would bias T toward overconfidence.
+    """
+    from app.preprocess import evaluation_rows
+
+    model_path = Path(model_path)
+    with open(model_path / "label2id.json", "r") as f:
+        label2id = json.load(f)
+
+    df, source = evaluation_rows(model_path, csv_path, train_csv)
+    df = df[df["intent"].isin(label2id)]
+    if df.empty:
+        raise ValueError(f"{source} has no rows with intents known to the model")
+    logger.info(f"Calibrating on {source}")
+    queries = df["query"].astype(str).tolist()
+    labels = df["intent"].map(label2id).to_numpy()
+
+    backend = load_backend(backend_name, model_path)
+    logits = np.concatenate([
+        backend.logits(queries[start:start + batch_size]) for start in range(0, len(queries), batch_size)
+    ])
+    temperature = fit_temperature(logits, labels)
+    with open(model_path / CALIBRATION_FILE, "w") as f:
+        json.dump({"temperature": temperature, "fitted_on": source, "rows": len(queries)}, f)
+    return {
+        "temperature": temperature,
+        "fitted_on": source,
+        "rows": len(queries),
+        "ece_before": expected_calibration_error(softmax(logits), labels),
+        "ece_after": expected_calibration_error(softmax(logits, temperature), labels),
+    }
+
+
+def main(argv=None):
+    from app.config import MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="Export and validate intent model inference backends")
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="Export the model to ONNX")
+    export.add_argument("--quantize", action="store_true", help="Also write a dynamic int8 model")
+    export.add_argument("--opset", type=int, default=17)
+
+    snapshot = sub.add_parser("snapshot", help="Write the fast-start snapshot used by the snapshot backend")
+    snapshot.add_argument("--quantize", action="store_true", help="Build it from the int8 model")
+
+    parity = sub.add_parser("parity", help="Check a backend against the PyTorch model")
+    parity.add_argument("--backend", default="onnx", choices=["onnx", "onnx-int8", "snapshot"])
+    parity.add_argument("--csv", default=str(Path(__file__).parent / "data" / "banking_intents.csv"))
+    parity.add_argument("--batch-size", type=int, default=64)
+    parity.add_argument("--limit", type=int, default=None)
+    parity.add_argument("--min-agreement", type=float, default=0.99)
+
+    calib = sub.add_parser("calibrate", help="Fit the softmax temperature used for calibrated probabilities")
+    calib.add_argument("--backend", default="pytorch", choices=["pytorch", "onnx", "onnx-int8", "snapshot"])
+    calib.add_argument("--csv", help="Held-out labeled CSV (default: the test split model.py kept out of training)")
+    calib.add_argument("--train-csv", help="CSV the model was trained on, if it has no training_data.json")
+    calib.add_argument("--batch-size", type=int, default=64)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    if args.command == "export":
+        for path in export_onnx(args.model_path, quantize=args.quantize, opset=args.opset):
+            print(f"Wrote {path}")
+        return 0
+
+    if args.command == "snapshot":
+        for path in write_snapshot(args.model_path, quantize=args.quantize):
+            print(f"Wrote {path}")
+        return 0
+
+    if args.command == "calibrate":
+        print(json.dumps(calibrate(args.model_path, args.csv, args.backend, args.batch_size, args.train_csv), indent=2))
+        return 0
+
+    report = check_parity(args.model_path, args.csv, args.backend, args.batch_size, args.limit)
+    print(json.dumps(report, indent=2))
+    if report["agreement"] < args.min_agreement:
+        print(f"Agreement {report['agreement']:.4f} is below {args.min_agreement}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
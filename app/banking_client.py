@@ -0,0 +1,306 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app import metrics, tracing
+from app.config import (
+    BANKING_API_URL, BANKING_API_POOL_SIZE, BANKING_API_TIMEOUT, BANKING_API_CONCURRENCY,
+    BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS, RETRY_BUDGET_RATIO,
+)
+
+logger = logging.getLogger(__name__)
+
+# Per-endpoint policy. Only read-only or idempotent endpoints are retried;
+# a retried transfer could move money twice.
+ENDPOINT_POLICIES = {
+    "/balance": {"timeout": 2.0, "retries": 2},
+    "/loan-status": {"timeout": 2.0, "retries": 2},
+    "/open-account": {"timeout": 3.0, "retries": 1},
+    "/report-fraud": {"timeout": 5.0, "retries": 0},
+    "/transfer": {"timeout": 5.0, "retries": 0},
+}
+CONNECT_TIMEOUT = 1.0
+BACKOFF_BASE = 0.05
+BACKOFF_MAX = 1.0
+RETRYABLE_STATUS = {502, 503, 504}
+
+
+class BankingAPIError(Exception):
+    pass
+
+
+class CircuitOpenError(BankingAPIError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls
+    for `reset_seconds`. After that a single trial call is let through: a
+    success closes the breaker, a failure opens it again. A trial that is
+    cancelled, or never reports back within `reset_seconds`, is replaced by
+    a new one instead of leaving the endpoint locked out.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            started = self._opened_at if self.state == self.OPEN else self._trial_started
+            if now - started >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._trial_started = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def record_cancelled(self):
+        # A cancelled call (client disconnect, request timeout) says nothing
+        # about the backend; an abandoned trial lets the next call try again
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic() - self.reset_seconds
+
+
+class RetryBudget:
+    """
+    Caps retries at `ratio` of recent requests so a struggling backend isn't
+    hit with a retry storm. Counts decay every `window` seconds.
+    """
+
+    def __init__(self, ratio, window=10.0, min_retries=3):
+        self.ratio = ratio
+        self.window = window
+        self.min_retries = min_retries
+        self._requests = 0
+        self._retries = 0
+        self._window_started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        if time.monotonic() - self._window_started >= self.window:
+            self._requests //= 2
+            self._retries //= 2
+            self._window_started = time.monotonic()
+
+    def record_request(self):
+        with self._lock:
+            self._roll()
+            self._requests += 1
+
+    def try_spend(self):
+        with self._lock:
+            self._roll()
+            if self._retries < max(self.min_retries, self.ratio * self._requests):
+                self._retries += 1
+                return True
+            return False
+
+
+class EndpointStats:
+    def __init__(self, path):
+        labels = {"endpoint": path}
+        self.latency = metrics.histogram(
+            "banking_api_latency_seconds", "Banking API call latency, including retries", labels=labels
+        )
+        self.requests = metrics.counter("banking_api_requests_total", "Banking API calls", labels=labels)
+        self.errors = metrics.counter("banking_api_errors_total", "Banking API calls that failed", labels=labels)
+        self.retries = metrics.counter("banking_api_retries_total", "Banking API retry attempts", labels=labels)
+        self.rejected = metrics.counter(
+            "banking_api_circuit_rejections_total", "Calls rejected by an open circuit breaker", labels=labels
+        )
+
+
+class BankingClient:
+    """
+    Shared client for the banking API: one keep-alive connection pool,
+    per-endpoint timeouts and retries, a shared retry budget and a circuit
+    breaker per endpoint.
+    """
+
+    def __init__(self, base_url=BANKING_API_URL, pool_size=BANKING_API_POOL_SIZE):
+        self.base_url = base_url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(ENDPOINT_POLICIES), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.retry_budget = RetryBudget(RETRY_BUDGET_RATIO)
+        self._breakers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._async_client = None
+
+    def _policy(self, path):
+        return ENDPOINT_POLICIES.get(path, {"timeout": BANKING_API_TIMEOUT, "retries": 0})
+
+    def _endpoint(self, path):
+        with self._lock:
+            if path not in self._breakers:
+                breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+                self._breakers[path] = breaker
+                self._stats[path] = EndpointStats(path)
+                metrics.gauge(
+                    "banking_api_circuit_state", "0 closed, 1 open, 2 half-open",
+                    fn=lambda: breaker.state, labels={"endpoint": path},
+                )
+            return self._breakers[path], self._stats[path]
+
+    def _backoff(self, attempt):
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def post(self, path, query):
+        """
+        POST {"query": query} to `path` and return the decoded JSON body.
+        Raises BankingAPIError when the call fails after its retries.
+        """
+        with tracing.span("banking_api", endpoint=path):
+            return self._post(path, query)
+
+    def _post(self, path, query):
+        breaker, stats = self._endpoint(path)
+        policy = self._policy(path)
+        if not breaker.allow():
+            stats.rejected.inc()
+            raise CircuitOpenError(f"Circuit open for {path}")
+
+        stats.requests.inc()
+        self.retry_budget.record_request()
+        started = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    response = self.session.post(
+                        f"{self.base_url}{path}", json={"query": query},
+                        timeout=(CONNECT_TIMEOUT, policy["timeout"]),
+                    )
+                    if response.status_code in RETRYABLE_STATUS:
+                        raise BankingAPIError(f"{path} returned {response.status_code}")
+                    response.raise_for_status()
+                    data = response.json()
+                    breaker.record_success()
+                    return data
+                except (requests.ConnectionError, requests.Timeout, BankingAPIError) as e:
+                    if attempt >= policy["retries"] or not self.retry_budget.try_spend():
+                        raise BankingAPIError(f"{path} failed after {attempt + 1} attempt(s): {e}") from e
+                    attempt += 1
+                    stats.retries.inc()
+                    time.sleep(self._backoff(attempt))
+        except Exception:
+            stats.errors.inc()
+            breaker.record_failure()
+            raise
+        except BaseException:
+            # asyncio.CancelledError, KeyboardInterrupt
+            breaker.record_cancelled()
+            raise
+        finally:
+            stats.latency.observe(time.perf_counter() - started)
+
+    def run_concurrently(self, calls):
+        """
+        Run independent calls at the same time. `calls` is a list of
+        (function, *args) tuples; results come back in the same order.
+        """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=BANKING_API_CONCURRENCY, thread_name_prefix="banking-api"
+                    )
+        futures = [self._executor.submit(fn, *args) for fn, *args in calls]
+        return [future.result() for future in futures]
+
+    async def apost(self, path, query):
+        # Async counterpart of post() for the ASGI app; shares the breakers,
+        # retry budget and metrics
+        with tracing.span("banking_api", endpoint=path):
+            return await self._apost(path, query)
+
+    async def _apost(self, path, query):
+        import asyncio
+        import httpx
+
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(max_connections=BANKING_API_POOL_SIZE, max_keepalive_connections=BANKING_API_POOL_SIZE),
+            )
+        breaker, stats = self._endpoint(path)
+        policy = self._policy(path)
+        if not breaker.allow():
+            stats.rejected.inc()
+            raise CircuitOpenError(f"Circuit open for {path}")
+
+        stats.requests.inc()
+        self.retry_budget.record_request()
+        started = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    response = await self._async_client.post(
+                        path, json={"query": query},
+                        timeout=httpx.Timeout(policy["timeout"], connect=CONNECT_TIMEOUT),
+                    )
+                    if response.status_code in RETRYABLE_STATUS:
+                        raise BankingAPIError(f"{path} returned {response.status_code}")
+                    response.raise_for_status()
+                    data = response.json()
+                    breaker.record_success()
+                    return data
+                except (httpx.TransportError, BankingAPIError) as e:
+                    if attempt >= policy["retries"] or not self.retry_budget.try_spend():
+                        raise BankingAPIError(f"{path} failed after {attempt + 1} attempt(s): {e}") from e
+                    attempt += 1
+                    stats.retries.inc()
+                    await asyncio.sleep(self._backoff(attempt))
+        except Exception:
+            stats.errors.inc()
+            breaker.record_failure()
+            raise
+        except BaseException:
+            # asyncio.CancelledError, KeyboardInterrupt
+            breaker.record_cancelled()
+            raise
+        finally:
+            stats.latency.observe(time.perf_counter() - started)
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+
+banking_client = BankingClient()
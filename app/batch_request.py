@@ -0,0 +1,17 @@
+from app.config import MAX_BATCH_QUERIES, MAX_TOP_K
+
+# Request validation shared by the Flask (app/main.py) and Quart
+# (app/asgi.py) servers. Kept apart so neither server imports the other.
+
+
+def parse_batch_request(data):
+    queries = (data or {}).get("queries")
+    if not isinstance(queries, list) or not queries:
+        return None, None, "queries must be a non-empty list"
+    if len(queries) > MAX_BATCH_QUERIES:
+        return None, None, f"At most {MAX_BATCH_QUERIES} queries per request"
+    try:
+        top_k = int(data.get("top_k", 3))
+    except (TypeError, ValueError):
+        return None, None, "top_k must be an integer"
+    return queries, max(1, min(top_k, MAX_TOP_K)), None
@@ -0,0 +1,90 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests for a short window and runs them through
+    `batch_fn` as one batch. `batch_fn` takes a list of inputs and must return
+    a list of results in the same order.
+    """
+
+    def __init__(self, batch_fn, window_ms=5, max_batch_size=32, name="classifier"):
+        self.batch_fn = batch_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.name = name
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+        self.batch_size_histogram = metrics.histogram(
+            f"{name}_batch_size", "Number of requests per forward pass", BATCH_SIZE_BUCKETS
+        )
+        self.queue_wait_histogram = metrics.histogram(
+            f"{name}_queue_wait_seconds", "Time a request waited before its batch started"
+        )
+
+    def submit(self, item):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+                self._worker.start()
+
+    def _collect(self):
+        # Block for the first request, then keep draining until the window
+        # closes or the batch is full
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Everything after the batch is taken off the queue runs under the
+            # try, so every future ends up with a result or an exception and
+            # no caller is left blocked in __call__
+            try:
+                started = time.perf_counter()
+                for _, _, enqueued in batch:
+                    self.queue_wait_histogram.observe(started - enqueued)
+                self.batch_size_histogram.observe(len(batch))
+
+                results = self.batch_fn([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"batch_fn returned {len(results)} results for {len(batch)} inputs")
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logger.error(f"[{self.name}] batch of {len(batch)} failed: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
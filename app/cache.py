@@ -0,0 +1,200 @@
+import argparse
+import logging
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager
+from pathlib import Path
+
+from app import metrics
+from app.ipc import load_authkey, parse_address, remove_stale_socket, resolve_address  # noqa: F401
+
+logger = logging.getLogger(__name__)
+
+# Files whose changes mean cached predictions are stale: the weights of
+# every backend, the label maps and the calibrated temperature
+MODEL_FILES = (
+    "label2id.json", "config.json", "model.safetensors", "pytorch_model.bin", "calibration.json",
+    "onnx/model.onnx", "onnx/model.int8.onnx", "snapshot/model.onnx", "snapshot/weights.bin",
+    "student/student.npz", "knn/labels.txt",
+)
+CACHE_NAME = "intent-cache"
+
+
+class LocalCache:
+    """
+    Thread-safe LRU cache with a per-entry TTL. Also served to other
+    processes by `serve()`.
+    """
+
+    def __init__(self, max_size=4096, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < now:
+                del self._entries[key]
+                self._expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "evictions": self._evictions, "expirations": self._expirations}
+
+
+class CacheManager(BaseManager):
+    pass
+
+
+def serve(address, authkey, max_size, ttl, runtime_dir=""):
+    # See app/ipc.py: a private Unix socket and a random key unless configured
+    address = resolve_address(address, CACHE_NAME, runtime_dir, "127.0.0.1:50055")
+    key = load_authkey(authkey, CACHE_NAME, runtime_dir, create=True)
+    remove_stale_socket(address)
+    store = LocalCache(max_size, ttl)
+    CacheManager.register("get_cache", callable=lambda: store)
+    manager = CacheManager(address=address, authkey=key)
+    logger.info(f"Intent cache server listening on {address}")
+    manager.get_server().serve_forever()
+
+
+def connect(address, authkey, runtime_dir=""):
+    CacheManager.register("get_cache")
+    manager = CacheManager(
+        address=resolve_address(address, CACHE_NAME, runtime_dir, "127.0.0.1:50055"),
+        authkey=load_authkey(authkey, CACHE_NAME, runtime_dir),
+    )
+    manager.connect()
+    return manager.get_cache()
+
+
+def model_fingerprint(model_path, backend=""):
+    # `backend` (see backends.backend_signature) keeps predictions from one
+    # inference backend from being served for another
+    parts = [f"backend:{backend}"] if backend else []
+    for name in MODEL_FILES:
+        path = Path(model_path) / name
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "|".join(parts)
+
+
+def normalize_query(text):
+    # Callers pass sanitize_input output; the model is uncased, so case and
+    # repeated whitespace don't change the prediction
+    return " ".join(text.lower().split())
+
+
+class IntentCache:
+    """
+    Caches classify_intent results keyed on the normalized query. Keys carry
+    the model fingerprint and the backend, so retraining, re-exporting or
+    recalibrating the model, editing label2id.json or switching backends
+    invalidates every entry, including ones held by the shared server.
+    """
+
+    def __init__(self, store, model_path, backend="", check_interval=5.0):
+        self.store = store
+        self.model_path = model_path
+        self.backend = backend
+        self.check_interval = check_interval
+        self._fingerprint = model_fingerprint(model_path, backend)
+        self._checked_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.hits = metrics.counter("intent_cache_hits_total", "classify_intent results served from the cache")
+        self.misses = metrics.counter("intent_cache_misses_total", "classify_intent calls that ran the model")
+        self.errors = metrics.counter("intent_cache_errors_total", "Cache backend calls that failed")
+        metrics.gauge("intent_cache_evictions", "Entries evicted by the LRU limit", fn=lambda: self._stat("evictions"))
+        metrics.gauge("intent_cache_size", "Entries currently cached", fn=lambda: self._stat("size"))
+
+    def _stat(self, name):
+        try:
+            return self.store.stats()[name]
+        except Exception:
+            return 0
+
+    def _current_fingerprint(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            with self._lock:
+                if now - self._checked_at >= self.check_interval:
+                    fingerprint = model_fingerprint(self.model_path, self.backend)
+                    if fingerprint != self._fingerprint:
+                        logger.info(f"Model files changed in {self.model_path}; invalidating intent cache")
+                        self._fingerprint = fingerprint
+                        self._safe(self.store.clear)
+                    self._checked_at = now
+        return self._fingerprint
+
+    def _safe(self, fn, *args):
+        try:
+            return fn(*args)
+        except Exception as e:
+            self.errors.inc()
+            logger.warning(f"Intent cache backend error: {e}")
+            return None
+
+    def key(self, text):
+        return f"{self._current_fingerprint()}#{normalize_query(text)}"
+
+    def get(self, key):
+        value = self._safe(self.store.get, key)
+        if value is None:
+            self.misses.inc()
+        else:
+            self.hits.inc()
+        return value
+
+    def put(self, key, value):
+        self._safe(self.store.put, key, value)
+
+
+def create_cache(backend, model_path, max_size, ttl, address="", authkey="", runtime_dir="", model_backend=""):
+    if backend == "off":
+        return None
+    if backend == "local":
+        return IntentCache(LocalCache(max_size, ttl), model_path, model_backend)
+    if backend == "shared":
+        return IntentCache(connect(address, authkey, runtime_dir), model_path, model_backend)
+    raise ValueError(f"Unknown intent cache backend '{backend}'. Use local, shared or off.")
+
+
+if __name__ == "__main__":
+    from app.config import CACHE_ADDRESS, CACHE_AUTHKEY, CACHE_MAX_SIZE, CACHE_TTL, RUNTIME_DIR
+
+    parser = argparse.ArgumentParser(description="Serve the intent cache to several worker processes")
+    parser.add_argument("--address", default=CACHE_ADDRESS,
+                        help="Unix socket path or host:port (default: intent-cache.sock in the runtime directory)")
+    parser.add_argument("--max-size", type=int, default=CACHE_MAX_SIZE)
+    parser.add_argument("--ttl", type=float, default=CACHE_TTL)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    serve(args.address, CACHE_AUTHKEY, args.max_size, args.ttl, RUNTIME_DIR)
@@ -0,0 +1,107 @@
+import csv
+import io
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Append-only call log for the voice client. Rows are buffered in memory and
+# appended in batches under an exclusive file lock, so several client
+# processes can share one log file without interleaving or duplicate headers.
+
+CALL_LOG_FIELDS = ("query", "intent", "confidence", "response", "timestamp", "session_id")
+
+
+@contextmanager
+def locked(f):
+    # Exclusive lock across processes for the duration of one batch append
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        # msvcrt locks a byte range from the current position; every writer
+        # locks the first byte, which works as a whole-file lock
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                continue  # LK_LOCK gives up after ~10 seconds; keep waiting
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class CallLogWriter:
+    """
+    Buffers call-log rows and appends them to `path` as CSV or JSON lines.
+    A batch is written once `flush_every` rows are waiting or `flush_seconds`
+    have passed since the last write; `close` writes the rest and fsyncs.
+    """
+
+    def __init__(self, path, fields=CALL_LOG_FIELDS, format="csv", flush_every=20, flush_seconds=5.0):
+        if format not in ("csv", "jsonl"):
+            raise ValueError(f"Unknown call log format '{format}'. Use csv or jsonl.")
+        self.path = path
+        self.fields = tuple(fields)
+        self.format = format
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self._rows = []
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def write(self, row):
+        with self._lock:
+            self._rows.append(row)
+            due = len(self._rows) >= self.flush_every or time.monotonic() - self._flushed_at >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def _encode(self, rows, header):
+        if self.format == "jsonl":
+            return "".join(json.dumps({field: row.get(field) for field in self.fields}, default=str) + "\n" for row in rows)
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=self.fields, extrasaction="ignore", lineterminator="\n")
+        if header:
+            writer.writeheader()
+        writer.writerows(rows)
+        return out.getvalue()
+
+    def flush(self, sync=False):
+        with self._lock:
+            rows, self._rows = self._rows, []
+            self._flushed_at = time.monotonic()
+            if not rows and not sync:
+                return
+            with open(self.path, "a", encoding="utf-8", newline="") as f:
+                with locked(f):
+                    # Only the first writer of an empty file adds the CSV header
+                    f.seek(0, os.SEEK_END)
+                    if rows:
+                        f.write(self._encode(rows, header=f.tell() == 0))
+                    f.flush()
+                    if sync:
+                        os.fsync(f.fileno())
+
+    def close(self):
+        self.flush(sync=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
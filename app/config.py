@@ -0,0 +1,90 @@
+import os
+
+# Runtime settings for the intent service. Every value can be overridden
+# through an environment variable so deployments don't need code changes.
+
+# Micro-batching in front of the intent classifier
+BATCH_WINDOW_MS = float(os.environ.get("IVR_BATCH_WINDOW_MS", "5"))
+MAX_BATCH_SIZE = int(os.environ.get("IVR_MAX_BATCH_SIZE", "32"))
+
+# Fine-tuned intent model written by app/model.py
+MODEL_PATH = os.environ.get("IVR_MODEL_PATH", r"D:\IVR Case-02\banking-intents-minilm")
+
+# Inference runtime for the intent model: pytorch, onnx, onnx-int8, snapshot,
+# cascade (the distilled student from app/distill.py, escalating to
+# CASCADE_TEACHER when its top probability is below CASCADE_THRESHOLD) or
+# knn (top-KNN_K vote over the exemplar index built by app/knn.py)
+INTENT_BACKEND = os.environ.get("IVR_INTENT_BACKEND", "pytorch")
+INFERENCE_THREADS = int(os.environ.get("IVR_INFERENCE_THREADS", "0"))  # 0 = runtime default
+CASCADE_TEACHER = os.environ.get("IVR_CASCADE_TEACHER", "pytorch")
+CASCADE_THRESHOLD = float(os.environ.get("IVR_CASCADE_THRESHOLD", "0.9"))
+KNN_K = int(os.environ.get("IVR_KNN_K", "10"))
+
+# Private (0700) directory for the sockets and generated authkeys of the
+# local servers below; default $XDG_RUNTIME_DIR/ivr or <tmp>/ivr-<user>
+RUNTIME_DIR = os.environ.get("IVR_RUNTIME_DIR", "")
+
+# classify_intent result cache: local (per process), shared (served by
+# `python -m app.cache` over a local socket) or off. The address defaults to
+# a Unix socket in RUNTIME_DIR and the authkey to a random key the server
+# writes there; there is deliberately no built-in key.
+CACHE_BACKEND = os.environ.get("IVR_CACHE_BACKEND", "local")
+CACHE_MAX_SIZE = int(os.environ.get("IVR_CACHE_MAX_SIZE", "4096"))
+CACHE_TTL = float(os.environ.get("IVR_CACHE_TTL", "3600"))
+CACHE_ADDRESS = os.environ.get("IVR_CACHE_ADDRESS", "")
+CACHE_AUTHKEY = os.environ.get("IVR_CACHE_AUTHKEY", "")
+
+# Async (ASGI) serving mode in app/asgi.py
+ASYNC_INFERENCE_WORKERS = int(os.environ.get("IVR_ASYNC_INFERENCE_WORKERS", "4"))
+MAX_PENDING_REQUESTS = int(os.environ.get("IVR_MAX_PENDING_REQUESTS", "64"))
+
+# Banking API client (app/banking_client.py)
+BANKING_API_URL = os.environ.get("IVR_BANKING_API_URL", "http://localhost:5001")
+BANKING_API_POOL_SIZE = int(os.environ.get("IVR_BANKING_API_POOL_SIZE", "20"))
+BANKING_API_TIMEOUT = float(os.environ.get("IVR_BANKING_API_TIMEOUT", "5"))  # endpoints without their own policy
+BANKING_API_CONCURRENCY = int(os.environ.get("IVR_BANKING_API_CONCURRENCY", "8"))  # parallel independent calls
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("IVR_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("IVR_BREAKER_RESET_SECONDS", "30"))
+RETRY_BUDGET_RATIO = float(os.environ.get("IVR_RETRY_BUDGET_RATIO", "0.2"))  # retries allowed per request
+
+# Session state store: memory (per process), sqlite (a WAL database shared
+# by every worker process on the node) or socket (served by
+# `python -m app.session_store` over a local socket). Like the shared cache,
+# the socket defaults to RUNTIME_DIR with a generated key, never a built-in one.
+SESSION_STORE = os.environ.get("IVR_SESSION_STORE", "memory")
+SESSION_DB_PATH = os.environ.get("IVR_SESSION_DB_PATH", "./sessions.db")
+SESSION_TTL = float(os.environ.get("IVR_SESSION_TTL", "1800"))  # idle seconds before a session expires
+SESSION_MAX_SIZE = int(os.environ.get("IVR_SESSION_MAX_SIZE", "100000"))
+SESSION_ADDRESS = os.environ.get("IVR_SESSION_ADDRESS", "")
+SESSION_AUTHKEY = os.environ.get("IVR_SESSION_AUTHKEY", "")
+
+# Warm-up inference at startup: "background" (the app serves at once and
+# /readyz turns 200 when done) or "off" (the prefork workers warm up instead)
+WARM_UP = os.environ.get("IVR_WARM_UP", "background")
+WARM_UP_RETRIES = int(os.environ.get("IVR_WARM_UP_RETRIES", "3"))  # retries before a prefork worker gives up and exits
+WARM_UP_BACKOFF = float(os.environ.get("IVR_WARM_UP_BACKOFF", "1.0"))  # seconds before the first retry, doubled each time
+
+# Prefork serving (gunicorn.conf.py)
+WORKERS = int(os.environ.get("IVR_WORKERS", str(os.cpu_count() or 1)))
+WORKER_THREADS = int(os.environ.get("IVR_WORKER_THREADS", "4"))
+BIND = os.environ.get("IVR_BIND", "0.0.0.0:5000")
+
+# Speculative prefetch of read-only tool calls (app/prefetch.py)
+PREFETCH_ENABLED = os.environ.get("IVR_PREFETCH_ENABLED", "1") == "1"
+PREFETCH_THRESHOLD = float(os.environ.get("IVR_PREFETCH_THRESHOLD", "0.6"))  # min intent probability
+PREFETCH_TTL = float(os.environ.get("IVR_PREFETCH_TTL", "10"))
+PREFETCH_MAX_IN_FLIGHT = int(os.environ.get("IVR_PREFETCH_MAX_IN_FLIGHT", "4"))
+PREFETCH_WAIT_SECONDS = float(os.environ.get("IVR_PREFETCH_WAIT_SECONDS", "5"))
+
+# /predict_intent/batch
+MAX_BATCH_QUERIES = int(os.environ.get("IVR_MAX_BATCH_QUERIES", "1000"))
+MAX_TOP_K = 10
+
+# Logging
+LOG_LEVEL = os.environ.get("IVR_LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.environ.get("IVR_LOG_MAX_BYTES", str(50 * 1024 * 1024)))  # rotate log files at this size
+LOG_BACKUP_COUNT = int(os.environ.get("IVR_LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.environ.get("IVR_LOG_QUEUE_SIZE", "10000"))  # records waiting to be written
+
+# Tracing (app/tracing.py); spans are exported as Chrome trace files when set
+TRACE_DIR = os.environ.get("IVR_TRACE_DIR", "")
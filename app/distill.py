@@ -0,0 +1,338 @@
+import argparse
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app import metrics
+from app.backends import MAX_SEQUENCE_LENGTH, fit_temperature, load_backend, load_temperature, softmax
+
+logger = logging.getLogger(__name__)
+
+# Knowledge distillation of the fine-tuned intent model (the teacher) into a
+# tiny student: mean-pooled static embeddings of word pieces and hashed
+# word-piece bigrams, followed by one linear layer (fastText-style). The
+# student runs in plain numpy in microseconds. At serving time the cascade
+# backend lets it answer the queries it is confident about and escalates
+# the rest to the teacher.
+#
+#   python -m app.distill train              # writes <model>/student
+#   python -m app.distill report             # escalation / accuracy / CPU
+#
+# The student is trained on the teacher's own training split. The report is
+# measured on rows neither model trained on: the test split app/model.py
+# kept out of fine-tuning (app.preprocess.held_out_split), or --csv.
+
+STUDENT_DIR = "student"
+STUDENT_WEIGHTS_FILE = "student.npz"
+STUDENT_CONFIG_FILE = "student.json"
+BIGRAM_BUCKETS = 50000
+DEFAULT_THRESHOLD = 0.9
+REPORT_THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98, 0.99)
+STUDENT_CALIBRATION_SIZE = 0.1  # Share of the training split kept back to calibrate the student
+
+
+def feature_ids(ids, vocab_size):
+    # Word pieces plus hashed bigrams of neighbouring pieces
+    bigrams = [vocab_size + (a * 1000003 + b) % BIGRAM_BUCKETS for a, b in zip(ids, ids[1:])]
+    return list(ids) + bigrams
+
+
+def load_labels(model_path):
+    with open(Path(model_path) / "label2id.json", "r") as f:
+        label2id = json.load(f)
+    return label2id
+
+
+class StudentModel:
+    """
+    Inference for a student written by `train_student`. Only needs numpy and
+    the `tokenizers` package.
+    """
+
+    def __init__(self, student_dir):
+        from tokenizers import Tokenizer
+
+        student_dir = Path(student_dir)
+        weights = np.load(student_dir / STUDENT_WEIGHTS_FILE)
+        self.embedding = weights["embedding"]
+        self.weight = weights["weight"]
+        self.bias = weights["bias"]
+        with open(student_dir / STUDENT_CONFIG_FILE, "r") as f:
+            self.config = json.load(f)
+        self.vocab_size = self.config["vocab_size"]
+        self.temperature = self.config["temperature"]
+        self.tokenizer = Tokenizer.from_file(str(student_dir / "tokenizer.json"))
+
+    def logits(self, texts):
+        pooled = np.empty((len(texts), self.embedding.shape[1]), dtype=np.float32)
+        for row, encoding in enumerate(self.tokenizer.encode_batch(list(texts))):
+            ids = feature_ids(encoding.ids, self.vocab_size)
+            pooled[row] = self.embedding[ids].mean(axis=0)
+        return pooled @ self.weight.T + self.bias
+
+    def probabilities(self, texts):
+        return softmax(self.logits(texts), self.temperature)
+
+
+def load_student(model_path):
+    student_dir = Path(model_path) / STUDENT_DIR
+    if not (student_dir / STUDENT_WEIGHTS_FILE).exists():
+        raise FileNotFoundError(f"{student_dir} has no student model. Train one with: python -m app.distill train")
+    return StudentModel(student_dir)
+
+
+class CascadeBackend:
+    """
+    Student first, teacher only for the queries the student is unsure of
+    (top probability below `threshold`). Returns calibrated log-probabilities
+    scaled by the teacher's temperature, so the softmax(logits, temperature)
+    in app.nlp turns them back into the probabilities of whichever model
+    answered each row.
+    """
+
+    name = "cascade"
+
+    def __init__(self, model_path, teacher="pytorch", threshold=DEFAULT_THRESHOLD, num_threads=0):
+        self.student = load_student(model_path)
+        self.teacher = load_backend(teacher, model_path, num_threads=num_threads)
+        self.tokenizer = self.teacher.tokenizer
+        self.threshold = threshold
+        self.temperature = load_temperature(model_path)
+        self.student_answers = metrics.counter(
+            "cascade_student_answers_total", "Queries answered by the distilled student model"
+        )
+        self.escalations = metrics.counter(
+            "cascade_escalations_total", "Queries the student escalated to the full intent model"
+        )
+
+    def after_fork(self, num_threads=0):
+        self.teacher.after_fork(num_threads)
+
+    def logits(self, texts):
+        probs = self.student.probabilities(texts)
+        escalate = np.flatnonzero(probs.max(axis=-1) < self.threshold)
+        if len(escalate):
+            probs[escalate] = softmax(self.teacher.logits([texts[i] for i in escalate]), self.temperature)
+        self.escalations.inc(len(escalate))
+        self.student_answers.inc(len(texts) - len(escalate))
+        return np.log(probs + 1e-12) * self.temperature
+
+
+def teacher_logits(teacher, texts, batch_size=64):
+    return np.concatenate([teacher.logits(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)])
+
+
+def split_dataset(df, test_size=0.2, seed=42):
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(df))
+    cut = int(len(df) * (1 - test_size))
+    return df.iloc[order[:cut]].reset_index(drop=True), df.iloc[order[cut:]].reset_index(drop=True)
+
+
+def train_student(model_path, train_csv=None, teacher_backend="pytorch", dim=128, epochs=40,
+                  kd_temperature=2.0, alpha=0.7, lr=0.05, batch_size=64, seed=42):
+    """
+    Fits the student on the teacher's soft labels (KL divergence at
+    `kd_temperature`) mixed with the true labels (cross-entropy), weighted
+    by `alpha`, then calibrates its temperature. Only the teacher's training
+    split is used (`train_csv` if the model has no training_data.json), so
+    its test split stays unseen for `report`; the student's calibration rows
+    are a slice of the training split the student itself doesn't train on.
+    """
+    import torch
+    from transformers import AutoTokenizer
+
+    from app.preprocess import held_out_split
+
+    model_path = Path(model_path)
+    label2id = load_labels(model_path)
+    teacher_train_df, _, source = held_out_split(model_path, train_csv)
+    df = teacher_train_df[teacher_train_df["intent"].isin(label2id)]
+    train_df, test_df = split_dataset(df, STUDENT_CALIBRATION_SIZE, seed)
+    test_df = test_df[~test_df["query"].isin(set(train_df["query"]))]
+
+    teacher = load_backend(teacher_backend, model_path)
+    train_texts = train_df["query"].tolist()
+    soft_targets = torch.tensor(teacher_logits(teacher, train_texts), dtype=torch.float32)
+    labels = torch.tensor(train_df["intent"].map(label2id).to_numpy())
+
+    tokenizer = AutoTokenizer.from_pretrained(str(model_path), local_files_only=True)
+    fast = tokenizer.backend_tokenizer
+    fast.enable_truncation(MAX_SEQUENCE_LENGTH)
+    fast.no_padding()
+    vocab_size = fast.get_vocab_size()
+    features = [feature_ids(e.ids, vocab_size) for e in fast.encode_batch(train_texts)]
+
+    torch.manual_seed(seed)
+    embedding = torch.nn.EmbeddingBag(vocab_size + BIGRAM_BUCKETS, dim, mode="mean")
+    linear = torch.nn.Linear(dim, len(label2id))
+    optimizer = torch.optim.Adam(list(embedding.parameters()) + list(linear.parameters()), lr=lr)
+
+    logger.info(f"Distilling {model_path} into a {dim}-dim student on {len(train_texts)} queries")
+    generator = torch.Generator().manual_seed(seed)
+    for epoch in range(epochs):
+        total = 0.0
+        for batch in torch.randperm(len(features), generator=generator).split(batch_size):
+            rows = [features[i] for i in batch.tolist()]
+            flat = torch.tensor([i for row in rows for i in row])
+            offsets = torch.tensor([0] + [len(row) for row in rows[:-1]]).cumsum(0)
+            logits = linear(embedding(flat, offsets))
+            kd = torch.nn.functional.kl_div(
+                torch.log_softmax(logits / kd_temperature, dim=-1),
+                torch.softmax(soft_targets[batch] / kd_temperature, dim=-1),
+                reduction="batchmean",
+            ) * kd_temperature ** 2
+            ce = torch.nn.functional.cross_entropy(logits, labels[batch])
+            loss = alpha * kd + (1 - alpha) * ce
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(batch)
+        logger.info(f"Epoch {epoch + 1}/{epochs}: loss {total / len(features):.4f}")
+
+    out_dir = model_path / STUDENT_DIR
+    out_dir.mkdir(parents=True, exist_ok=True)
+    np.savez(
+        out_dir / STUDENT_WEIGHTS_FILE,
+        embedding=embedding.weight.detach().numpy().astype(np.float32),
+        weight=linear.weight.detach().numpy().astype(np.float32),
+        bias=linear.bias.detach().numpy().astype(np.float32),
+    )
+    fast.save(str(out_dir / "tokenizer.json"))
+    config = {"vocab_size": vocab_size, "dim": dim, "temperature": 1.0, "kd_temperature": kd_temperature,
+              "alpha": alpha, "epochs": epochs, "train_csv": str(source), "seed": seed}
+    with open(out_dir / STUDENT_CONFIG_FILE, "w") as f:
+        json.dump(config, f, indent=2)
+
+    # Calibrate on rows the student didn't fit so the cascade threshold means what it says
+    student = StudentModel(out_dir)
+    config["temperature"] = fit_temperature(
+        student.logits(test_df["query"].tolist()), test_df["intent"].map(label2id).to_numpy()
+    )
+    with open(out_dir / STUDENT_CONFIG_FILE, "w") as f:
+        json.dump(config, f, indent=2)
+    logger.info(f"Student written to {out_dir} (temperature {config['temperature']:.3f})")
+    return out_dir
+
+
+def cpu_per_call(fn, texts):
+    # CPU seconds per single-query call, as the API sees them
+    started = time.process_time()
+    for text in texts:
+        fn([text])
+    return (time.process_time() - started) / len(texts)
+
+
+def report(model_path, csv_path=None, teacher_backend="pytorch", thresholds=REPORT_THRESHOLDS,
+           timing_samples=500, train_csv=None):
+    """
+    Compares student, teacher and cascade on rows neither was trained on:
+    `csv_path`, or by default the test split app/model.py kept out of
+    fine-tuning. Reports accuracy, escalation rate and CPU per 1,000 calls
+    at each threshold. The cascade's CPU is estimated from the measured
+    per-call CPU of the two models (student on every call, teacher on the
+    escalated ones).
+    """
+    from app.preprocess import evaluation_rows
+
+    model_path = Path(model_path)
+    label2id = load_labels(model_path)
+    test_df, source = evaluation_rows(model_path, csv_path, train_csv)
+    test_df = test_df[test_df["intent"].isin(label2id)]
+    if test_df.empty:
+        raise ValueError(f"{source} has no rows with intents known to the model")
+    logger.info(f"Reporting on {source}")
+    texts = test_df["query"].astype(str).tolist()
+    labels = test_df["intent"].map(label2id).to_numpy()
+
+    student = load_student(model_path)
+    teacher = load_backend(teacher_backend, model_path)
+    student_probs = student.probabilities(texts)
+    teacher_pred = teacher_logits(teacher, texts).argmax(axis=-1)
+    student_pred = student_probs.argmax(axis=-1)
+    confidence = student_probs.max(axis=-1)
+
+    sample = texts[:timing_samples]
+    teacher.logits(sample[:8])  # Warm up the runtime before timing
+    student_cpu = cpu_per_call(student.logits, sample)
+    teacher_cpu = cpu_per_call(teacher.logits, sample)
+    teacher_accuracy = float((teacher_pred == labels).mean())
+
+    rows = []
+    for threshold in thresholds:
+        escalate = confidence < threshold
+        cascade_pred = np.where(escalate, teacher_pred, student_pred)
+        cascade_cpu = student_cpu + escalate.mean() * teacher_cpu
+        accuracy = float((cascade_pred == labels).mean())
+        rows.append({
+            "threshold": threshold,
+            "escalation_rate": round(float(escalate.mean()), 4),
+            "accuracy": round(accuracy, 4),
+            "accuracy_loss": round(teacher_accuracy - accuracy, 4),
+            "agreement_with_teacher": round(float((cascade_pred == teacher_pred).mean()), 4),
+            "cpu_ms_per_1000_calls": round(cascade_cpu * 1e6, 1),
+            "cpu_ms_saved_per_1000_calls": round((teacher_cpu - cascade_cpu) * 1e6, 1),
+        })
+    return {
+        "evaluated_on": source,
+        "queries": len(texts),
+        "teacher": {"backend": teacher_backend, "accuracy": round(teacher_accuracy, 4),
+                    "cpu_ms_per_1000_calls": round(teacher_cpu * 1e6, 1)},
+        "student": {"accuracy": round(float((student_pred == labels).mean()), 4),
+                    "cpu_ms_per_1000_calls": round(student_cpu * 1e6, 1)},
+        "cascade": rows,
+    }
+
+
+def main(argv=None):
+    from app.config import MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="Distil the intent model into a small student for the cascade backend")
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    parser.add_argument("--csv", help="Held-out labeled CSV to report on (default: the test split model.py kept out of training)")
+    parser.add_argument("--train-csv", help="CSV the teacher was trained on, if it has no training_data.json")
+    parser.add_argument("--teacher", default="pytorch", choices=["pytorch", "onnx", "onnx-int8", "snapshot"])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    train = sub.add_parser("train", help="Train the student on the teacher's predictions")
+    train.add_argument("--dim", type=int, default=128)
+    train.add_argument("--epochs", type=int, default=40)
+    train.add_argument("--kd-temperature", type=float, default=2.0)
+    train.add_argument("--alpha", type=float, default=0.7, help="Weight of the distillation loss vs. true labels")
+
+    evaluate = sub.add_parser("report", help="Escalation rate, accuracy loss and CPU saved per threshold")
+    evaluate.add_argument("--timing-samples", type=int, default=500)
+    evaluate.add_argument("--output", help="Also write the report as JSON here")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    if args.command == "train":
+        train_student(args.model_path, args.train_csv, args.teacher, args.dim, args.epochs, args.kd_temperature, args.alpha)
+        result = report(args.model_path, args.csv, args.teacher, train_csv=args.train_csv)
+    else:
+        result = report(args.model_path, args.csv, args.teacher, timing_samples=args.timing_samples,
+                        train_csv=args.train_csv)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+
+    print(f"Evaluated on {result['evaluated_on']}")
+    print(f"Teacher ({result['teacher']['backend']}): accuracy {result['teacher']['accuracy']:.4f}, "
+          f"{result['teacher']['cpu_ms_per_1000_calls']:.1f} CPU ms per 1,000 calls")
+    print(f"Student: accuracy {result['student']['accuracy']:.4f}, "
+          f"{result['student']['cpu_ms_per_1000_calls']:.1f} CPU ms per 1,000 calls")
+    print(f"\n{'threshold':>9} {'escalated':>9} {'accuracy':>8} {'loss':>7} {'CPU ms/1k':>10} {'saved/1k':>9}")
+    for row in result["cascade"]:
+        print(f"{row['threshold']:>9.2f} {row['escalation_rate']:>9.1%} {row['accuracy']:>8.4f} "
+              f"{row['accuracy_loss']:>+7.4f} {row['cpu_ms_per_1000_calls']:>10.1f} "
+              f"{row['cpu_ms_saved_per_1000_calls']:>9.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,40 @@
+import argparse
+import logging
 import os
+import re
+import secrets
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
-import random
-import logging
 
-# Set up logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("D:/IVR Case-02/sample_generation.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+# Synthetic training data for the intent model. Every template is compiled
+# once into literal text and slot positions, so the combinations of a
+# template's placeholder values form a mixed-radix number space: combination
+# i of a template is rendered by splitting i into one digit per slot, for a
+# whole array of i at once. Each intent can be enumerated exhaustively or
+# sampled to a quota (with replacement, like the original generator, or
+# distinct rows only with --dedup) from a seed. Work is split into
+# units that mix all intents, rendered in parallel processes and streamed
+# to CSV or Parquet.
+#
+#   python -m app.generate_banking_intents                                  # 40 per intent, like before
+#   python -m app.generate_banking_intents --mode exhaustive -o all.parquet
+#   python -m app.generate_banking_intents --total 1000000 --workers 8 -o big.parquet
+#   python -m app.generate_banking_intents --dedup                          # distinct only; may fall short
+
+LOG_FILE = "D:/IVR Case-02/sample_generation.log"
+
 # Define output path
 output_path = "D:/IVR Case-02/app/data/banking_intents.csv"
 
-# Ensure output directory exists
-os.makedirs(os.path.dirname(output_path), exist_ok=True)
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+UNIT_ROWS = 50000  # rows rendered per work unit, across all intents
+DEFAULT_PER_INTENT = 40
 
 # Define intents and query templates (~50 intents)
 intents_templates = {
@@ -508,44 +524,271 @@ variations = {
     "bill_type": ["utility", "phone", "internet", "electricity"]
 }
 
-# Generate samples
-def generate_samples(intent, templates, num_samples=40):
-    samples = []
-    for _ in range(num_samples):
-        template = random.choice(templates)
-        query = template
-        for placeholder, options in variations.items():
-            if f"{{{placeholder}}}" in query:
-                query = query.replace(f"{{{placeholder}}}", random.choice(options))
-        samples.append({"query": query, "intent": intent})
-    return samples
-
-# Generate dataset
-data = []
-for intent, templates in intents_templates.items():
-    logger.info(f"Generating samples for intent: {intent}")
-    samples = generate_samples(intent, templates, num_samples=40)
-    data.extend(samples)
-
-# Shuffle and create DataFrame
-random.shuffle(data)
-df = pd.DataFrame(data)
-
-# Save to CSV
-try:
-    logger.info(f"Saving {len(df)} samples to {output_path}")
-    df.to_csv(output_path, index=False)
-    logger.info(f"Successfully saved to {output_path}")
-    logger.info(f"Intents: {sorted(df['intent'].unique())}")
-    logger.info(f"Sample count per intent:\n{df['intent'].value_counts().to_dict()}")
-except Exception as e:
-    logger.error(f"Error saving CSV: {str(e)}")
-    raise
-
-# Verify file
-if os.path.exists(output_path):
-    logger.info(f"File verified at {output_path}")
-    logger.info(f"Total samples: {len(df)}")
-else:
-    logger.error(f"File not found at {output_path}")
-    raise FileNotFoundError(f"CSV not created at {output_path}")
\ No newline at end of file
+class CompiledTemplate:
+    """
+    A template split into literal parts around its placeholders. A
+    placeholder used twice gets the same value both times, as str.replace
+    did. Placeholders without variations stay as literal text.
+    """
+
+    def __init__(self, template, variations):
+        pieces = PLACEHOLDER.split(template)  # literal, name, literal, name, ..., literal
+        self.parts = [pieces[0]]
+        self.slots = []
+        self.occurrences = []  # slot index of each placeholder, in order
+        for name, literal in zip(pieces[1::2], pieces[2::2]):
+            if name not in variations:
+                self.parts[-1] += f"{{{name}}}{literal}"
+                continue
+            if name not in self.slots:
+                self.slots.append(name)
+            self.occurrences.append(self.slots.index(name))
+            self.parts.append(literal)
+        self.options = [np.array(variations[name]) for name in self.slots]
+        self.radices = np.array([len(options) for options in self.options], dtype=np.int64)
+        # Mixed-radix place values, last slot varying fastest
+        self.strides = np.ones(len(self.slots), dtype=np.int64)
+        for position in range(len(self.slots) - 2, -1, -1):
+            self.strides[position] = self.strides[position + 1] * self.radices[position + 1]
+        self.size = int(np.prod(self.radices))
+
+    def render(self, combos):
+        digits = (combos[:, None] // self.strides) % self.radices
+        out = np.full(len(combos), self.parts[0])
+        for position, slot in enumerate(self.occurrences):
+            out = np.char.add(np.char.add(out, self.options[slot][digits[:, slot]]), self.parts[position + 1])
+        return out
+
+
+class IntentSpace:
+    """All combinations of every template of one intent, numbered 0..size-1."""
+
+    def __init__(self, templates, variations):
+        self.templates = [CompiledTemplate(template, variations) for template in templates]
+        self.offsets = np.cumsum([0] + [template.size for template in self.templates])
+        self.size = int(self.offsets[-1])
+
+    def render(self, indices):
+        which = np.searchsorted(self.offsets, indices, side="right") - 1
+        out = np.empty(len(indices), dtype=object)
+        for template_index in np.unique(which):
+            mask = which == template_index
+            out[mask] = self.templates[template_index].render(indices[mask] - self.offsets[template_index])
+        return out
+
+
+_spaces = {}
+
+
+def intent_space(intent):
+    # Compiled once per process
+    if intent not in _spaces:
+        _spaces[intent] = IntentSpace(intents_templates[intent], variations)
+    return _spaces[intent]
+
+
+def select_indices(intent, quota, mode, dedup, seed):
+    """
+    Combination indices for one intent. Every intent has its own random
+    stream derived from the seed, so its rows don't depend on which other
+    intents are generated or how the work is sharded.
+    """
+    space = intent_space(intent)
+    rng = np.random.default_rng([seed, list(intents_templates).index(intent)])
+    if mode == "exhaustive" and (quota is None or quota >= space.size):
+        return np.arange(space.size, dtype=np.int64)
+    if dedup:
+        if quota > space.size:
+            logger.warning(f"{intent}: only {space.size} distinct queries, asked for {quota}")
+        return rng.choice(space.size, size=min(quota, space.size), replace=False).astype(np.int64)
+    return rng.integers(0, space.size, size=quota, dtype=np.int64)
+
+
+def build_units(selected, unit_rows=UNIT_ROWS):
+    # Unit k takes the k-th slice of every intent's indices, so each unit
+    # (and the output stream) mixes all intents
+    per_intent = max(1, unit_rows // max(1, len(selected)))
+    longest = max((len(indices) for indices in selected.values()), default=0)
+    return [
+        [(intent, indices[start:start + per_intent]) for intent, indices in selected.items()
+         if len(indices[start:start + per_intent])]
+        for start in range(0, longest, per_intent)
+    ]
+
+
+def render_unit(args):
+    unit_index, unit, seed, dedup, shuffle = args
+    df = pd.concat(
+        [pd.DataFrame({"query": intent_space(intent).render(indices), "intent": intent}) for intent, indices in unit],
+        ignore_index=True,
+    )
+    if dedup:
+        # Different combinations can still render the same text
+        df = df.drop_duplicates(["query", "intent"])
+    if shuffle:
+        df = df.sample(frac=1.0, random_state=np.random.default_rng([seed, unit_index, 1]))
+    return df.reset_index(drop=True)
+
+
+class ChunkWriter:
+    """
+    Streams DataFrames to a CSV or Parquet file next to `path`. `close`
+    renames it into place; `abort` deletes it, so a failed run never
+    replaces an existing output.
+    """
+
+    def __init__(self, path, fmt):
+        self.path = path
+        self.tmp = f"{path}.tmp"
+        self.fmt = fmt
+        self.rows = 0
+        self._file = open(self.tmp, "w", encoding="utf-8", newline="") if fmt == "csv" else None
+        self._parquet = None
+
+    def write(self, df):
+        if self.fmt == "csv":
+            df.to_csv(self._file, header=self.rows == 0, index=False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.tmp, table.schema)
+            self._parquet.write_table(table)
+        self.rows += len(df)
+
+    def _close_handles(self):
+        if self._file is not None:
+            self._file.close()
+        if self._parquet is not None:
+            self._parquet.close()
+
+    def close(self):
+        self._close_handles()
+        if self._parquet is None and self.fmt == "parquet":
+            pd.DataFrame({"query": [], "intent": []}).to_parquet(self.tmp, index=False)
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        self._close_handles()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+
+def parse_quotas(args, intents):
+    if args.total:
+        # Stratified: an equal share per intent, the remainder spread one row at a time
+        share, remainder = divmod(args.total, len(intents))
+        quotas = {intent: share + (position < remainder) for position, intent in enumerate(intents)}
+    else:
+        quotas = {intent: args.per_intent for intent in intents}
+    for item in args.quota:
+        intent, _, count = item.partition("=")
+        if intent not in quotas:
+            raise SystemExit(f"Unknown intent in --quota: {intent}")
+        quotas[intent] = int(count)
+    if args.mode == "exhaustive" and not (args.total or args.quota or args.per_intent_given):
+        quotas = {intent: None for intent in intents}
+    return quotas
+
+
+def generate(output, quotas, mode="sample", dedup=False, shuffle=True, seed=None, workers=1, shard=(0, 1),
+             fmt=None):
+    seed = secrets.randbits(32) if seed is None else seed
+    fmt = fmt or ("parquet" if str(output).endswith(".parquet") else "csv")
+    started = time.perf_counter()
+    selected = {intent: select_indices(intent, quota, mode, dedup, seed) for intent, quota in quotas.items()}
+    units = build_units(selected)
+    shard_index, shard_count = shard
+    jobs = [(index, unit, seed, dedup, shuffle) for index, unit in enumerate(units) if index % shard_count == shard_index]
+    rows = sum(len(indices) for job in jobs for _, indices in job[1])
+    logger.info(
+        f"Generating {rows:,} rows ({mode}, seed {seed}, {len(jobs)} of {len(units)} units, "
+        f"{workers} worker(s)) into {output}"
+    )
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    writer = ChunkWriter(output, fmt)
+    counts = pd.Series(dtype="int64")
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                chunks = executor.map(render_unit, jobs)
+                for df in chunks:
+                    writer.write(df)
+                    counts = counts.add(df["intent"].value_counts(), fill_value=0)
+        else:
+            for job in jobs:
+                df = render_unit(job)
+                writer.write(df)
+                counts = counts.add(df["intent"].value_counts(), fill_value=0)
+    except BaseException:
+        # Includes Ctrl-C: keep whatever was at `output` before this run
+        writer.abort()
+        raise
+    writer.close()
+    elapsed = time.perf_counter() - started
+    logger.info(f"Wrote {writer.rows:,} rows to {output} in {elapsed:.1f}s ({writer.rows / max(elapsed, 1e-9):,.0f} rows/s)")
+    per_intent = counts.astype(int).to_dict()
+    # Only a whole (unsharded) run can be held to the quotas
+    shortfall = {
+        intent: {"requested": quota, "written": per_intent.get(intent, 0)}
+        for intent, quota in quotas.items()
+        if quota is not None and shard_count == 1 and per_intent.get(intent, 0) < quota
+    }
+    return {"rows": writer.rows, "seed": seed, "seconds": elapsed, "per_intent": per_intent, "shortfall": shortfall}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic banking intent queries")
+    parser.add_argument("-o", "--output", default=output_path, help="A .csv or .parquet file")
+    parser.add_argument("--format", choices=["csv", "parquet"], help="Default: from the output file name")
+    parser.add_argument("--mode", default="sample", choices=["sample", "exhaustive"],
+                        help="exhaustive enumerates every combination unless a quota limits it")
+    parser.add_argument("--per-intent", type=int, help=f"Rows per intent (default {DEFAULT_PER_INTENT})")
+    parser.add_argument("--total", type=int, help="Total rows, split evenly across the intents")
+    parser.add_argument("--quota", action="append", default=[], help="intent=N for one intent (repeatable)")
+    parser.add_argument("--intents", help="Comma-separated intents to generate (default: all)")
+    parser.add_argument("--seed", type=int, help="Default: random, and logged so the run can be repeated")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Distinct queries only; intents with too few combinations fall short of their quota")
+    parser.add_argument("--no-shuffle", dest="shuffle", action="store_false")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--shard", default="0/1", help="INDEX/COUNT: generate only this share of the work")
+    parser.add_argument("--log-file", default=LOG_FILE)
+    args = parser.parse_args(argv)
+
+    handlers = [logging.StreamHandler()]
+    if args.log_file:
+        handlers.append(logging.FileHandler(args.log_file))
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s", handlers=handlers)
+
+    intents = args.intents.split(",") if args.intents else list(intents_templates)
+    unknown = [intent for intent in intents if intent not in intents_templates]
+    if unknown:
+        parser.error(f"Unknown intents: {', '.join(unknown)}")
+    args.per_intent_given = args.per_intent is not None
+    args.per_intent = args.per_intent or DEFAULT_PER_INTENT
+    shard_index, _, shard_count = args.shard.partition("/")
+    shard = (int(shard_index), int(shard_count or 1))
+    if not 0 <= shard[0] < shard[1]:
+        parser.error("--shard must be INDEX/COUNT with 0 <= INDEX < COUNT")
+
+    result = generate(args.output, parse_quotas(args, intents), args.mode, args.dedup, args.shuffle, args.seed,
+                      args.workers, shard, args.format)
+    logger.info(f"Intents: {sorted(result['per_intent'])}")
+    logger.info(f"Sample count per intent:\n{result['per_intent']}")
+    if result["shortfall"]:
+        requested = sum(entry["requested"] for entry in result["shortfall"].values())
+        written = sum(entry["written"] for entry in result["shortfall"].values())
+        logger.warning(
+            f"{len(result['shortfall'])} intent(s) came up short of their quota ({written:,} of {requested:,} rows); "
+            f"they have fewer distinct queries than asked for: "
+            + ", ".join(f"{intent} {entry['written']}/{entry['requested']}" for intent, entry in sorted(result["shortfall"].items()))
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
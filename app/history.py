@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from app import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationLog:
+    """
+    Per-session ring buffer of the most recent turns. Appends are O(1) and
+    every turn gets a monotonically increasing id within its session.
+    Sessions idle for longer than `ttl` seconds expire and the least recently
+    used ones are evicted beyond `max_sessions`, like InMemorySessionStore,
+    so callers that never reset don't grow the log forever. `on_evict` is
+    called with the id of every session dropped that way.
+    """
+
+    def __init__(self, max_messages, ttl=1800, max_sessions=100000, on_evict=None):
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.on_evict = on_evict
+        self._sessions = OrderedDict()  # session_id -> [turns, next_id, expires_at]
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        # Entries are kept in last-touched order, so expired ones are at the front
+        evicted = []
+        while self._sessions:
+            session_id, (_, _, expires_at) = next(iter(self._sessions.items()))
+            if expires_at >= now and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+            evicted.append(session_id)
+        return evicted
+
+    def append(self, session_id, sender, text):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[2] < now:
+                entry = self._sessions[session_id] = [deque(maxlen=self.max_messages), 0, 0.0]
+            turn_id = entry[1]
+            entry[0].append((turn_id, sender, text))
+            entry[1] = turn_id + 1
+            entry[2] = now + self.ttl
+            self._sessions.move_to_end(session_id)
+            evicted = self._evict(now)
+        self._notify(evicted)
+        return turn_id
+
+    def recent(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[2] < time.monotonic():
+                return []
+            return list(entry[0])
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def count(self):
+        with self._lock:
+            evicted = self._evict(time.monotonic())
+            count = len(self._sessions)
+        self._notify(evicted)
+        return count
+
+    def _notify(self, session_ids):
+        if self.on_evict is None:
+            return
+        for session_id in session_ids:
+            try:
+                self.on_evict(session_id)
+            except Exception as e:
+                logger.error(f"[ConversationLog] eviction of {session_id} failed: {e}")
+
+
+class VectorStoreWriter:
+    """
+    Applies Chroma writes on a single background thread so the request path
+    never waits for an embedding. Using one thread keeps adds and deletes for
+    a session in the order they were issued. `collection` may be a
+    zero-argument factory; it is then called on the writer thread before the
+    first operation, so importing and opening Chroma stays off the startup path.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection if not callable(collection) else None
+        self._factory = collection if callable(collection) else None
+        self._start()
+        # The writer thread doesn't exist in forked workers; give them their own
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chroma-writer")
+
+    def _run(self, name, fn, *args, **kwargs):
+        try:
+            with tracing.span(f"chroma.{name}"):
+                return fn(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"[VectorStoreWriter] {name} failed: {e}")
+            raise
+
+    @property
+    def collection(self):
+        # Only touched on the writer thread
+        if self._collection is None:
+            self._collection = self._factory()
+        return self._collection
+
+    def _call(self, name, *args, **kwargs):
+        return self._run(name, lambda: getattr(self.collection, name)(*args, **kwargs))
+
+    def open(self):
+        # Opens the collection in the background, e.g. during warm-up
+        return self._executor.submit(self._run, "open", lambda: self.collection)
+
+    def add(self, **kwargs):
+        return self._executor.submit(tracing.bind(self._call), "add", **kwargs)
+
+    def delete(self, **kwargs):
+        return self._executor.submit(tracing.bind(self._call), "delete", **kwargs)
+
+    def query(self, **kwargs):
+        # Queued behind pending writes so results include every earlier turn
+        return self._executor.submit(tracing.bind(self._call), "query", **kwargs).result()
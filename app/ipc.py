@@ -0,0 +1,98 @@
+import getpass
+import logging
+import os
+import secrets
+import socket
+import stat
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Addresses and authkeys for the multiprocessing managers behind the shared
+# intent cache and the socket session store. Managers unpickle whatever an
+# authenticated client sends, so nothing here has a built-in secret: by
+# default they listen on a Unix socket in a private (0700) runtime directory
+# and authenticate with a random key kept next to it (0600). The server
+# writes the key; workers running as the same user read it.
+
+
+def runtime_dir(path=""):
+    """
+    IVR_RUNTIME_DIR, else $XDG_RUNTIME_DIR/ivr, else <tmp>/ivr-<user>.
+    Created with mode 0700; refused if it is a symlink, belongs to another
+    user or is open to group/others.
+    """
+    if path:
+        directory = Path(path)
+    elif os.environ.get("XDG_RUNTIME_DIR"):
+        directory = Path(os.environ["XDG_RUNTIME_DIR"]) / "ivr"
+    else:
+        directory = Path(tempfile.gettempdir()) / f"ivr-{getpass.getuser()}"
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if os.name == "posix":
+        info = os.lstat(directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise PermissionError(f"{directory} must be a directory owned by this user with mode 0700")
+    return directory
+
+
+def parse_address(address):
+    # "host:port" for TCP on localhost, anything else is a Unix socket path
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def resolve_address(address, name, directory="", tcp_fallback=None):
+    # Empty means <runtime dir>/<name>.sock; Windows has no Unix sockets for
+    # multiprocessing, so it falls back to localhost TCP there
+    if address:
+        return parse_address(address)
+    if os.name == "nt":
+        return parse_address(tcp_fallback)
+    return str(runtime_dir(directory) / f"{name}.sock")
+
+
+def load_authkey(authkey, name, directory="", create=False):
+    """
+    The explicit key when one is configured, else the random key in
+    <runtime dir>/<name>.key. Only the server passes `create`; a client
+    started before the server gets a clear error instead of a guessable key.
+    """
+    if authkey:
+        return authkey.encode()
+    path = runtime_dir(directory) / f"{name}.key"
+    if create:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+            logger.info(f"Generated a new authkey in {path}")
+    try:
+        key = path.read_text().strip()
+    except FileNotFoundError:
+        raise RuntimeError(f"No authkey for {name}: start its server first or set the authkey explicitly") from None
+    if not key:
+        raise RuntimeError(f"{path} is empty")
+    return key.encode()
+
+
+def remove_stale_socket(address):
+    # A server that died leaves its socket file behind, which makes the next
+    # bind fail. Only remove it when nothing is listening on it any more.
+    if not isinstance(address, str) or not os.path.exists(address):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(address)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(address)
+    else:
+        raise RuntimeError(f"Another server is already listening on {address}")
+    finally:
+        probe.close()
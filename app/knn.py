@@ -0,0 +1,402 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from app.backends import MAX_SEQUENCE_LENGTH, load_backend, load_temperature, softmax
+
+logger = logging.getLogger(__name__)
+
+# Nearest-neighbour intent classifier over the labeled exemplar queries.
+# Every exemplar is embedded once into a contiguous row-major matrix on disk
+# (vectors.bin, memory-mapped at load) with its intent on the matching line
+# of labels.txt. A query is classified by cosine similarity against every
+# row and a weighted vote of the top k. New exemplars, including ones for a
+# brand-new intent, are appended to both files; nothing is retrained.
+#
+#   python -m app.knn build --csv app/data/banking_intents.csv
+#   python -m app.knn add --intent card_freeze --query "freeze my debit card"
+#   python -m app.knn evaluate
+
+KNN_DIR = "knn"
+VECTORS_FILE = "vectors.bin"
+LABELS_FILE = "labels.txt"
+INDEX_FILE = "index.json"
+DEFAULT_K = 10
+VOTE_TEMPERATURE = 0.05  # softmax temperature over the top-k similarities
+SEARCH_CHUNK_ROWS = 16384  # float16 rows upcast per matmul
+RELOAD_CHECK_SECONDS = 5.0
+DEFAULT_CSV = str(Path(__file__).parent / "data" / "banking_intents.csv")
+
+# Everything a query is scored against, swapped in as one object on reload
+IndexSnapshot = namedtuple("IndexSnapshot", ["vectors", "label_ids", "intents", "id2label"])
+
+
+class SentenceEncoder:
+    """
+    Mean-pooled, L2-normalised sentence embeddings from a transformer
+    encoder. By default this is the body of the fine-tuned intent model (the
+    classification head is ignored); any local sentence-transformers style
+    model directory works too.
+    """
+
+    def __init__(self, encoder_path, num_threads=0, batch_size=64):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self._torch = torch
+        self.encoder_path = str(Path(encoder_path).resolve())
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(self.encoder_path, local_files_only=True)
+        self.model = AutoModel.from_pretrained(self.encoder_path, local_files_only=True)
+        self.model.eval()
+        self.dim = self.model.config.hidden_size
+
+    def encode(self, texts):
+        chunks = []
+        for start in range(0, len(texts), self.batch_size):
+            encoded = self.tokenizer(
+                texts[start:start + self.batch_size], padding=True, truncation=True,
+                max_length=MAX_SEQUENCE_LENGTH, return_tensors="pt",
+            )
+            with self._torch.inference_mode():
+                hidden = self.model(**encoded).last_hidden_state
+            mask = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            chunks.append(self._torch.nn.functional.normalize(pooled, dim=-1).numpy())
+        return np.concatenate(chunks) if chunks else np.zeros((0, self.dim), dtype=np.float32)
+
+
+class ExemplarIndex:
+    """
+    The on-disk exemplar matrix. The row count is derived from the size of
+    vectors.bin, so a partly written append is ignored rather than misread.
+    A reload replaces `snapshot` with a single assignment; readers take it
+    once per call, so they never mix rows and labels from two loads.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        with open(self.directory / INDEX_FILE, "r") as f:
+            self.meta = json.load(f)
+        self.dim = self.meta["dim"]
+        self.dtype = np.dtype(self.meta["dtype"])
+        self._lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def create(cls, directory, dim, dtype="float16", encoder=""):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in (VECTORS_FILE, LABELS_FILE):
+            open(directory / name, "wb").close()
+        with open(directory / INDEX_FILE, "w") as f:
+            json.dump({"dim": dim, "dtype": np.dtype(dtype).name, "encoder": str(encoder)}, f, indent=2)
+        return cls(directory)
+
+    def _signature(self):
+        return tuple(os.stat(self.directory / name).st_size for name in (VECTORS_FILE, LABELS_FILE))
+
+    def _load(self):
+        row_bytes = self.dim * self.dtype.itemsize
+        with open(self.directory / LABELS_FILE, "r", encoding="utf-8", newline="") as f:
+            text = f.read()
+        # A last line without its newline is a torn write, not a label yet
+        labels = text[:text.rfind("\n") + 1].split("\n")[:-1]
+        rows = min(os.path.getsize(self.directory / VECTORS_FILE) // row_bytes, len(labels))
+        vectors = (
+            np.memmap(self.directory / VECTORS_FILE, dtype=self.dtype, mode="r", shape=(rows, self.dim))
+            if rows else np.zeros((0, self.dim), dtype=self.dtype)
+        )
+        # Intents are numbered in order of first appearance, so appending a
+        # new intent never renumbers the existing ones
+        intents = tuple(dict.fromkeys(labels[:rows]))
+        ids = {intent: i for i, intent in enumerate(intents)}
+        label_ids = np.array([ids[label] for label in labels[:rows]], dtype=np.int64)
+        self.snapshot = IndexSnapshot(vectors, label_ids, intents, {str(i): intent for i, intent in enumerate(intents)})
+        self._loaded = self._signature()
+
+    def reload_if_changed(self):
+        with self._lock:
+            if self._signature() != self._loaded:
+                self._load()
+                return True
+        return False
+
+    @property
+    def intents(self):
+        return self.snapshot.intents
+
+    def __len__(self):
+        return len(self.snapshot.label_ids)
+
+    def _truncate_torn_append(self):
+        """
+        Cuts off what a crashed append left behind: a last label line with
+        no newline, and vectors (written first) with no label. _load skips
+        both, but a new append must start right after the last complete row
+        or every later label would sit next to the wrong vector.
+        """
+        with open(self.directory / LABELS_FILE, "rb+") as f:
+            data = f.read()
+            complete = data.rfind(b"\n") + 1
+            if complete != len(data):
+                f.truncate(complete)
+        expected = data[:complete].count(b"\n") * self.dim * self.dtype.itemsize
+        vectors_path = self.directory / VECTORS_FILE
+        size = os.path.getsize(vectors_path)
+        if size < expected:
+            raise RuntimeError(f"{vectors_path} has fewer rows than {LABELS_FILE}; rebuild the index")
+        if size > expected:
+            logger.warning(f"Dropping {size - expected} bytes of unlabeled vectors left by an interrupted append")
+            os.truncate(vectors_path, expected)
+
+    def append(self, embeddings, labels):
+        if len(embeddings) != len(labels):
+            raise ValueError("Need one label per embedding")
+        if any("\n" in label or not label.strip() for label in labels):
+            raise ValueError("Labels must be non-empty single-line strings")
+        embeddings = np.ascontiguousarray(embeddings, dtype=self.dtype)
+        self._truncate_torn_append()
+        # Vectors first: a crash in between leaves extra vectors, which
+        # _load ignores and the next append truncates
+        with open(self.directory / VECTORS_FILE, "ab") as f:
+            f.write(embeddings.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.directory / LABELS_FILE, "a", encoding="utf-8") as f:
+            f.write("".join(f"{label}\n" for label in labels))
+            f.flush()
+            os.fsync(f.fileno())
+        self.reload_if_changed()
+
+    def search(self, queries, k=DEFAULT_K, snapshot=None):
+        """
+        Top-k exemplar rows and cosine similarities for each (normalised)
+        query. float16 matrices are upcast one chunk at a time.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        vectors = (snapshot or self.snapshot).vectors
+        if not len(vectors):
+            raise ValueError(f"The exemplar index in {self.directory} is empty. Add rows with: python -m app.knn add")
+        if self.dtype == np.float32:
+            sims = queries @ vectors.T
+        else:
+            sims = np.concatenate(
+                [queries @ vectors[start:start + SEARCH_CHUNK_ROWS].astype(np.float32).T
+                 for start in range(0, len(vectors), SEARCH_CHUNK_ROWS)],
+                axis=1,
+            )
+        k = min(k, sims.shape[1])
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        return top, np.take_along_axis(sims, top, axis=1)
+
+    def vote(self, queries, k=DEFAULT_K, temperature=VOTE_TEMPERATURE, snapshot=None):
+        """
+        Probability per intent: softmax over the top-k similarities, summed
+        per intent. Intents with no neighbour in the top k get 0. Columns
+        follow `snapshot.intents` (the current snapshot by default).
+        """
+        snapshot = snapshot or self.snapshot
+        top, sims = self.search(queries, k, snapshot)
+        weights = softmax(sims, temperature)
+        probs = np.zeros((len(top), len(snapshot.intents)), dtype=np.float32)
+        np.add.at(probs, (np.arange(len(top))[:, None], snapshot.label_ids[top]), weights)
+        return probs
+
+
+def knn_dir(model_path):
+    return Path(model_path) / KNN_DIR
+
+
+def build_index(model_path, csv_paths, encoder_path=None, dtype="float16", directory=None):
+    encoder = SentenceEncoder(encoder_path or model_path)
+    index = ExemplarIndex.create(directory or knn_dir(model_path), encoder.dim, dtype, encoder.encoder_path)
+    for csv_path in csv_paths:
+        add_exemplars(index, encoder, pd.read_csv(csv_path))
+    return index
+
+
+def add_exemplars(index, encoder, df, batch_rows=4096):
+    df = df.dropna(subset=["query", "intent"])
+    for start in range(0, len(df), batch_rows):
+        batch = df.iloc[start:start + batch_rows]
+        index.append(encoder.encode(batch["query"].tolist()), batch["intent"].astype(str).str.strip().tolist())
+    logger.info(f"Index {index.directory} now holds {len(index)} exemplars for {len(index.intents)} intents")
+    return len(df)
+
+
+class KnnBackend:
+    """
+    Serves the exemplar index behind classify_intent. `labelled_logits`
+    returns the id2label of the index snapshot each batch was scored
+    against, so intents appended after the model was trained are returned
+    by name; appends are picked up without a restart.
+    """
+
+    name = "knn"
+
+    def __init__(self, model_path, k=DEFAULT_K, encoder_path=None, num_threads=0):
+        directory = knn_dir(model_path)
+        if not (directory / INDEX_FILE).exists():
+            raise FileNotFoundError(f"{directory} has no exemplar index. Build it with: python -m app.knn build")
+        self.index = ExemplarIndex(directory)
+        self.encoder = SentenceEncoder(encoder_path or self.index.meta["encoder"] or model_path, num_threads)
+        if self.encoder.dim != self.index.dim:
+            raise ValueError(f"Encoder produces {self.encoder.dim}-dim vectors, the index holds {self.index.dim}")
+        self.tokenizer = self.encoder.tokenizer
+        self.k = k
+        self.temperature = load_temperature(model_path)
+        self._checked = time.monotonic()
+
+    def after_fork(self, num_threads=0):
+        if num_threads:
+            self.encoder._torch.set_num_threads(num_threads)
+
+    def logits(self, texts):
+        return self.labelled_logits(texts)[0]
+
+    def labelled_logits(self, texts):
+        now = time.monotonic()
+        if now - self._checked >= RELOAD_CHECK_SECONDS:
+            self._checked = now
+            if self.index.reload_if_changed():
+                logger.info(f"Reloaded exemplar index: {len(self.index)} rows, {len(self.index.intents)} intents")
+        snapshot = self.index.snapshot
+        probs = self.index.vote(self.encoder.encode(list(texts)), self.k, snapshot=snapshot)
+        # Like the cascade backend: log-probabilities scaled so that app.nlp's
+        # temperature softmax gives back the vote shares
+        return np.log(probs + 1e-12) * self.temperature, snapshot.id2label
+
+
+def evaluate(model_path, csv_path=None, head_backend="pytorch", k=DEFAULT_K, dtype="float16",
+             timing_samples=200, train_csv=None):
+    """
+    Builds a throwaway index from the model's training split and compares
+    kNN with the transformer classification head on rows neither the head
+    nor the encoder was fine-tuned on: `csv_path`, or by default the test
+    split app/model.py kept out of training. Reports accuracy, per-query
+    latency (single-query calls) and batched throughput.
+    """
+    from app.preprocess import evaluation_rows, held_out_split
+
+    with open(Path(model_path) / "label2id.json", "r") as f:
+        label2id = json.load(f)
+    id2label = {v: k for k, v in label2id.items()}
+    train_df, _, _ = held_out_split(model_path, train_csv)
+    train_df = train_df.drop_duplicates(["query", "intent"])  # Oversampled copies would weigh twice in the vote
+    test_df, source = evaluation_rows(model_path, csv_path, train_csv)
+    test_df = test_df[test_df["intent"].isin(label2id)]
+    if test_df.empty:
+        raise ValueError(f"{source} has no rows with intents known to the model")
+    logger.info(f"Evaluating on {source}")
+    texts, expected = test_df["query"].astype(str).tolist(), test_df["intent"].to_numpy()
+
+    encoder = SentenceEncoder(model_path)
+    with tempfile.TemporaryDirectory(prefix="ivr-knn-") as directory:
+        index = ExemplarIndex.create(directory, encoder.dim, dtype, model_path)
+        started = time.perf_counter()
+        add_exemplars(index, encoder, train_df)
+        build_seconds = time.perf_counter() - started
+
+        def knn_predict(batch):
+            return [index.intents[i] for i in index.vote(encoder.encode(batch), k).argmax(axis=-1)]
+
+        head = load_backend(head_backend, model_path)
+
+        def head_predict(batch):
+            return [id2label.get(int(i), str(i)) for i in head.logits(batch).argmax(axis=-1)]
+
+        results = {}
+        for name, predict in (("knn", knn_predict), (head_backend, head_predict)):
+            predict(texts[:8])  # Warm up
+            started = time.perf_counter()
+            predicted = np.concatenate([predict(texts[i:i + 64]) for i in range(0, len(texts), 64)])
+            batched = time.perf_counter() - started
+            latencies = []
+            for text in texts[:timing_samples]:
+                started = time.perf_counter()
+                predict([text])
+                latencies.append((time.perf_counter() - started) * 1000)
+            results[name] = {
+                "accuracy": round(float((predicted == expected).mean()), 4),
+                "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+                "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+                "queries_per_second_batched": round(len(texts) / batched, 1),
+            }
+        index_bytes = os.path.getsize(Path(directory) / VECTORS_FILE)
+
+    return {
+        "evaluated_on": source,
+        "exemplars": len(train_df),
+        "test_queries": len(texts),
+        "k": k,
+        "dtype": dtype,
+        "index_mb": round(index_bytes / 1e6, 2),
+        "build_seconds": round(build_seconds, 2),
+        "results": results,
+    }
+
+
+def main(argv=None):
+    from app.config import KNN_K, MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="Build and evaluate the nearest-neighbour intent index")
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Embed every exemplar into a new index")
+    build.add_argument("--csv", action="append", help="Labeled queries (repeatable; default banking_intents.csv)")
+    build.add_argument("--encoder", help="Encoder model directory (default: the intent model)")
+    build.add_argument("--dtype", default="float16", choices=["float16", "float32"])
+
+    add = sub.add_parser("add", help="Append exemplars to the index")
+    add.add_argument("--csv", help="CSV with query and intent columns")
+    add.add_argument("--intent")
+    add.add_argument("--query", action="append", default=[], help="Exemplar for --intent (repeatable)")
+
+    evaluation = sub.add_parser("evaluate", help="Compare kNN with the transformer head on held-out data")
+    evaluation.add_argument("--csv", help="Held-out labeled CSV (default: the test split model.py kept out of training)")
+    evaluation.add_argument("--train-csv", help="CSV the model was trained on, if it has no training_data.json")
+    evaluation.add_argument("--backend", default="pytorch", choices=["pytorch", "onnx", "onnx-int8", "snapshot"])
+    evaluation.add_argument("--k", type=int, default=KNN_K)
+    evaluation.add_argument("--dtype", default="float16", choices=["float16", "float32"])
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    if args.command == "build":
+        index = build_index(args.model_path, args.csv or [DEFAULT_CSV], args.encoder, args.dtype)
+        print(f"Wrote {len(index)} exemplars for {len(index.intents)} intents to {index.directory}")
+        return 0
+
+    if args.command == "add":
+        if args.csv:
+            df = pd.read_csv(args.csv)
+        elif args.intent and args.query:
+            df = pd.DataFrame({"query": args.query, "intent": args.intent})
+        else:
+            parser.error("add needs --csv, or --intent with at least one --query")
+        index = ExemplarIndex(knn_dir(args.model_path))
+        added = add_exemplars(index, SentenceEncoder(index.meta["encoder"] or args.model_path), df)
+        print(f"Added {added} exemplars; the index now holds {len(index)} for {len(index.intents)} intents")
+        return 0
+
+    print(json.dumps(evaluate(args.model_path, args.csv, args.backend, args.k, args.dtype,
+                              train_csv=args.train_csv), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,170 @@
+import atexit
+import json
 import logging
-from datetime import datetime
+import logging.handlers
+import os
+import queue
+import re
+import threading
 
-logging.basicConfig(
-    filename='ivr_logs.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(message)s'
+from app import metrics
+from app.tracing import current_trace_id
+from app.config import LOG_LEVEL, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE
+
+# Request-path logging. Records are put on a queue and written as JSON lines
+# by a background thread, so request threads never wait on file I/O.
+#
+#   intent_classifier.log  application logs (root logger)
+#   ivr_logs.log           one record per handled query (log_query_response)
+
+WRITE_BATCH_SIZE = 512  # most records written with one write() call
+SHED_DEBUG_RATIO = 0.5  # drop DEBUG records once the queue is this full
+
+shed_records = metrics.counter(
+    "log_records_dropped_total", "Log records dropped before being written", labels={"reason": "shed_debug"}
+)
+dropped_records = metrics.counter(
+    "log_records_dropped_total", "Log records dropped before being written", labels={"reason": "queue_full"}
 )
 
-def log_query_response(query, intent, response, confidence):
-    logging.info(f"Query: {query} | Intent: {intent} | Confidence: {confidence:.2f} | Response: {response}")
+
+def mask_sensitive_data(text):
+    return re.sub(r'\d{12,}', '******', text)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line. Structured fields passed as
+    `extra={"fields": {...}}` are merged into the record; account and card
+    numbers are masked in the message and in string fields.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": mask_sensitive_data(record.getMessage()),
+        }
+        for key, value in getattr(record, "fields", {}).items():
+            entry[key] = mask_sensitive_data(value) if isinstance(value, str) else value
+        return json.dumps(entry, default=str)
+
+
+class BatchingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Size-rotated file handler that writes a list of records with a single
+    write and flush.
+    """
+
+    def emit_batch(self, records):
+        try:
+            data = "".join(self.format(record) + self.terminator for record in records)
+            with self.lock:
+                if self.stream is None:
+                    self.stream = self._open()
+                position = self.stream.tell()
+                if self.maxBytes > 0 and position > 0 and position + len(data) >= self.maxBytes:
+                    self.doRollover()
+                self.stream.write(data)
+                self.stream.flush()
+        except Exception:
+            self.handleError(records[0])
+
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """
+    Non-blocking front end for a BatchingFileHandler. `emit` only enqueues;
+    a daemon thread drains the queue and writes whatever has accumulated in
+    one batch. DEBUG records are shed when the queue is half full, and
+    anything is dropped (and counted) rather than block when it is full.
+    """
+
+    def __init__(self, target, queue_size=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(queue_size))
+        self.target = target
+        self.queue_size = queue_size
+        self._writer = None
+        self._pid = os.getpid()
+        self._writer_lock = threading.Lock()
+        atexit.register(self.drain)
+
+    def enqueue(self, record):
+        self._ensure_writer()
+        if record.levelno < logging.INFO and self.queue.qsize() >= self.queue_size * SHED_DEBUG_RATIO:
+            shed_records.inc()
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records.inc()
+
+    def _ensure_writer(self):
+        if self._writer is not None and self._writer.is_alive() and self._pid == os.getpid():
+            return
+        with self._writer_lock:
+            if self._pid != os.getpid():
+                # Forked child: the parent's queue lock may have been held at fork time
+                self.queue = queue.Queue(self.queue_size)
+                self._pid = os.getpid()
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._writer.start()
+
+    def _take_batch(self, block):
+        batch = [self.queue.get(block=block)]
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            self.target.emit_batch(self._take_batch(block=True))
+
+    def drain(self):
+        # Write out whatever is still queued, e.g. at interpreter exit
+        while True:
+            try:
+                batch = self._take_batch(block=False)
+            except queue.Empty:
+                return
+            self.target.emit_batch(batch)
+
+
+def create_handler(filename):
+    target = BatchingFileHandler(filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    target.setFormatter(JsonFormatter())
+    return AsyncLogHandler(target)
+
+
+def configure_logging(filename="intent_classifier.log"):
+    root = logging.getLogger()
+    if not any(isinstance(handler, AsyncLogHandler) for handler in root.handlers):
+        root.addHandler(create_handler(filename))
+    root.setLevel(LOG_LEVEL)
+
+
+request_logger = logging.getLogger("ivr.requests")
+request_logger.propagate = False
+request_logger.setLevel(logging.INFO)
+if not request_logger.handlers:
+    request_logger.addHandler(create_handler("ivr_logs.log"))
+
+
+def log_query_response(query, intent, response, confidence, session_id=None, latency_ms=None):
+    """
+    Logs one handled query. `latency_ms` maps a stage name to its duration
+    in milliseconds, e.g. {"classify": 12.1, "route": 80.4, "total": 93.0}.
+    """
+    request_logger.info("query handled", extra={"fields": {
+        "trace_id": current_trace_id(),
+        "session_id": session_id,
+        "query": query,
+        "intent": intent,
+        "confidence": round(float(confidence), 4),
+        "response": response,
+        "latency_ms": {stage: round(ms, 2) for stage, ms in (latency_ms or {}).items()},
+    }})
@@ -1,5 +1,10 @@
-from flask import Flask, request, jsonify
-from app.nlp import process_user_query  # Function to classify intent
+import time
+
+from flask import Flask, Response, request, jsonify
+from app import metrics, startup, tracing
+from app.nlp import process_user_query, classify_intents, session_store, warm_up, prefetcher, DIALOGUE_INTENTS  # Function to classify intent
+from app.config import WARM_UP
+from app.batch_request import parse_batch_request
 from app.router import AutoGenRouter
 from app.log_util import log_query_response
 
@@ -9,6 +14,10 @@ router = AutoGenRouter()
 
 CONFIDENCE_THRESHOLD = 0.5  # Must match the threshold in your nlp.py
 
+# Serve straight away; /readyz reports 503 until the first inference has run
+if WARM_UP == "background":
+    startup.warm_up_in_background(warm_up)
+
 @app.route("/predict_intent", methods=["POST"])
 def predict_intent():
     data = request.json
@@ -18,17 +27,35 @@ def predict_intent():
     if not query:
         return jsonify({"error": "Query is required"}), 400
 
-    # Step 1: Classify the query
-    intent, confidence, action_response = process_user_query(query, session_id)
+    # Continues the caller's trace when the payload carries a traceparent
+    with tracing.span("api.predict_intent", traceparent=data.get("traceparent")) as request_span:
+        started = time.perf_counter()
+        # Session state is read once and written back once for the whole request
+        with session_store.batch():
+            try:
+                # Step 1: Classify the query
+                intent, confidence, action_response = process_user_query(query, session_id)
+                classified = time.perf_counter()
 
-    # Step 2: Route to tool if confidence is high
-    if confidence >= CONFIDENCE_THRESHOLD:
-        final_response = router.route(query, intent, confidence)
-    else:
-        final_response = action_response  # fallback response
+                # Step 2: Route to tool if confidence is high. Multi-turn flows were
+                # already advanced by process_user_query, so they aren't routed again.
+                if confidence >= CONFIDENCE_THRESHOLD and intent not in DIALOGUE_INTENTS:
+                    final_response = router.route(query, intent, confidence, session_id)
+                else:
+                    final_response = action_response  # fallback response
+                routed = time.perf_counter()
+            finally:
+                # Prefetches this turn didn't use must not reach the next one
+                if prefetcher:
+                    prefetcher.end_turn(session_id)
+        request_span.set("intent", intent)
 
-    # Step 3: Log and return the result
-    log_query_response(query, intent, final_response, confidence)
+        # Step 3: Log and return the result
+        log_query_response(query, intent, final_response, confidence, session_id, latency_ms={
+            "classify": (classified - started) * 1000,
+            "route": (routed - classified) * 1000,
+            "total": (time.perf_counter() - started) * 1000,
+        })
 
     return jsonify({
         "query": query,
@@ -37,5 +64,30 @@ def predict_intent():
         "response": final_response
     })
 
+@app.route("/predict_intent/batch", methods=["POST"])
+def predict_intent_batch():
+    queries, top_k, error = parse_batch_request(request.json)
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Scores only: no session state, routing or tool calls
+    return jsonify({"results": classify_intents(queries, top_k)})
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render_prometheus(), mimetype="text/plain")
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    # Liveness: the process is up and serving HTTP
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    # Readiness: the model has answered its warm-up query
+    if not startup.ready.is_set():
+        return jsonify({"status": "warming up"}), 503
+    return jsonify({"status": "ready"})
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,148 @@
+import bisect
+import threading
+
+# Lightweight in-process metrics. Values are rendered in the Prometheus text
+# exposition format by the /metrics endpoint in app/main.py. Metrics that
+# share a name and differ only by labels are rendered as one family.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labels, extra=None):
+    items = list((labels or {}).items()) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class Counter:
+    type_name = "counter"
+
+    def __init__(self, name, help_text="", labels=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def samples(self):
+        return [f"{self.name}{_format_labels(self.labels)} {self._value}"]
+
+
+class Gauge:
+    type_name = "gauge"
+
+    def __init__(self, name, help_text="", fn=None, labels=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self._value = 0
+        self._fn = fn
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        return self._fn() if self._fn else self._value
+
+    def samples(self):
+        return [f"{self.name}{_format_labels(self.labels)} {self.value}"]
+
+
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name, help_text="", buckets=DEFAULT_BUCKETS, labels=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        counts, _, total = self.snapshot()
+        if total == 0:
+            return 0.0
+        target = q * total
+        running = 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            if running >= target:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        counts, total_sum, total = self.snapshot()
+        lines = []
+        running = 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, {'le': bound})} {running}")
+        lines.append(f"{self.name}_bucket{_format_labels(self.labels, {'le': '+Inf'})} {total}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels)} {total_sum}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels)} {total}")
+        return lines
+
+
+def _register(metric):
+    key = (metric.name, tuple(sorted(metric.labels.items())))
+    with _registry_lock:
+        existing = _registry.get(key)
+        if existing is not None:
+            return existing
+        _registry[key] = metric
+        return metric
+
+
+def counter(name, help_text="", labels=None):
+    return _register(Counter(name, help_text, labels))
+
+
+def gauge(name, help_text="", fn=None, labels=None):
+    return _register(Gauge(name, help_text, fn, labels))
+
+
+def histogram(name, help_text="", buckets=DEFAULT_BUCKETS, labels=None):
+    return _register(Histogram(name, help_text, buckets, labels))
+
+
+def render_prometheus():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    families = {}
+    for metric in metrics:
+        families.setdefault(metric.name, []).append(metric)
+    lines = []
+    for name, family in families.items():
+        lines.append(f"# HELP {name} {family[0].help_text}")
+        lines.append(f"# TYPE {name} {family[0].type_name}")
+        for metric in family:
+            lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
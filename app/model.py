@@ -2,143 +2,131 @@ import json
 import logging
 import os
 import sys
-import pandas as pd
-import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, Trainer, TrainingArguments, get_linear_schedule_with_warmup
-from datasets import Dataset
+import time
 import traceback
+from contextlib import contextmanager
+
+import numpy as np
 from sklearn.metrics import accuracy_score, precision_recall_fscore_support
 
-# Set up logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("D:/IVR Case-02/training.log"),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from app.preprocess import prepare_dataset, write_training_data
+
 logger = logging.getLogger(__name__)
 
-# Define save directory
-save_dir = "D:/IVR Case-02/banking-intents-minilm"
-logger.info(f"Using save directory: {save_dir}")
-
-# Check directory
-try:
-    logger.info(f"Creating/checking save directory: {save_dir}")
-    os.makedirs(save_dir, exist_ok=True)
-    test_file = os.path.join(save_dir, "test.txt")
-    with open(test_file, "w") as f:
-        f.write("test")
-    os.remove(test_file)
-    logger.info("Directory is writable")
-except Exception as e:
-    logger.error(f"Directory error: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
-
-# Load dataset
-csv_path = "D:/IVR Case-02/app/data/banking_intents.csv"
-try:
-    logger.info(f"Loading dataset from {csv_path}")
-    df = pd.read_csv(csv_path)
-
-    logger.info("Class distribution (before balancing):")
-    logger.info(df["intent"].value_counts())
-
-    if not {"query", "intent"}.issubset(df.columns):
-        logger.error("Dataset missing 'query' or 'intent' columns")
-        raise ValueError("CSV must have 'query' and 'intent' columns")
-    if df["query"].isnull().any() or df["intent"].isnull().any():
-        logger.error("Dataset contains null values")
-        raise ValueError("Dataset contains null values")
-    logger.info(f"Dataset loaded with {len(df)} rows")
-    logger.info(f"Unique intents: {len(df['intent'].unique())}")
-except Exception as e:
-    logger.error(f"Dataset load error: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
-
-# Balance classes by oversampling
-try:
-    logger.info("Balancing classes")
-    intent_counts = df["intent"].value_counts()
-    max_count = intent_counts.max()  # Target ~40 samples per intent
-    balanced_data = {"query": [], "intent": []}
-    for intent in df["intent"].unique():
-        intent_df = df[df["intent"] == intent]
-        if len(intent_df) < max_count:
-            oversampled = intent_df.sample(n=max_count - len(intent_df), replace=True, random_state=42)
-            balanced_data["query"].extend(intent_df["query"].tolist() + oversampled["query"].tolist())
-            balanced_data["intent"].extend([intent] * max_count)
-        else:
-            balanced_data["query"].extend(intent_df["query"].tolist())
-            balanced_data["intent"].extend([intent] * len(intent_df))
-    df = pd.DataFrame(balanced_data)
-    logger.info("Class distribution (after balancing):")
-    logger.info(df["intent"].value_counts())
-    logger.info(f"Balanced dataset size: {len(df)}")
-except Exception as e:
-    logger.error(f"Class balancing error: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
-
-# Encode labels
-try:
-    logger.info("Encoding labels")
-    labels = sorted(df["intent"].unique())
-    label2id = {label: idx for idx, label in enumerate(labels)}
-    id2label = {idx: label for label, idx in label2id.items()}
-    df["label"] = df["intent"].map(label2id)
-    logger.info(f"Labels: {labels}")
-    logger.info(f"Label2id: {label2id}")
-except Exception as e:
-    logger.error(f"Label encoding error: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
-
-# Initialize tokenizer and model
-model_name = "distilbert-base-uncased"
-try:
-    logger.info(f"Loading model: {model_name}")
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSequenceClassification.from_pretrained(
-        model_name,
-        num_labels=len(labels),
-        id2label=id2label,
-        label2id=label2id
+# Fine-tunes the intent classifier. `python -m app.model` trains once with
+# the defaults below; app/sweep.py calls train() for each trial of a
+# hyperparameter sweep.
+
+SAVE_DIR = "D:/IVR Case-02/banking-intents-minilm"
+LOG_FILE = "D:/IVR Case-02/training.log"
+LOGGING_DIR = "D:/IVR Case-02/logs"
+MODEL_NAME = "distilbert-base-uncased"
+
+# Training data (IVR_TRAIN_CSV can point at banking_intents_expanded.csv)
+CSV_PATH = os.environ.get("IVR_TRAIN_CSV", "D:/IVR Case-02/app/data/banking_intents.csv")
+
+# Tokenization settings. "dynamic" pads each batch to its longest query
+# and groups similar lengths together; "max_length" pads everything to
+# MAX_LENGTH like before. MAX_LENGTH "auto" derives it from the dataset.
+PADDING = os.environ.get("IVR_TRAIN_PADDING", "dynamic")
+MAX_LENGTH = os.environ.get("IVR_TRAIN_MAX_LENGTH", "auto")
+MAX_LENGTH_PERCENTILE = float(os.environ.get("IVR_TRAIN_MAX_LENGTH_PERCENTILE", "99.5"))
+
+# Defaults for train(); every one can be overridden per sweep trial
+HYPERPARAMETERS = {
+    "learning_rate": 3e-5,
+    "batch_size": 8,
+    "epochs": 10,
+    "weight_decay": 0.01,
+    "warmup_ratio": 0.1,
+}
+
+
+def setup_logging(log_file=LOG_FILE, level=logging.DEBUG):
+    logging.basicConfig(
+        level=level,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[logging.FileHandler(log_file), logging.StreamHandler(sys.stdout)],
     )
-    logger.info("Model and tokenizer loaded")
-except Exception as e:
-    logger.error(f"Model load error: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
-
-# Tokenization function
-def tokenize_function(batch):
-    return tokenizer(batch["query"], padding="max_length", truncation=True, max_length=256)
-
-# Convert to Dataset
-try:
-    logger.info("Converting to Hugging Face Dataset")
-    dataset = Dataset.from_pandas(df)
-    logger.info(f"Dataset columns: {dataset.column_names}")
-    dataset = dataset.map(tokenize_function, batched=True)
-    dataset = dataset.train_test_split(test_size=0.2, seed=42)
-    dataset.set_format(type="torch", columns=["input_ids", "attention_mask", "label"])
-    logger.info(f"Train dataset size: {len(dataset['train'])}")
-    logger.info(f"Test dataset size: {len(dataset['test'])}")
-except Exception as e:
-    logger.error(f"Dataset processing error: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
-
-# Compute metrics
+
+
+@contextmanager
+def step(description):
+    # Every stage logs its own failure with the traceback before re-raising
+    try:
+        yield
+    except Exception as e:
+        logger.error(f"{description} error: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise
+
+
+def check_save_dir(save_dir):
+    with step("Directory"):
+        logger.info(f"Creating/checking save directory: {save_dir}")
+        os.makedirs(save_dir, exist_ok=True)
+        test_file = os.path.join(save_dir, "test.txt")
+        with open(test_file, "w") as f:
+            f.write("test")
+        os.remove(test_file)
+        logger.info("Directory is writable")
+
+
+def training_arguments(**kwargs):
+    """
+    TrainingArguments across transformers releases: newer ones replaced
+    group_by_length with train_sampling_strategy and dropped logging_dir.
+    """
+    from transformers import TrainingArguments
+
+    fields = TrainingArguments.__dataclass_fields__
+    if "group_by_length" not in fields and "train_sampling_strategy" in fields:
+        kwargs["train_sampling_strategy"] = "group_by_length" if kwargs.pop("group_by_length") else "random"
+    if "logging_dir" not in fields:
+        kwargs.pop("logging_dir", None)
+    if "eval_strategy" not in fields and "eval_strategy" in kwargs:
+        kwargs["evaluation_strategy"] = kwargs.pop("eval_strategy")
+    return TrainingArguments(**kwargs)
+
+
+def make_trainer_callback():
+    from transformers import TrainerCallback
+
+    # Report wall-clock time and throughput for every epoch
+    class EpochThroughputCallback(TrainerCallback):
+        def __init__(self, tokens_per_epoch, padded_tokens_per_epoch, padding):
+            self.tokens_per_epoch = tokens_per_epoch
+            self.padded_tokens_per_epoch = padded_tokens_per_epoch
+            self.padding = padding
+            self.epoch_started = None
+            self.epoch_times = []
+
+        def on_epoch_begin(self, args, state, control, **kwargs):
+            self.epoch_started = time.perf_counter()
+
+        def on_epoch_end(self, args, state, control, **kwargs):
+            elapsed = time.perf_counter() - self.epoch_started
+            self.epoch_times.append(elapsed)
+            logger.info(
+                f"Epoch {state.epoch:.0f}: {elapsed:.1f}s, {self.tokens_per_epoch / elapsed:,.0f} tokens/sec "
+                f"({self.padded_tokens_per_epoch / elapsed:,.0f} incl. padding)"
+            )
+
+        def on_train_end(self, args, state, control, **kwargs):
+            if self.epoch_times:
+                total = sum(self.epoch_times)
+                logger.info(
+                    f"Training wall-clock: {total:.1f}s over {len(self.epoch_times)} epochs "
+                    f"({total / len(self.epoch_times):.1f}s/epoch, padding={self.padding})"
+                )
+
+    return EpochThroughputCallback
+
+
 def compute_metrics(pred):
     labels = pred.label_ids
     preds = pred.predictions.argmax(-1)
-    precision, recall, f1, _ = precision_recall_fscore_support(labels, preds, average='weighted')
+    precision, recall, f1, _ = precision_recall_fscore_support(labels, preds, average='weighted', zero_division=0)
     acc = accuracy_score(labels, preds)
     return {
         'accuracy': acc,
@@ -147,107 +135,168 @@ def compute_metrics(pred):
         'recall': recall
     }
 
-# Define training arguments
-try:
-    logger.info("Setting training arguments")
-    training_args = TrainingArguments(
-        output_dir=save_dir,
-        per_device_train_batch_size=8,
-        per_device_eval_batch_size=8,
-        num_train_epochs=10,  # Increased for better convergence
-        learning_rate=3e-5,
-        weight_decay=0.01,
-        logging_dir="D:/IVR Case-02/logs",
-        logging_steps=10,
-        do_eval=True,  # Enable evaluation at epoch boundaries
-        save_strategy="epoch",  # Save at epoch boundaries
-        save_total_limit=1
-    )
-except Exception as e:
-    logger.error(f"Training args error: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
-
-# Initialize Trainer
-try:
-    logger.info("Initializing Trainer")
-    trainer = Trainer(
-        model=model,
-        args=training_args,
-        train_dataset=dataset["train"],
-        eval_dataset=dataset["test"],
-        tokenizer=tokenizer,
-        compute_metrics=compute_metrics
-    )
-except Exception as e:
-    logger.error(f"Trainer init error: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
-
-# Configure learning rate scheduler
-try:
-    num_training_steps = len(trainer.train_dataset) * training_args.num_train_epochs // training_args.per_device_train_batch_size
-    warmup_steps = int(0.1 * num_training_steps)
-    optimizer = torch.optim.AdamW(model.parameters(), lr=training_args.learning_rate, weight_decay=training_args.weight_decay)
-    lr_scheduler = get_linear_schedule_with_warmup(
-        optimizer,
-        num_warmup_steps=warmup_steps,
-        num_training_steps=num_training_steps
+
+def padded_tokens(lengths, batch_size, padding, max_length):
+    if padding == "dynamic":
+        # Length grouping sorts similar queries together, so each batch pads
+        # to roughly its own longest query
+        num_batches = max(1, len(lengths) // batch_size)
+        batches = np.array_split(np.sort(lengths), num_batches)
+        return int(sum(batch.max() * len(batch) for batch in batches))
+    return len(lengths) * max_length
+
+
+def save_model(trainer, tokenizer, save_dir, label2id):
+    import torch
+
+    with step("Save"):
+        logger.info(f"Saving model to {save_dir}")
+        trainer.save_model(save_dir)
+        tokenizer.save_pretrained(save_dir)
+        saved_files = os.listdir(save_dir)
+        logger.info(f"Saved files: {saved_files}")
+        model_bin_path = os.path.join(save_dir, "pytorch_model.bin")
+        if not os.path.exists(model_bin_path):
+            logger.warning("pytorch_model.bin not found, attempting direct model save")
+            torch.save(trainer.model.state_dict(), model_bin_path)
+            logger.info("Model saved directly via torch.save")
+        if not os.path.exists(model_bin_path):
+            raise FileNotFoundError("pytorch_model.bin not saved in save_dir")
+        logger.info("pytorch_model.bin successfully saved")
+
+    with step("Label saving"):
+        id2label = {idx: label for label, idx in label2id.items()}
+        with open(os.path.join(save_dir, "label2id.json"), "w") as f:
+            json.dump(label2id, f)
+        with open(os.path.join(save_dir, "id2label.json"), "w") as f:
+            json.dump(id2label, f)
+        logger.info("Label mappings saved")
+
+
+def train(save_dir=SAVE_DIR, csv_path=CSV_PATH, model_name=MODEL_NAME, learning_rate=3e-5, batch_size=8,
+          epochs=10, weight_decay=0.01, warmup_ratio=0.1, padding=PADDING, max_length=MAX_LENGTH,
+          max_length_percentile=MAX_LENGTH_PERCENTILE, seed=42, early_stopping_patience=None,
+          early_stopping_threshold=0.0, logging_dir=LOGGING_DIR, report_to=None):
+    """
+    Fine-tunes `model_name` on the CSV and saves the model, tokenizer and
+    label maps to `save_dir`. With `early_stopping_patience`, the model is
+    evaluated every epoch, training stops once eval F1 hasn't improved by
+    more than `early_stopping_threshold` for that many epochs, and the best
+    epoch is the one saved. Returns the final evaluation metrics.
+    """
+    import torch
+    from transformers import (
+        AutoModelForSequenceClassification, AutoTokenizer, DataCollatorWithPadding, EarlyStoppingCallback,
+        Trainer, get_linear_schedule_with_warmup,
     )
-    trainer.optimizer = optimizer
-    trainer.lr_scheduler = lr_scheduler
-except Exception as e:
-    logger.error(f"LR Scheduler setup error: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
-
-# Train the model
-try:
-    logger.info("Starting training")
-    trainer.train()
-    logger.info("Training complete")
-    eval_results = trainer.evaluate()
-    logger.info(f"Final evaluation results: {eval_results}")
-except Exception as e:
-    logger.error(f"Training error: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
-
-# Save the model explicitly
-try:
-    logger.info(f"Saving model to {save_dir}")
-    trainer.save_model(save_dir)
-    tokenizer.save_pretrained(save_dir)
-    logger.info("Checking saved files after trainer.save_model")
-    saved_files = os.listdir(save_dir)
-    logger.info(f"Saved files: {saved_files}")
-    model_bin_path = os.path.join(save_dir, "pytorch_model.bin")
-    if not os.path.exists(model_bin_path):
-        logger.warning("pytorch_model.bin not found, attempting direct model save")
-        torch.save(model.state_dict(), model_bin_path)
-        logger.info("Model saved directly via torch.save")
-    saved_files = os.listdir(save_dir)
-    logger.info(f"Updated saved files: {saved_files}")
-    if "pytorch_model.bin" not in saved_files:
-        logger.error("pytorch_model.bin still not found in save_dir")
-        raise FileNotFoundError("pytorch_model.bin not saved in save_dir")
-    logger.info("pytorch_model.bin successfully saved")
-except Exception as e:
-    logger.error(f"Save error: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
-
-# Save label mappings
-try:
-    logger.info("Saving label mappings")
-    with open(os.path.join(save_dir, "label2id.json"), "w") as f:
-        json.dump(label2id, f)
-    with open(os.path.join(save_dir, "id2label.json"), "w") as f:
-        json.dump(id2label, f)
-    logger.info("Label mappings saved")
-except Exception as e:
-    logger.error(f"Label saving error: {str(e)}")
-    logger.error(traceback.format_exc())
-    raise
-
-logger.info("Process completed successfully")
\ No newline at end of file
+
+    check_save_dir(save_dir)
+
+    with step("Tokenizer load"):
+        logger.info(f"Loading tokenizer: {model_name}")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    # Load, balance, tokenize and split the dataset. Results are cached by
+    # app/preprocess.py; only queries the cache hasn't seen are tokenized.
+    with step("Dataset preparation"):
+        logger.info(f"Preparing dataset from {csv_path}")
+        dataset, data_info = prepare_dataset(
+            csv_path, tokenizer, max_length, max_length_percentile, padding, test_size=0.2, seed=42
+        )
+        label2id = data_info["label2id"]
+        resolved_max_length = data_info["max_length"]
+        lengths = data_info["token_lengths"]
+        logger.info(f"Labels: {data_info['labels']}")
+        logger.info(
+            f"Token lengths: mean={lengths['mean']:.1f} p50={lengths['p50']:.0f} p95={lengths['p95']:.0f} "
+            f"p99={lengths['p99']:.0f} max={lengths['max']}"
+        )
+        logger.info(
+            f"Using max_length={resolved_max_length} ({data_info['truncated']} queries truncated), padding={padding}"
+        )
+        logger.info(f"Train dataset size: {len(dataset['train'])}")
+        logger.info(f"Test dataset size: {len(dataset['test'])}")
+
+    with step("Model load"):
+        logger.info(f"Loading model: {model_name}")
+        torch.manual_seed(seed)
+        model = AutoModelForSequenceClassification.from_pretrained(
+            model_name,
+            num_labels=len(label2id),
+            id2label={idx: label for label, idx in label2id.items()},
+            label2id=label2id
+        )
+
+    with step("Training args"):
+        per_epoch = "epoch" if early_stopping_patience else "no"
+        training_args = training_arguments(
+            output_dir=save_dir,
+            per_device_train_batch_size=batch_size,
+            per_device_eval_batch_size=batch_size,
+            num_train_epochs=epochs,
+            learning_rate=learning_rate,
+            weight_decay=weight_decay,
+            logging_dir=logging_dir,
+            logging_steps=10,
+            do_eval=True,
+            eval_strategy=per_epoch,
+            save_strategy="epoch",  # Save at epoch boundaries
+            save_total_limit=1,
+            load_best_model_at_end=bool(early_stopping_patience),
+            metric_for_best_model="f1" if early_stopping_patience else None,
+            greater_is_better=True if early_stopping_patience else None,
+            group_by_length=padding == "dynamic",  # Batch queries of similar length to minimise padding
+            seed=seed,
+            **({"report_to": report_to} if report_to is not None else {}),
+        )
+
+    with step("Trainer init"):
+        train_lengths = np.array(dataset["train"]["length"])
+        callback_class = make_trainer_callback()
+        callbacks = [callback_class(
+            int(train_lengths.sum()), padded_tokens(train_lengths, batch_size, padding, resolved_max_length), padding
+        )]
+        if early_stopping_patience:
+            callbacks.append(EarlyStoppingCallback(early_stopping_patience, early_stopping_threshold))
+        trainer = Trainer(
+            model=model,
+            args=training_args,
+            train_dataset=dataset["train"],
+            eval_dataset=dataset["test"],
+            processing_class=tokenizer,
+            data_collator=DataCollatorWithPadding(tokenizer) if padding == "dynamic" else None,
+            compute_metrics=compute_metrics,
+            callbacks=callbacks,
+        )
+
+    with step("LR Scheduler setup"):
+        num_training_steps = len(trainer.train_dataset) * epochs // batch_size
+        optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate, weight_decay=weight_decay)
+        trainer.optimizer = optimizer
+        trainer.lr_scheduler = get_linear_schedule_with_warmup(
+            optimizer,
+            num_warmup_steps=int(warmup_ratio * num_training_steps),
+            num_training_steps=num_training_steps
+        )
+
+    with step("Training"):
+        logger.info("Starting training")
+        train_output = trainer.train()
+        logger.info("Training complete")
+        eval_results = trainer.evaluate()
+        logger.info(f"Final evaluation results: {eval_results}")
+
+    save_model(trainer, tokenizer, save_dir, label2id)
+    # Lets calibration and evaluation find the rows this model never saw
+    write_training_data(save_dir, data_info, test_size=0.2, seed=42)
+    eval_results["epochs_run"] = float(trainer.state.epoch or 0)
+    eval_results["train_seconds"] = train_output.metrics.get("train_runtime")
+    eval_results["best_checkpoint"] = trainer.state.best_model_checkpoint
+    return eval_results
+
+
+if __name__ == "__main__":
+    setup_logging()
+    logger.info(f"Using save directory: {SAVE_DIR}")
+    train(SAVE_DIR, CSV_PATH, MODEL_NAME, **HYPERPARAMETERS)
+    logger.info("Process completed successfully")
@@ -2,48 +2,134 @@ import json
 import logging
 import re
 from pathlib import Path
-import chromadb
-from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
-from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
 from app.tools import transfer_money_tool
-
-# Set up logging
-logging.basicConfig(level=logging.INFO, filename='intent_classifier.log',
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+from app.batching import MicroBatcher
+from app.history import ConversationLog, VectorStoreWriter
+from app.config import (
+    BATCH_WINDOW_MS, MAX_BATCH_SIZE, MODEL_PATH, INTENT_BACKEND, INFERENCE_THREADS,
+    CACHE_BACKEND, CACHE_MAX_SIZE, CACHE_TTL, CACHE_ADDRESS, CACHE_AUTHKEY, RUNTIME_DIR,
+    SESSION_STORE, SESSION_DB_PATH, SESSION_TTL, SESSION_MAX_SIZE, SESSION_ADDRESS, SESSION_AUTHKEY,
+    PREFETCH_ENABLED, PREFETCH_THRESHOLD, PREFETCH_TTL, PREFETCH_MAX_IN_FLIGHT,
+)
+from app.backends import backend_signature, load_backend, load_temperature, softmax
+from app.cache import create_cache
+from app.session_store import create_session_store
+from app.prefetch import ToolPrefetcher, PREFETCHABLE_TOOLS, keyword_intents, load_keyword_priors
+from app.slots import is_cancel, parse_amount, parse_slot, parse_yes_no
+from app import metrics, startup, tracing
+from app.log_util import configure_logging, mask_sensitive_data  # noqa: F401  re-exported
+
+# Set up logging (JSON lines written off the request thread)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Initialize ChromaDB
+# ChromaDB (and its embedding model) is opened on the vector writer thread
+# the first time it is needed, not at import
 persist_directory = "./chromadb_store"
-embedding_function = DefaultEmbeddingFunction()
-chroma_client = chromadb.Client(chromadb.config.Settings(persist_directory=persist_directory))
-collection = chroma_client.get_or_create_collection(name="session_context", embedding_function=embedding_function)
 
-# Load model
-model_path = Path(r"D:\IVR Case-02\banking-intents-minilm").resolve()
-model = AutoModelForSequenceClassification.from_pretrained(str(model_path), local_files_only=True)
-tokenizer = AutoTokenizer.from_pretrained(str(model_path), local_files_only=True)
-classifier = pipeline("text-classification", model=model, tokenizer=tokenizer)
+def create_collection():
+    with startup.phase("chroma open"):
+        import chromadb
+        from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+        chroma_client = chromadb.Client(chromadb.config.Settings(persist_directory=persist_directory))
+        return chroma_client.get_or_create_collection(
+            name="session_context", embedding_function=DefaultEmbeddingFunction()
+        )
+
+vector_writer = VectorStoreWriter(create_collection)
+
+# Load model with the inference backend selected at startup
+model_path = Path(MODEL_PATH).resolve()
+with startup.phase(f"model load ({INTENT_BACKEND})"):
+    backend = load_backend(INTENT_BACKEND, model_path, num_threads=INFERENCE_THREADS)
+logger.info(f"Intent model loaded from {model_path} using the {backend.name} backend")
+
+# Softmax temperature fitted by `python -m app.backends calibrate`, so
+# confidences are calibrated probabilities
+temperature = load_temperature(model_path)
+
+TOP_K_INTENTS = 3
+BULK_BATCH_SIZE = 256  # Rows per forward pass in classify_intents
+
+def score_texts(texts, top_k=TOP_K_INTENTS):
+    # One padded forward pass for all texts; labels are intent names
+    with tracing.span("model.forward", batch_size=len(texts)):
+        if hasattr(backend, "labelled_logits"):
+            logits, labels = backend.labelled_logits(texts)
+        else:
+            logits, labels = backend.logits(texts), id2label
+        probs = softmax(logits, temperature)
+    top = probs.argsort(axis=-1)[:, ::-1][:, :top_k]
+    return [
+        {
+            "label": labels.get(str(row.argmax()), str(row.argmax())),
+            "score": float(row.max()),
+            "top": [(labels.get(str(idx), str(idx)), float(row[idx])) for idx in top_idx],
+        }
+        for row, top_idx in zip(probs, top)
+    ]
+
+def classify_batch(texts):
+    # Every query collected by the batcher shares one forward pass
+    return score_texts(texts)
+
+# Concurrent classify_intent calls share forward passes through the batcher
+batcher = MicroBatcher(classify_batch, window_ms=BATCH_WINDOW_MS, max_batch_size=MAX_BATCH_SIZE)
 
 def load_label_mapping(model_path):
     with open(model_path / "label2id.json", "r") as f:
         label2id = json.load(f)
     return {str(v): k for k, v in label2id.items()}
 
+# The knn backend numbers intents itself and returns the names of the index
+# snapshot each batch was scored against (labelled_logits), so appended
+# intents have names; every other backend uses the model's label map
 id2label = load_label_mapping(model_path)
 
+# Repeated phrases ("check my balance", "yes") are answered from the cache
+with startup.phase(f"intent cache ({CACHE_BACKEND})"):
+    intent_cache = create_cache(
+        CACHE_BACKEND, model_path, CACHE_MAX_SIZE, CACHE_TTL, CACHE_ADDRESS, CACHE_AUTHKEY, RUNTIME_DIR,
+        backend_signature(INTENT_BACKEND),
+    )
+
+# Read-only tools (balance, loan status) start as soon as they look likely
+prefetcher = ToolPrefetcher(PREFETCHABLE_TOOLS, PREFETCH_THRESHOLD, PREFETCH_TTL, PREFETCH_MAX_IN_FLIGHT) if PREFETCH_ENABLED else None
+keyword_priors = load_keyword_priors(model_path) if PREFETCH_ENABLED else {}
+
 MAX_CONTEXT_MESSAGES = 12
 
-# Session state stored locally (used alongside Chroma vector context)
-session_store = {}
+# Intents whose turns are fully handled by the dialogue flow in this module
+DIALOGUE_INTENTS = {"transfer", "cancel"}
+
+model_calls_skipped = metrics.counter(
+    "intent_model_calls_skipped_total", "Turns answered by the slot parsers without running the intent model"
+)
+
+# Recent turns per session; Chroma is only used for semantic retrieval.
+# Sessions expire on the session store's TTL/LRU policy, and their vector
+# context goes with them.
+conversation_log = ConversationLog(
+    MAX_CONTEXT_MESSAGES, SESSION_TTL, SESSION_MAX_SIZE,
+    on_evict=lambda session_id: vector_writer.delete(where={"session_id": session_id}),
+)
+
+# Session state (used alongside Chroma vector context). Wrap a request in
+# session_store.batch() to read each session once and write it back once.
+with startup.phase(f"session store ({SESSION_STORE})"):
+    session_store = create_session_store(
+        SESSION_STORE, SESSION_DB_PATH, SESSION_TTL, SESSION_MAX_SIZE, SESSION_ADDRESS, SESSION_AUTHKEY, RUNTIME_DIR
+    )
+metrics.gauge("live_sessions", "Sessions currently held by the session store", fn=session_store.count)
+metrics.gauge("session_store_bytes", "Approximate memory/disk used by session state", fn=session_store.memory_bytes)
+metrics.gauge("conversation_log_sessions", "Sessions with recent turns held in memory", fn=conversation_log.count)
 
 def reset_state(session_id):
-    print(f"[reset_state] Resetting session: {session_id}")
+    if session_store.get(session_id) is not None:
+        session_store.delete(session_id)
 
-    if session_id in session_store:
-        del session_store[session_id]
-        print(f"[reset_state] Old session deleted: {session_id}")
-
-    session_store[session_id] = {
+    state = {
         "intent": None,
         "stage": None,
         "source": None,
@@ -51,34 +137,42 @@ def reset_state(session_id):
         "amount": None,
         "confirmed": False,
     }
-    print(f"[reset_state] New session initialized: {session_id} => {session_store[session_id]}")
+    session_store.set(session_id, state)
 
-    # Clear vector context
-    collection.delete(where={"session_id": session_id})
-    print(f"[reset_state] Vector store context cleared for session: {session_id}")
+    # Clear conversation history and vector context
+    clear_history(session_id)
+    logger.debug("Session reset", extra={"fields": {"session_id": session_id}})
 
 def get_state(session_id):
     return session_store.get(session_id)
 
 def save_state(session_id, state):
-    session_store[session_id] = state
+    session_store.set(session_id, state)
 
 def append_to_history(session_id, sender, text):
-    doc_id = f"{session_id}_{sender}_{len(get_recent_context(session_id))}"
-    collection.add(
+    turn_id = conversation_log.append(session_id, sender, text)
+    vector_writer.add(
         documents=[f"{sender}: {text}"],
-        ids=[doc_id],
-        metadatas=[{"session_id": session_id}]
+        ids=[f"{session_id}_{sender}_{turn_id}"],
+        metadatas=[{"session_id": session_id, "turn_id": turn_id}]
     )
 
 def get_recent_context(session_id):
-    results = collection.query(
-        query_texts=["context"],
-        n_results=MAX_CONTEXT_MESSAGES,
+    return "\n".join(f"{sender}: {text}" for _, sender, text in conversation_log.recent(session_id))
+
+def search_context(session_id, query, n_results=MAX_CONTEXT_MESSAGES):
+    # Semantic retrieval over everything stored for the session
+    results = vector_writer.query(
+        query_texts=[query],
+        n_results=n_results,
         where={"session_id": session_id}
     )
     return "\n".join([doc for doc in results["documents"][0]])
 
+def clear_history(session_id):
+    conversation_log.clear(session_id)
+    vector_writer.delete(where={"session_id": session_id})
+
 def sanitize_input(query):
     return re.sub(r'[^a-zA-Z0-9\s]', '', query)
 
@@ -89,12 +183,10 @@ def validate_input(query):
         return False, "Query is too long."
     return True, ""
 
-def mask_sensitive_data(text):
-    return re.sub(r'\d{12,}', '******', text)
-
+@tracing.traced("nlp.handle_transfer_conversation")
 def handle_transfer_conversation(session_id, query):
     # Debugging log to track session state access
-    logger.info(f"Handling transfer for session: {session_id}")
+    logger.debug("Handling transfer", extra={"fields": {"session_id": session_id}})
     
     # Retrieve the session state
     state = get_state(session_id)
@@ -104,7 +196,7 @@ def handle_transfer_conversation(session_id, query):
         logger.warning(f"Session {session_id} not found. Initializing a new session.")
         reset_state(session_id)  # Initialize the session state for this session ID
         state = get_state(session_id)  # Retrieve the newly initialized state
-        logger.info(f"New session state initialized: {state}")
+        logger.debug("New session state initialized", extra={"fields": {"session_id": session_id}})
     
     append_to_history(session_id, "user", query)  # Append user query to history
     stage = state.get("stage")
@@ -112,38 +204,34 @@ def handle_transfer_conversation(session_id, query):
     # Handle the transfer process
     if state.get("intent") == "transfer" and stage:
         if stage == "source":
-            state["source"] = query.strip()
+            # The parsed account when the slot parser understands it, else the raw reply
+            state["source"] = parse_slot(stage, query) or query.strip()
             state["stage"] = "destination"
             response = "Please provide the destination account."
         elif stage == "destination":
-            state["destination"] = query.strip()
+            state["destination"] = parse_slot(stage, query) or query.strip()
             state["stage"] = "amount"
             response = "How much would you like to transfer?"
         elif stage == "amount":
-            try:
-                amount = float(query.strip().replace("$", "").replace("₹", ""))
-                if amount > 10000:
-                    response = "Insufficient balance. Please enter a smaller amount."
-                else:
-                    state["amount"] = amount
-                    state["stage"] = "confirm"
-                    response = f"Do you confirm the transfer of ₹{amount} from {state['source']} to {state['destination']}?"
-            except ValueError:
+            amount = parse_amount(query)
+            if amount is None:
                 response = "Invalid amount. Please enter a valid number."
+            elif amount > 10000:
+                response = "Insufficient balance. Please enter a smaller amount."
+            else:
+                state["amount"] = amount
+                state["stage"] = "confirm"
+                response = f"Do you confirm the transfer of ₹{amount} from {state['source']} to {state['destination']}?"
         elif stage == "confirm":
-            if query.strip().lower() in ["yes", "confirm", "y"]:
+            if parse_yes_no(query) is True:
                 summary = f"Transfer ₹{state['amount']} from {state['source']} to {state['destination']}"
                 result = transfer_money_tool(summary)
                 response = f"{result}"
-                reset_state(session_id)  # Reset state after completion
-                # Clear history after transfer completion
-                collection.delete(where={"session_id": session_id})
-                print(f"from line 143 {state.get("intent")}, {state.get("stage")}")
+                reset_state(session_id)  # Reset state after completion (also clears history)
+                logger.debug("Transfer completed", extra={"fields": {"session_id": session_id}})
             else:
                 response = "Transfer cancelled."
-                reset_state(session_id)  # Reset state after cancellation
-                # Clear history after cancellation
-                collection.delete(where={"session_id": session_id})
+                reset_state(session_id)  # Reset state after cancellation (also clears history)
         else:
             response = "Sure, from which account would you like to transfer funds?"
             state["stage"] = "source"
@@ -169,7 +257,7 @@ def handle_transfer_conversation(session_id, query):
         save_state(session_id, state)
         response = "Sure, from which account would you like to transfer funds?"
         append_to_history(session_id, "bot", response)
-        print(f"from line 175 {state.get("intent")}, {state.get("stage")}")
+        logger.debug("Transfer started", extra={"fields": {"session_id": session_id, "stage": state["stage"]}})
         return intent, confidence, response
 
     # Return fallback response for other intents
@@ -177,45 +265,118 @@ def handle_transfer_conversation(session_id, query):
     append_to_history(session_id, "bot", fallback)
     return intent, confidence, fallback
 
+@tracing.traced("nlp.classify_intent")
 def classify_intent(query, context=""):
     valid, msg = validate_input(query)
     if not valid:
-        return {"intent": "fallback", "confidence": 0.0}
+        return {"intent": "fallback", "confidence": 0.0, "top_intents": []}
     cleaned = sanitize_input(query)
     enriched = f"{context}\n{cleaned}".strip()
-    result = classifier(enriched)[0]
-    label = result["label"].replace("LABEL_", "")
-    confidence = result["score"]
-    intent = id2label.get(label, label)
-    logger.info(f"Query: {query} | Intent: {intent} | Confidence: {confidence:.2f}")
-    return {"intent": intent, "confidence": confidence}
 
+    cache_key = intent_cache.key(enriched) if intent_cache else None
+    if cache_key:
+        cached = intent_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Intent classified", extra={"fields": {
+                "intent": cached["intent"], "confidence": cached["confidence"], "cached": True}})
+            return dict(cached)
+
+    with tracing.span("model.inference"):
+        result = batcher(enriched)  # Includes time queued for the next batch
+    intent = result["label"]
+    confidence = result["score"]
+    logger.debug("Intent classified", extra={"fields": {"intent": intent, "confidence": confidence, "cached": False}})
+    top_intents = [{"intent": intent, "confidence": p} for intent, p in result["top"]]
+    prediction = {"intent": intent, "confidence": confidence, "top_intents": top_intents}
+    if cache_key:
+        intent_cache.put(cache_key, prediction)
+    return dict(prediction)
+
+def classify_intents(queries, top_k=TOP_K_INTENTS, context=""):
+    """
+    Scores many queries at once for offline QA, re-scoring and analytics.
+    Uses the same validation and sanitizing as classify_intent, bypasses
+    the per-request batcher and cache, and returns the top_k intents with
+    calibrated probabilities for every query, in input order.
+    """
+    results = [None] * len(queries)
+    texts, positions = [], []
+    for position, query in enumerate(queries):
+        valid, msg = validate_input(query)
+        if not valid:
+            results[position] = {"query": query, "intent": "fallback", "confidence": 0.0, "top_intents": []}
+            continue
+        texts.append(f"{context}\n{sanitize_input(query)}".strip())
+        positions.append(position)
+
+    for start in range(0, len(texts), BULK_BATCH_SIZE):
+        scored = score_texts(texts[start:start + BULK_BATCH_SIZE], top_k)
+        for position, result in zip(positions[start:start + BULK_BATCH_SIZE], scored):
+            results[position] = {
+                "query": queries[position],
+                "intent": result["label"],
+                "confidence": result["score"],
+                "top_intents": [{"intent": intent, "confidence": p} for intent, p in result["top"]],
+            }
+    return results
+
+WARMUP_QUERY = "what is my account balance"
+
+def warm_up():
+    # One inference through the batcher so the first caller doesn't pay for
+    # lazy kernel/session initialisation; Chroma opens in the background
+    vector_writer.open()
+    batcher(sanitize_input(WARMUP_QUERY))
+
+@tracing.traced("nlp.process_user_query")
 def process_user_query(query, session_id="user-session"):
     state = get_state(session_id)
     if not state:
         reset_state(session_id)
         state = get_state(session_id)
 
-    # Classify current query
-    result = classify_intent(query)
-    intent = result["intent"]
-    confidence = result["confidence"]
-    print(f"[Classifier] intent: {intent}, confidence: {confidence}, query: {query}")
-
-    # Check for active intent flow
+    # Slot-filling fast path: while a flow is waiting for a slot, answer
+    # cancels and parseable slot values without running the intent model
     if state.get("intent") and state.get("stage"):
         active_intent = state["intent"]
 
         # Check for cancelation
-        if query.lower() in ["cancel", "nevermind", "stop"]:
+        if is_cancel(query):
+            model_calls_skipped.inc()
+            logger.debug("Fast path: cancel", extra={"fields": {
+                "session_id": session_id, "intent": active_intent, "stage": state["stage"]}})
             reset_state(session_id)
             response = f"{active_intent.capitalize()} cancelled."
             append_to_history(session_id, "bot", response)
             return "cancel", 1.0, response
 
+        if parse_slot(state["stage"], query) is not None:
+            model_calls_skipped.inc()
+            logger.debug("Fast path: slot parsed", extra={"fields": {
+                "session_id": session_id, "intent": active_intent, "stage": state["stage"]}})
+            return active_intent, 1.0, handle_transfer_conversation(session_id, query)
+
+    # A keyword that reliably means a read-only tool starts it now, overlapping the model
+    if prefetcher:
+        prefetcher.maybe_prefetch(session_id, query, keyword_intents(query, keyword_priors))
+
+    # Classify current query (the parsers couldn't interpret it, or no flow is active)
+    result = classify_intent(query)
+    intent = result["intent"]
+    confidence = result["confidence"]
+
+    # Then any other likely read-only tool from the intent distribution
+    if prefetcher:
+        prefetcher.maybe_prefetch(session_id, query, result.get("top_intents", []))
+
+    # Check for active intent flow
+    if state.get("intent") and state.get("stage"):
+        active_intent = state["intent"]
+
         # Check if user is switching to a new high-confidence intent
         if intent != active_intent and confidence >= 0.8:
-            print(f"[Intent Switch] Switching from {active_intent} to {intent}")
+            logger.debug("Intent switch", extra={"fields": {
+                "session_id": session_id, "from_intent": active_intent, "intent": intent}})
             reset_state(session_id)
             state = get_state(session_id)
             state["intent"] = intent
@@ -233,7 +394,7 @@ def process_user_query(query, session_id="user-session"):
             return intent, confidence, response
 
         # Continue handling current intent (e.g., transfer flow)
-        print(f"[Continue Intent] Still handling: {active_intent}")
+        logger.debug("Continuing intent", extra={"fields": {"session_id": session_id, "intent": active_intent}})
         return active_intent, 1.0, handle_transfer_conversation(session_id, query)
 
     # New intent flow starts here (if no prior context or after reset)
@@ -0,0 +1,146 @@
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import metrics
+from app.tools import check_balance_tool, loan_status_tool
+
+logger = logging.getLogger(__name__)
+
+# Only read-only, idempotent tools may run before the turn is routed; a
+# wasted prefetch must never have side effects
+PREFETCHABLE_TOOLS = {
+    "balance": check_balance_tool,
+    "loan_application": loan_status_tool,
+}
+
+# Words that point at a prefetchable tool. A query containing one can start
+# the call before the intent model runs, so the call overlaps classification
+# instead of only the few microseconds of state handling after it. A keyword
+# is not proof ("transfer my balance to savings"), so each one carries
+# P(intent | keyword) measured on the labeled training queries, and the
+# prefetch threshold applies to that like to any model probability.
+PREFETCH_KEYWORDS = {
+    "balance": re.compile(r"\bbalance\b"),
+    "loan_application": re.compile(r"\bloans?\b"),
+}
+
+
+def keyword_priors(df):
+    # Smoothed, so a keyword seen only a few times is never a certainty
+    queries = df["query"].astype(str).str.lower()
+    priors = {}
+    for intent, pattern in PREFETCH_KEYWORDS.items():
+        matched = df["intent"][queries.str.contains(pattern.pattern, regex=True)]
+        priors[intent] = (int((matched == intent).sum()) + 1) / (len(matched) + 2)
+    return priors
+
+
+def load_keyword_priors(model_path):
+    from app.preprocess import DEFAULT_TRAIN_CSV, load_csv, read_training_data
+
+    csv_path = read_training_data(model_path).get("csv") or DEFAULT_TRAIN_CSV
+    try:
+        df = load_csv(csv_path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Keyword prefetch off: can't weigh keywords without labeled queries ({e})")
+        return {}
+    priors = keyword_priors(df)
+    logger.info(f"Keyword prefetch priors from {csv_path}: {priors}")
+    return priors
+
+
+def keyword_intents(query, priors):
+    # Same shape as classify_intent's top_intents
+    text = query.lower()
+    return [
+        {"intent": intent, "confidence": priors[intent]}
+        for intent, pattern in PREFETCH_KEYWORDS.items() if intent in priors and pattern.search(text)
+    ]
+
+
+class ToolPrefetcher:
+    """
+    Starts read-only tool calls as soon as the intent distribution makes them
+    likely, and keeps the results in a short-lived cache for AutoGenRouter to
+    pick up. Entries belong to one turn: they are keyed by session, query and
+    intent, and whatever the turn didn't use is dropped by `end_turn`, so a
+    later turn never gets an earlier turn's balance. Prefetches nobody takes,
+    that expire after `ttl` seconds or that lose to a different intent are
+    counted as wasted.
+    """
+
+    def __init__(self, tools, threshold=0.6, ttl=10.0, max_in_flight=4):
+        self.tools = tools
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_in_flight = max_in_flight
+        self._entries = {}  # (session_id, query, intent) -> (future, expires_at)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="prefetch")
+
+        self.started = metrics.counter("prefetch_started_total", "Speculative tool calls started")
+        self.used = metrics.counter("prefetch_used_total", "Prefetched results used by the router")
+        self.wasted = metrics.counter("prefetch_wasted_total", "Prefetched results that expired or lost to another intent")
+        self.skipped = metrics.counter("prefetch_skipped_total", "Prefetches skipped because too many were in flight")
+
+    def _purge_expired(self, now):
+        expired = [key for key, (_, expires_at) in self._entries.items() if expires_at < now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self.wasted.inc(len(expired))
+
+    def _done(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def maybe_prefetch(self, session_id, query, top_intents):
+        now = time.monotonic()
+        started = []
+        with self._lock:
+            self._purge_expired(now)
+            for candidate in top_intents:
+                intent = candidate["intent"]
+                if candidate["confidence"] < self.threshold or intent not in self.tools:
+                    continue
+                if (session_id, query, intent) in self._entries:
+                    continue
+                if self._in_flight >= self.max_in_flight:
+                    self.skipped.inc()
+                    continue
+                self._in_flight += 1
+                future = self._executor.submit(self.tools[intent].invoke, query)
+                started.append(future)
+                self._entries[(session_id, query, intent)] = (future, now + self.ttl)
+                self.started.inc()
+                logger.info(f"[Prefetch] {intent} for session {session_id} (p={candidate['confidence']:.2f})")
+        # Outside the lock: a call that already finished runs _done right here
+        for future in started:
+            future.add_done_callback(self._done)
+
+    def take(self, session_id, query, intent):
+        """
+        Returns the Future of the call prefetched for this turn's query, or
+        None. Every other prefetch for the session is dropped as wasted.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._purge_expired(now)
+            future, _ = self._entries.pop((session_id, query, intent), (None, None))
+        self.end_turn(session_id)
+        if future is not None:
+            self.used.inc()
+        return future
+
+    def end_turn(self, session_id):
+        # Called when a turn finishes, whether or not it was routed to a tool
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == session_id]
+            for key in keys:
+                del self._entries[key]
+        if keys:
+            self.wasted.inc(len(keys))
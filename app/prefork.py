@@ -0,0 +1,57 @@
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+# Hooks for the prefork serving mode (gunicorn.conf.py). The master imports
+# app.main, which loads the model once; workers are forked afterwards and
+# share the weights copy-on-write.
+
+def threads_per_worker(workers):
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def init_worker(workers):
+    from app import nlp, startup
+
+    nlp.backend.after_fork(threads_per_worker(workers))
+    # Before the worker accepts requests. A worker that can't warm up exits
+    # and gunicorn forks a fresh one, rather than serving 503s on /readyz
+    if not startup.warm_up(nlp.warm_up):
+        sys.exit(1)
+    logger.info(f"Worker {os.getpid()} ready with {threads_per_worker(workers)} inference thread(s)")
+
+
+def memory_footprint(pid="self"):
+    """
+    Memory of one process in MB from /proc/<pid>/smaps_rollup (Linux).
+    `private` is what the worker costs on its own; `shared` includes the
+    model weights inherited from the master; `pss` splits shared pages
+    evenly between the processes mapping them.
+    """
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared_clean", "Shared_Dirty": "shared_dirty",
+              "Private_Clean": "private_clean", "Private_Dirty": "private_dirty"}
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in fields:
+                    usage[fields[name]] = int(rest.split()[0]) / 1024
+    except OSError:
+        return None
+    usage["shared"] = usage.get("shared_clean", 0) + usage.get("shared_dirty", 0)
+    usage["private"] = usage.get("private_clean", 0) + usage.get("private_dirty", 0)
+    return {name: round(value, 1) for name, value in usage.items()}
+
+
+def log_memory_footprint(label):
+    usage = memory_footprint()
+    if usage is None:
+        logger.info(f"[{label}] memory footprint unavailable on this platform")
+        return
+    logger.info(
+        f"[{label}] pid={os.getpid()} rss={usage['rss']}MB pss={usage['pss']}MB "
+        f"shared={usage['shared']}MB private={usage['private']}MB"
+    )
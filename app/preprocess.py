@@ -0,0 +1,267 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+logger = logging.getLogger(__name__)
+
+# Preprocessing for app/model.py with an on-disk cache, so tweaking a few
+# intents doesn't re-tokenize the whole dataset:
+#
+# - tokens-<tokenizer>/ holds Arrow shards of untruncated token ids for
+#   every distinct query seen so far. Only queries missing from the shards
+#   are tokenized; they are written as a new shard.
+# - dataset-<key>/ holds the finished train/test DatasetDict, keyed by the
+#   CSV content hash, the tokenizer, max_length, padding and seed. A re-run
+#   on an unchanged CSV loads it straight from disk.
+
+CACHE_DIR = os.environ.get("IVR_PREPROCESS_CACHE", ".preprocess_cache")
+HASH_CHUNK_BYTES = 1 << 20
+MAX_LENGTH_CAP = 256
+
+# Written next to a trained model: which CSV it was trained on and how it
+# was split, so calibration and evaluation can use rows it never saw
+TRAINING_DATA_FILE = "training_data.json"
+DEFAULT_TRAIN_CSV = os.environ.get("IVR_TRAIN_CSV", str(Path(__file__).parent / "data" / "banking_intents.csv"))
+
+
+def hash_file(path):
+    # Streamed in chunks, so large CSVs aren't read into memory to be hashed
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer):
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    text = backend.to_str() if backend is not None else json.dumps(tokenizer.get_vocab(), sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def oversample(df, column="intent", random_state=42):
+    """
+    Tops every class up to the size of the largest one by sampling its rows
+    with replacement. One vectorized draw for all classes instead of a
+    filter-and-sample per class.
+    """
+    codes, classes = pd.factorize(df[column])
+    counts = np.bincount(codes)
+    deficit = counts.max() - counts
+    if not deficit.any():
+        return df.reset_index(drop=True)
+    rng = np.random.default_rng(random_state)
+    order = np.argsort(codes, kind="stable")  # row positions grouped by class
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    extra_class = np.repeat(np.arange(len(classes)), deficit)
+    picks = order[starts[extra_class] + (rng.random(len(extra_class)) * counts[extra_class]).astype(np.int64)]
+    return pd.concat([df, df.iloc[picks]], ignore_index=True)
+
+
+def truncate(ids, max_length):
+    # Same result as the tokenizer's truncation for a single sequence: keep
+    # the leading tokens and the closing special token
+    return ids if len(ids) <= max_length else ids[:max_length - 1] + ids[-1:]
+
+
+class TokenCache:
+    """
+    Untruncated token ids per distinct query, stored as Arrow shards under a
+    directory named after the tokenizer's fingerprint.
+    """
+
+    def __init__(self, tokenizer, cache_dir=CACHE_DIR):
+        self.tokenizer = tokenizer
+        self.directory = Path(cache_dir) / f"tokens-{tokenizer_fingerprint(tokenizer)}"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ids = {}
+        for shard in sorted(self.directory.glob("shard-*.arrow")):
+            table = feather.read_table(shard)
+            self.ids.update(zip(table.column("query").to_pylist(), table.column("input_ids").to_pylist()))
+
+    def encode(self, queries):
+        missing = [query for query in dict.fromkeys(queries) if query not in self.ids]
+        if missing:
+            encoded = self.tokenizer(missing, truncation=False)["input_ids"]
+            self._write_shard(missing, encoded)
+            self.ids.update(zip(missing, encoded))
+        logger.info(f"Tokenized {len(missing)} new queries; {len(self.ids) - len(missing)} came from the cache")
+        return [self.ids[query] for query in queries], len(missing)
+
+    def _write_shard(self, queries, encoded):
+        name = hashlib.sha256("\n".join(queries).encode("utf-8")).hexdigest()[:16]
+        table = pa.table({"query": queries, "input_ids": pa.array(encoded, type=pa.list_(pa.int32()))})
+        path = self.directory / f"shard-{name}.arrow"
+        tmp = path.with_suffix(".tmp")
+        feather.write_feather(table, tmp)
+        os.replace(tmp, path)
+
+
+def load_csv(csv_path):
+    df = pd.read_csv(csv_path)
+    if not {"query", "intent"}.issubset(df.columns):
+        raise ValueError("CSV must have 'query' and 'intent' columns")
+    if df["query"].isnull().any() or df["intent"].isnull().any():
+        raise ValueError("Dataset contains null values")
+    return df
+
+
+def split_rows(num_rows, test_size=0.2, seed=42):
+    # Row positions of the train and test splits; prepare_dataset and
+    # held_out_split both split this way, so they always agree
+    from datasets import Dataset
+
+    split = Dataset.from_dict({"row": list(range(num_rows))}).train_test_split(test_size=test_size, seed=seed)
+    return split["train"]["row"], split["test"]["row"]
+
+
+def resolve_max_length(lengths, max_length="auto", percentile=99.5):
+    if max_length == "auto":
+        return int(min(MAX_LENGTH_CAP, np.ceil(np.percentile(lengths, percentile))))
+    return int(max_length)
+
+
+def prepare_dataset(csv_path, tokenizer, max_length="auto", percentile=99.5, padding="dynamic",
+                    test_size=0.2, seed=42, cache_dir=CACHE_DIR):
+    """
+    Reads, balances, encodes and splits the training CSV. Returns the
+    DatasetDict (torch format: input_ids, attention_mask, label, length)
+    and a dict with the label maps, token-length stats and max_length.
+    """
+    from datasets import Dataset, DatasetDict, load_from_disk
+
+    csv_hash = hash_file(csv_path)
+    key = hashlib.sha256(
+        f"{csv_hash}|{tokenizer_fingerprint(tokenizer)}|{max_length}|{percentile}|{padding}|{test_size}|{seed}".encode()
+    ).hexdigest()[:16]
+    dataset_dir = Path(cache_dir) / f"dataset-{key}"
+    columns = ["input_ids", "attention_mask", "label", "length"]
+
+    if (dataset_dir / "info.json").exists():
+        with open(dataset_dir / "info.json", "r") as f:
+            info = json.load(f)
+        dataset = load_from_disk(str(dataset_dir))
+        dataset.set_format(type="torch", columns=columns)
+        logger.info(f"Loaded preprocessed dataset {dataset_dir} (CSV {csv_hash[:12]} unchanged)")
+        return dataset, info
+
+    df = load_csv(csv_path)
+    logger.info(f"Dataset loaded with {len(df)} rows, {df['intent'].nunique()} intents")
+    logger.info(f"Class distribution (before balancing):\n{df['intent'].value_counts()}")
+
+    df = oversample(df, "intent", random_state=seed)
+    logger.info(f"Balanced dataset size: {len(df)}")
+
+    labels = sorted(df["intent"].unique())
+    label2id = {label: idx for idx, label in enumerate(labels)}
+
+    ids, tokenized = TokenCache(tokenizer, cache_dir).encode(df["query"].tolist())
+    token_lengths = np.array([len(row) for row in ids])
+    resolved = resolve_max_length(token_lengths, max_length, percentile)
+    ids = [truncate(row, resolved) for row in ids]
+    lengths = [len(row) for row in ids]
+    if padding == "dynamic":
+        # Padding happens per batch in the data collator
+        masks = [[1] * length for length in lengths]
+    else:
+        pad = tokenizer.pad_token_id
+        masks = [[1] * length + [0] * (resolved - length) for length in lengths]
+        ids = [row + [pad] * (resolved - len(row)) for row in ids]
+
+    dataset = Dataset.from_dict({
+        "query": df["query"].tolist(),
+        "input_ids": ids,
+        "attention_mask": masks,
+        "label": df["intent"].map(label2id).tolist(),
+        "length": lengths,
+    })
+    train_rows, test_rows = split_rows(len(dataset), test_size, seed)
+    dataset = DatasetDict({"train": dataset.select(train_rows), "test": dataset.select(test_rows)})
+
+    info = {
+        "csv": str(csv_path),
+        "csv_sha256": csv_hash,
+        "rows": len(df),
+        "newly_tokenized": tokenized,
+        "labels": labels,
+        "label2id": label2id,
+        "max_length": resolved,
+        "truncated": int((token_lengths > resolved).sum()),
+        "token_lengths": {
+            "mean": round(float(token_lengths.mean()), 1),
+            "p50": float(np.percentile(token_lengths, 50)),
+            "p95": float(np.percentile(token_lengths, 95)),
+            "p99": float(np.percentile(token_lengths, 99)),
+            "max": int(token_lengths.max()),
+        },
+    }
+    dataset.save_to_disk(str(dataset_dir))
+    with open(dataset_dir / "info.json", "w") as f:
+        json.dump(info, f, indent=2)
+    dataset.set_format(type="torch", columns=columns)
+    return dataset, info
+
+
+def write_training_data(save_dir, info, test_size=0.2, seed=42):
+    record = {"csv": info["csv"], "csv_sha256": info["csv_sha256"], "test_size": test_size, "seed": seed}
+    with open(Path(save_dir) / TRAINING_DATA_FILE, "w") as f:
+        json.dump(record, f, indent=2)
+
+
+def read_training_data(model_path):
+    path = Path(model_path) / TRAINING_DATA_FILE
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def held_out_split(model_path, train_csv=None):
+    """
+    The train and test rows of app/model.py's split for the model at
+    `model_path`, from its training_data.json when present (else
+    `train_csv` with model.py's defaults). Oversampling repeats queries, so
+    test rows whose query is also in the train split are dropped: what's
+    left is data the model never trained on.
+    """
+    record = read_training_data(model_path)
+    csv_path = train_csv or record.get("csv") or DEFAULT_TRAIN_CSV
+    if not Path(csv_path).exists():
+        raise FileNotFoundError(f"Training CSV {csv_path} not found; pass the CSV the model was trained on")
+    if record.get("csv_sha256") and hash_file(csv_path) != record["csv_sha256"]:
+        raise ValueError(f"{csv_path} changed since {model_path} was trained, so its test split is unknown")
+    seed = record.get("seed", 42)
+    df = oversample(load_csv(csv_path), "intent", random_state=seed)
+    train_rows, test_rows = split_rows(len(df), record.get("test_size", 0.2), seed)
+    train_df = df.iloc[train_rows].reset_index(drop=True)
+    test_df = df.iloc[test_rows]
+    test_df = test_df[~test_df["query"].isin(set(train_df["query"]))].drop_duplicates("query").reset_index(drop=True)
+    return train_df, test_df, csv_path
+
+
+def evaluation_rows(model_path, csv_path=None, train_csv=None):
+    """
+    Labeled rows to calibrate or evaluate the model at `model_path` on, and
+    a description of where they came from: `csv_path` when given (refused if
+    it is the model's training CSV), else the held-out test split.
+    """
+    if csv_path is None:
+        _, test_df, source = held_out_split(model_path, train_csv)
+        return test_df, f"held-out test split of {source} ({len(test_df)} queries)"
+    record = read_training_data(model_path)
+    training_hashes = {record.get("csv_sha256")}
+    for path in (train_csv, record.get("csv") or DEFAULT_TRAIN_CSV):
+        if path and Path(path).exists():
+            training_hashes.add(hash_file(path))
+    if hash_file(csv_path) in training_hashes:
+        raise ValueError(
+            f"{csv_path} is the CSV the model was trained on; pass a held-out CSV or leave it out to use the test split"
+        )
+    return load_csv(csv_path), f"{csv_path}"
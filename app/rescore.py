@@ -0,0 +1,284 @@
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Offline re-classification of historical call logs with the current model.
+# Logs are streamed in fixed-size chunks, scored in worker processes with
+# the same preprocessing as the online path (app.nlp.classify_intents) and
+# written as one Parquet part per chunk, so an interrupted run resumes where
+# it stopped. The checkpoint records the rows each chunk covered: a chunk is
+# only skipped when it still covers the same rows, so the last chunk of a log
+# that grew since is scored again instead of being taken as done.
+#
+#   python -m app.rescore --csv ivr_log.csv --log ivr_logs.log --out rescore_output
+
+CHECKPOINT_FILE = "checkpoint.json"
+LOG_LINE = re.compile(
+    r"^(?P<timestamp>\d{4}-\d{2}-\d{2} [\d:,]+) - Query: (?P<query>.*?) \| Intent: (?P<intent>.*?) "
+    r"\| Confidence: (?P<confidence>[\d.]+) \| Response: (?P<response>.*)$"
+)
+
+
+def read_csv_chunks(path, chunk_size):
+    # ivr_log.csv written by voice_assistant.py (app/call_log.py); .jsonl call logs too
+    if str(path).endswith(".jsonl"):
+        reader = pd.read_json(path, lines=True, chunksize=chunk_size, dtype=str)
+    else:
+        reader = pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False)
+    for index, chunk in enumerate(reader):
+        chunk = chunk.fillna("")
+        yield index, [
+            {
+                "row": int(row_number),
+                "timestamp": row.get("timestamp", ""),
+                "session_id": row.get("session_id", ""),
+                "query": row.get("query", ""),
+                "old_intent": row.get("intent", ""),
+                "old_confidence": float(row.get("confidence") or 0.0),
+            }
+            for row_number, row in zip(chunk.index, chunk.to_dict("records"))
+        ]
+
+
+def parse_log_line(line):
+    # JSON records from log_util.log_query_response, or the older plain-text lines
+    if line.startswith("{"):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        if "query" not in entry or "intent" not in entry:
+            return None
+        return {
+            "timestamp": entry.get("time", ""),
+            "session_id": entry.get("session_id") or "",
+            "query": entry["query"],
+            "old_intent": entry["intent"],
+            "old_confidence": float(entry.get("confidence") or 0.0),
+        }
+    match = LOG_LINE.match(line)
+    if match is None:
+        return None
+    return {
+        "timestamp": match["timestamp"],
+        "session_id": "",
+        "query": match["query"],
+        "old_intent": match["intent"],
+        "old_confidence": float(match["confidence"]),
+    }
+
+
+def read_log_chunks(path, chunk_size):
+    # ivr_logs.log written by log_util.log_query_response; other lines are skipped
+    records, index = [], 0
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line_number, line in enumerate(f):
+            record = parse_log_line(line.rstrip("\n"))
+            if record is not None:
+                records.append({"row": line_number, **record})
+            if len(records) >= chunk_size:
+                yield index, records
+                records, index = [], index + 1
+    if records:
+        yield index, records
+
+
+def init_worker(inference_threads):
+    # The worker only scores text: no shared cache, prefetching or tool calls.
+    # Workers are spawned, not forked, so app.config is imported fresh here
+    # and sees these settings
+    os.environ["IVR_CACHE_BACKEND"] = "off"
+    os.environ["IVR_PREFETCH_ENABLED"] = "0"
+    os.environ["IVR_INFERENCE_THREADS"] = str(inference_threads)
+    import app.nlp  # noqa: F401  Loads the model once per worker
+
+
+def score_chunk(source, prefix, index, records, out_dir, top_k):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from app.nlp import classify_intents
+
+    results = classify_intents([record["query"] for record in records], top_k)
+    rows = []
+    for record, result in zip(records, results):
+        rows.append({
+            "source": source,
+            **record,
+            "new_intent": result["intent"],
+            "new_confidence": result["confidence"],
+            "top_intents": result["top_intents"],
+        })
+
+    part = Path(out_dir) / f"part-{prefix}-{index:06d}.parquet"
+    tmp = part.with_suffix(".tmp")
+    pq.write_table(pa.Table.from_pylist(rows), tmp)
+    os.replace(tmp, part)  # Only complete parts are ever visible
+
+    # Per-intent aggregates for the drift report
+    stats = {}
+    for row in rows:
+        for key, intent, confidence in (("old", row["old_intent"], row["old_confidence"]),
+                                        ("new", row["new_intent"], row["new_confidence"])):
+            entry = stats.setdefault(intent, {"old_count": 0, "new_count": 0, "old_conf_sum": 0.0,
+                                              "new_conf_sum": 0.0, "changed_from": 0, "changed_to": 0})
+            entry[f"{key}_count"] += 1
+            entry[f"{key}_conf_sum"] += confidence
+        if row["old_intent"] != row["new_intent"]:
+            stats[row["old_intent"]]["changed_from"] += 1
+            stats[row["new_intent"]]["changed_to"] += 1
+    return source, index, chunk_extent(records), stats
+
+
+def merge_stats(total, stats):
+    for intent, entry in stats.items():
+        target = total.setdefault(intent, dict.fromkeys(entry, 0))
+        for key, value in entry.items():
+            target[key] += value
+
+
+def drift_report(stats):
+    old_total = sum(entry["old_count"] for entry in stats.values()) or 1
+    new_total = sum(entry["new_count"] for entry in stats.values()) or 1
+    rows = []
+    for intent, entry in sorted(stats.items()):
+        rows.append({
+            "intent": intent,
+            "old_count": entry["old_count"],
+            "new_count": entry["new_count"],
+            "old_share": entry["old_count"] / old_total,
+            "new_share": entry["new_count"] / new_total,
+            "share_delta": entry["new_count"] / new_total - entry["old_count"] / old_total,
+            "old_mean_confidence": entry["old_conf_sum"] / entry["old_count"] if entry["old_count"] else None,
+            "new_mean_confidence": entry["new_conf_sum"] / entry["new_count"] if entry["new_count"] else None,
+            "changed_from": entry["changed_from"],
+            "changed_to": entry["changed_to"],
+        })
+    return pd.DataFrame(rows)
+
+
+def source_name(path):
+    # Logs are told apart by their full path; the short hash keeps part file
+    # names unique when two directories hold logs with the same name
+    resolved = str(Path(path).resolve())
+    return resolved, f"{Path(path).stem}-{hashlib.sha1(resolved.encode()).hexdigest()[:8]}"
+
+
+def chunk_extent(records):
+    return {"rows": len(records), "first_row": records[0]["row"], "last_row": records[-1]["row"]}
+
+
+def load_checkpoint(out_dir, fingerprint, restart):
+    path = Path(out_dir) / CHECKPOINT_FILE
+    if restart or not path.exists():
+        return {"model": fingerprint, "chunks": {}}
+    with open(path, "r") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("model") != fingerprint or "chunks" not in checkpoint:
+        raise RuntimeError(
+            f"{path} was written for a different model or by an older version. "
+            "Use --restart (and a clean --out) to re-score from scratch."
+        )
+    return checkpoint
+
+
+def save_checkpoint(out_dir, checkpoint):
+    path = Path(out_dir) / CHECKPOINT_FILE
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+def run(sources, out_dir, workers, top_k, restart=False):
+    """
+    `sources` is a list of (path, part_prefix, chunks). Each finished chunk
+    is recorded with its extent and drift stats; a chunk whose extent changed
+    (a log that grew) replaces its earlier part and stats.
+    """
+    from app.backends import backend_signature
+    from app.cache import model_fingerprint
+    from app.config import INTENT_BACKEND, MODEL_PATH
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    checkpoint = load_checkpoint(out_dir, model_fingerprint(MODEL_PATH, backend_signature(INTENT_BACKEND)), restart)
+    chunks_done = checkpoint["chunks"]
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker, initargs=(threads,)) as pool:
+        pending = set()
+        for source, prefix, chunks in sources:
+            for index, records in chunks:
+                extent = chunk_extent(records)
+                previous = chunks_done.get(source, {}).get(str(index))
+                if previous is not None and all(previous[key] == value for key, value in extent.items()):
+                    continue
+                if previous is not None:
+                    logger.info(f"{source} chunk {index} changed since the last run; scoring it again")
+                # Keep only a few chunks in memory at a time
+                while len(pending) >= workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        _record(future.result(), checkpoint, out_dir)
+                pending.add(pool.submit(score_chunk, source, prefix, index, records, str(out_dir), top_k))
+        for future in pending:
+            _record(future.result(), checkpoint, out_dir)
+
+    stats, rows = {}, 0
+    for chunks in chunks_done.values():
+        for chunk in chunks.values():
+            merge_stats(stats, chunk["stats"])
+            rows += chunk["rows"]
+    report = drift_report(stats)
+    report.to_csv(out_dir / "drift_stats.csv", index=False)
+    report.to_json(out_dir / "drift_stats.json", orient="records", indent=2)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Re-scored {rows} rows in total ({elapsed:.1f}s this run); results in {out_dir}")
+    return report
+
+
+def _record(result, checkpoint, out_dir):
+    source, index, extent, stats = result
+    checkpoint["chunks"].setdefault(source, {})[str(index)] = {**extent, "stats": stats}
+    save_checkpoint(out_dir, checkpoint)
+    logger.info(f"{source} chunk {index}: {extent['rows']} rows")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score IVR call logs with the current intent model")
+    parser.add_argument("--csv", action="append", default=[], help="ivr_log.csv (or .jsonl) written by the voice client")
+    parser.add_argument("--log", action="append", default=[], help="ivr_logs.log written by the API")
+    parser.add_argument("--out", default="rescore_output", help="Directory for Parquet parts and reports")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    if not args.csv and not args.log:
+        parser.error("pass at least one --csv or --log")
+    sources = [(*source_name(path), read_csv_chunks(path, args.chunk_size)) for path in args.csv]
+    sources += [(*source_name(path), read_log_chunks(path, args.chunk_size)) for path in args.log]
+
+    report = run(sources, args.out, args.workers, args.top_k, args.restart)
+    print(report.to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
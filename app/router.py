@@ -1,10 +1,18 @@
-from app.nlp import process_user_query, mask_sensitive_data, handle_transfer_conversation
+import asyncio
+
+from app import tracing
+from app.nlp import process_user_query, mask_sensitive_data, handle_transfer_conversation, prefetcher
+from app.config import PREFETCH_WAIT_SECONDS
 
 from app.tools import (
     check_balance_tool,
     report_fraud_tool,
     open_account_tool,
     loan_status_tool,
+    check_balance_async,
+    report_fraud_async,
+    open_account_async,
+    loan_status_async,
 )
 
 class AutoGenRouter:
@@ -15,9 +23,19 @@ class AutoGenRouter:
             "open_account": open_account_tool,
             "loan_application": loan_status_tool,
         }
+        self.async_tool_registry = {
+            "balance": check_balance_async,
+            "fraud_report": report_fraud_async,
+            "open_account": open_account_async,
+            "loan_application": loan_status_async,
+        }
         self.confidence_threshold = 0.5
 
     def route(self, query: str, predicted_intent: str, confidence: float, session_id="user-session"):
+        with tracing.span("router.route", intent=predicted_intent):
+            return self._route(query, predicted_intent, confidence, session_id)
+
+    def _route(self, query, predicted_intent, confidence, session_id):
         if confidence < self.confidence_threshold:
             return "Low confidence in intent classification. Please rephrase your query."
 
@@ -31,7 +49,40 @@ class AutoGenRouter:
             return f"Sorry, I couldn't process the intent '{predicted_intent}' at the moment."
 
         try:
-            result = tool(query)
+            prefetched = prefetcher.take(session_id, query, predicted_intent) if prefetcher else None
+            with tracing.span(f"tool.{predicted_intent}", prefetched=prefetched is not None):
+                if prefetched is not None:
+                    result = prefetched.result(timeout=PREFETCH_WAIT_SECONDS)
+                else:
+                    result = tool(query)
+            return mask_sensitive_data(result)
+        except Exception as e:
+            return f"Error while handling your request: {str(e)}"
+
+    async def aroute(self, query: str, predicted_intent: str, confidence: float, session_id="user-session", executor=None):
+        # Same contract as route(), without blocking the event loop
+        with tracing.span("router.route", intent=predicted_intent):
+            return await self._aroute(query, predicted_intent, confidence, session_id, executor)
+
+    async def _aroute(self, query, predicted_intent, confidence, session_id, executor):
+        if confidence < self.confidence_threshold:
+            return "Low confidence in intent classification. Please rephrase your query."
+
+        if predicted_intent == "transfer":
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, tracing.bind(handle_transfer_conversation), session_id, query)
+
+        tool = self.async_tool_registry.get(predicted_intent)
+        if not tool:
+            return f"Sorry, I couldn't process the intent '{predicted_intent}' at the moment."
+
+        try:
+            prefetched = prefetcher.take(session_id, query, predicted_intent) if prefetcher else None
+            with tracing.span(f"tool.{predicted_intent}", prefetched=prefetched is not None):
+                if prefetched is not None:
+                    result = await asyncio.wait_for(asyncio.wrap_future(prefetched), PREFETCH_WAIT_SECONDS)
+                else:
+                    result = await tool(query)
             return mask_sensitive_data(result)
         except Exception as e:
             return f"Error while handling your request: {str(e)}"
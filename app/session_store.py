@@ -0,0 +1,385 @@
+import abc
+import argparse
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.managers import BaseManager
+
+from app import tracing
+from app.ipc import load_authkey, remove_stale_socket, resolve_address
+
+logger = logging.getLogger(__name__)
+
+# Where conversation state (intent, stage, slots) lives between turns.
+# get_state/save_state/reset_state in app/nlp.py sit on top of these.
+
+
+SESSION_STORE_NAME = "session-store"
+
+
+class SessionStore(abc.ABC):
+    """
+    Interface for session state backends. States are plain JSON-able dicts;
+    callers must `set` a state again after changing it.
+    """
+
+    @abc.abstractmethod
+    def get(self, session_id):
+        ...
+
+    @abc.abstractmethod
+    def set(self, session_id, state):
+        ...
+
+    @abc.abstractmethod
+    def delete(self, session_id):
+        ...
+
+    def get_many(self, session_ids):
+        return {session_id: self.get(session_id) for session_id in session_ids}
+
+    def set_many(self, states):
+        for session_id, state in states.items():
+            self.set(session_id, state)
+
+    def delete_many(self, session_ids):
+        for session_id in session_ids:
+            self.delete(session_id)
+
+    @abc.abstractmethod
+    def count(self):
+        ...
+
+    @abc.abstractmethod
+    def memory_bytes(self):
+        ...
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Per-process store. Sessions idle for longer than `ttl` seconds expire and
+    the least recently used ones are evicted beyond `max_size`.
+    """
+
+    def __init__(self, ttl=1800, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._sessions = OrderedDict()  # session_id -> (state, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, session_id):
+        _, _, size = self._sessions.pop(session_id)
+        self._bytes -= size
+
+    def _purge_expired(self, now):
+        # Entries are kept in last-touched order, so expired ones are at the front
+        while self._sessions:
+            session_id, (_, expires_at, _) = next(iter(self._sessions.items()))
+            if expires_at >= now:
+                break
+            self._drop(session_id)
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            state, expires_at, size = entry
+            if expires_at < now:
+                self._drop(session_id)
+                return None
+            self._sessions[session_id] = (state, now + self.ttl, size)
+            self._sessions.move_to_end(session_id)
+            return state
+
+    def set(self, session_id, state):
+        now = time.monotonic()
+        size = len(json.dumps(state))
+        with self._lock:
+            if session_id in self._sessions:
+                self._drop(session_id)
+            self._sessions[session_id] = (state, now + self.ttl, size)
+            self._bytes += size
+            self._purge_expired(now)
+            while len(self._sessions) > self.max_size:
+                self._drop(next(iter(self._sessions)))
+
+    def delete(self, session_id):
+        with self._lock:
+            if session_id in self._sessions:
+                self._drop(session_id)
+
+    def count(self):
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            return len(self._sessions)
+
+    def memory_bytes(self):
+        # Serialized size of the live states, a proxy for their footprint
+        with self._lock:
+            return self._bytes
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Session state in a SQLite database in WAL mode, so every worker process
+    on the node reads and writes the same sessions. Rows idle for longer than
+    `ttl` seconds are ignored and purged periodically.
+    """
+
+    PURGE_INTERVAL = 60.0
+
+    def __init__(self, path, ttl=1800):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._purged_at = 0.0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _connection(self):
+        # SQLite connections can't cross threads or forks, so keep one per
+        # thread and open a new one when running in a forked child
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _cutoff(self):
+        return time.time() - self.ttl
+
+    def _maybe_purge(self, conn):
+        now = time.monotonic()
+        if now - self._purged_at >= self.PURGE_INTERVAL:
+            self._purged_at = now
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (self._cutoff(),))
+
+    def get(self, session_id):
+        return self.get_many([session_id])[session_id]
+
+    def get_many(self, session_ids):
+        session_ids = list(session_ids)
+        states = dict.fromkeys(session_ids)
+        if not session_ids:
+            return states
+        placeholders = ",".join("?" * len(session_ids))
+        rows = self._connection().execute(
+            f"SELECT session_id, state FROM sessions WHERE session_id IN ({placeholders}) AND updated_at >= ?",
+            (*session_ids, self._cutoff()),
+        ).fetchall()
+        for session_id, state in rows:
+            states[session_id] = json.loads(state)
+        return states
+
+    def set(self, session_id, state):
+        self.set_many({session_id: state})
+
+    def set_many(self, states):
+        if not states:
+            return
+        conn = self._connection()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?)",
+                [(session_id, json.dumps(state), now) for session_id, state in states.items()],
+            )
+        self._maybe_purge(conn)
+
+    def delete(self, session_id):
+        self.delete_many([session_id])
+
+    def delete_many(self, session_ids):
+        session_ids = list(session_ids)
+        if not session_ids:
+            return
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("DELETE FROM sessions WHERE session_id = ?", [(s,) for s in session_ids])
+
+    def count(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM sessions WHERE updated_at >= ?", (self._cutoff(),)
+        ).fetchone()[0]
+
+    def memory_bytes(self):
+        conn = self._connection()
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+
+
+class SessionManager(BaseManager):
+    pass
+
+
+class SocketSessionStore(SessionStore):
+    """
+    Client for an InMemorySessionStore served by `python -m app.session_store`
+    over a local socket, for workers that shouldn't share a database file.
+    The address and authkey default to the private socket and generated key
+    described in app/ipc.py.
+    """
+
+    def __init__(self, address, authkey, runtime_dir=""):
+        self.address = resolve_address(address, SESSION_STORE_NAME, runtime_dir, "127.0.0.1:50056")
+        self.authkey = load_authkey(authkey, SESSION_STORE_NAME, runtime_dir)
+        self._local = threading.local()
+
+    def _remote(self):
+        # Manager connections aren't fork-safe either
+        remote = getattr(self._local, "remote", None)
+        if remote is None or self._local.pid != os.getpid():
+            SessionManager.register("get_store")
+            manager = SessionManager(address=self.address, authkey=self.authkey)
+            manager.connect()
+            remote = self._local.remote = manager.get_store()
+            self._local.pid = os.getpid()
+        return remote
+
+    def get(self, session_id):
+        return self._remote().get(session_id)
+
+    def set(self, session_id, state):
+        self._remote().set(session_id, state)
+
+    def delete(self, session_id):
+        self._remote().delete(session_id)
+
+    def get_many(self, session_ids):
+        return self._remote().get_many(list(session_ids))
+
+    def set_many(self, states):
+        self._remote().set_many(states)
+
+    def delete_many(self, session_ids):
+        self._remote().delete_many(list(session_ids))
+
+    def count(self):
+        return self._remote().count()
+
+    def memory_bytes(self):
+        return self._remote().memory_bytes()
+
+
+def serve(address, authkey, ttl, max_size, runtime_dir=""):
+    # States hold account numbers and amounts, so there is no default key;
+    # see app/ipc.py
+    address = resolve_address(address, SESSION_STORE_NAME, runtime_dir, "127.0.0.1:50056")
+    key = load_authkey(authkey, SESSION_STORE_NAME, runtime_dir, create=True)
+    remove_stale_socket(address)
+    store = InMemorySessionStore(ttl, max_size)
+    SessionManager.register("get_store", callable=lambda: store)
+    manager = SessionManager(address=address, authkey=key)
+    logger.info(f"Session store server listening on {address}")
+    manager.get_server().serve_forever()
+
+
+_DELETED = object()
+_request_buffer = contextvars.ContextVar("session_request_buffer", default=None)
+
+
+class BufferedSessionStore:
+    """
+    Wraps a store so that, inside `batch()`, every session a request touches
+    is read at most once and all writes go out together when the request
+    finishes. Outside a batch, calls pass straight through.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    @contextmanager
+    def batch(self):
+        if _request_buffer.get() is not None:
+            yield  # Already batching; the outer batch flushes
+            return
+        buffer = {"reads": {}, "writes": {}}
+        token = _request_buffer.set(buffer)
+        try:
+            yield
+        finally:
+            _request_buffer.reset(token)
+            self._flush(buffer["writes"])
+
+    def _flush(self, writes):
+        if not writes:
+            return
+        deletes = [session_id for session_id, state in writes.items() if state is _DELETED]
+        updates = {session_id: state for session_id, state in writes.items() if state is not _DELETED}
+        with tracing.span("session_store.flush"):
+            if deletes:
+                self.store.delete_many(deletes)
+            if updates:
+                self.store.set_many(updates)
+
+    def get(self, session_id):
+        buffer = _request_buffer.get()
+        if buffer is None:
+            return self.store.get(session_id)
+        if session_id in buffer["writes"]:
+            state = buffer["writes"][session_id]
+            return None if state is _DELETED else state
+        if session_id not in buffer["reads"]:
+            buffer["reads"][session_id] = self.store.get(session_id)
+        return buffer["reads"][session_id]
+
+    def set(self, session_id, state):
+        buffer = _request_buffer.get()
+        if buffer is None:
+            self.store.set(session_id, state)
+        else:
+            buffer["writes"][session_id] = state
+
+    def delete(self, session_id):
+        buffer = _request_buffer.get()
+        if buffer is None:
+            self.store.delete(session_id)
+        else:
+            buffer["writes"][session_id] = _DELETED
+
+    def count(self):
+        return self.store.count()
+
+    def memory_bytes(self):
+        return self.store.memory_bytes()
+
+
+def create_session_store(backend, db_path=None, ttl=1800, max_size=100000, address="", authkey="", runtime_dir=""):
+    if backend == "memory":
+        store = InMemorySessionStore(ttl, max_size)
+    elif backend == "sqlite":
+        store = SqliteSessionStore(db_path, ttl)
+    elif backend == "socket":
+        store = SocketSessionStore(address, authkey, runtime_dir)
+    else:
+        raise ValueError(f"Unknown session store '{backend}'. Use memory, sqlite or socket.")
+    return BufferedSessionStore(store)
+
+
+if __name__ == "__main__":
+    from app.config import RUNTIME_DIR, SESSION_ADDRESS, SESSION_AUTHKEY, SESSION_MAX_SIZE, SESSION_TTL
+
+    parser = argparse.ArgumentParser(description="Serve session state to several worker processes")
+    parser.add_argument("--address", default=SESSION_ADDRESS,
+                        help="Unix socket path or host:port (default: session-store.sock in the runtime directory)")
+    parser.add_argument("--ttl", type=float, default=SESSION_TTL)
+    parser.add_argument("--max-size", type=int, default=SESSION_MAX_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    serve(args.address, SESSION_AUTHKEY, args.ttl, args.max_size, RUNTIME_DIR)
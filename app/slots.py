@@ -0,0 +1,71 @@
+import re
+
+# Cheap deterministic parsers for the slots of multi-turn flows. Each parser
+# returns None when it can't interpret the input, so the caller can fall back
+# to the intent model.
+
+CANCEL_WORDS = {"cancel", "nevermind", "never mind", "stop", "abort", "quit"}
+YES_WORDS = {"yes", "y", "yeah", "yep", "yup", "sure", "ok", "okay", "confirm", "confirmed", "correct", "go ahead", "do it"}
+NO_WORDS = {"no", "n", "nope", "nah", "wrong", "incorrect", "dont", "do not"}
+
+ACCOUNT_TYPES = ("savings", "checking", "current", "salary", "business", "joint", "credit", "loan")
+
+_amount_re = re.compile(r"^(?:rs\.?|inr|usd)?\s*[$₹]?\s*(\d{1,3}(?:,\d{2,3})+|\d+)(?:\.(\d{1,2}))?\s*(?:rs|rupees?|inr|dollars?|usd)?$")
+_account_number_re = re.compile(r"^(?:(?:account|acct|a/c)\s*(?:number|no\.?|#)?\s*(?:ending\s*(?:in|with)?\s*)?)?(\d[\d\s-]{2,22}\d)$")
+_account_type_re = re.compile(r"^(?:(?:from|to|my|the)\s+)*(" + "|".join(ACCOUNT_TYPES) + r")(?:\s+account)?$")
+
+
+_please_re = re.compile(r"^please\s+|[\s,]+please$")
+
+
+def _normalize(text):
+    normalized = re.sub(r"\s+", " ", text.strip().lower()).rstrip(".!")
+    return _please_re.sub("", normalized)
+
+
+def is_cancel(text):
+    return _normalize(text) in CANCEL_WORDS
+
+
+def parse_yes_no(text):
+    normalized = _normalize(text).replace("'", "")
+    if normalized in YES_WORDS:
+        return True
+    if normalized in NO_WORDS:
+        return False
+    return None
+
+
+def parse_amount(text):
+    match = _amount_re.match(_normalize(text))
+    if not match:
+        return None
+    whole, fraction = match.groups()
+    return float(whole.replace(",", "") + (f".{fraction}" if fraction else ""))
+
+
+def parse_account(text):
+    normalized = _normalize(text)
+    match = _account_number_re.match(normalized)
+    if match:
+        return re.sub(r"[\s-]", "", match.group(1))
+    match = _account_type_re.match(normalized)
+    if match:
+        return f"{match.group(1)} account"
+    return None
+
+
+# Parser used for each stage of the transfer flow
+TRANSFER_SLOT_PARSERS = {
+    "source": parse_account,
+    "destination": parse_account,
+    "amount": parse_amount,
+    "confirm": parse_yes_no,
+}
+
+
+def parse_slot(stage, text):
+    parser = TRANSFER_SLOT_PARSERS.get(stage)
+    if parser is None:
+        return None
+    return parser(text)
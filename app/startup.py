@@ -0,0 +1,76 @@
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from app import metrics
+from app.config import WARM_UP_BACKOFF, WARM_UP_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Startup bookkeeping: how long each phase took, and whether the warm-up
+# inference has run. /readyz reports ready only after warm-up; /healthz
+# only says the process is up.
+
+_started = time.perf_counter()
+_lock = threading.Lock()
+phases = []  # (name, seconds) in the order they finished
+ready = threading.Event()
+
+
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        phases.append((name, seconds))
+        metrics.gauge("startup_phase_seconds", "Time spent in each startup phase", labels={"phase": name}).set(
+            round(seconds, 4)
+        )
+
+
+def breakdown():
+    lines = [f"  {name:<28} {seconds * 1000:>9.1f} ms" for name, seconds in phases]
+    lines.append(f"  {'total since app import':<28} {(time.perf_counter() - _started) * 1000:>9.1f} ms")
+    return "Startup time breakdown:\n" + "\n".join(lines)
+
+
+def warm_up(fn, retries=WARM_UP_RETRIES):
+    """
+    Runs `fn` (the warm-up inference) once per process and marks the
+    process ready. A failed attempt is retried with exponential backoff,
+    `retries` times or forever when None. Returns whether the process is
+    ready. Safe to call from several places; later calls return at once.
+    """
+    with _lock:
+        if ready.is_set():
+            return True
+        attempt, delay = 0, WARM_UP_BACKOFF
+        with phase("warm-up inference"):
+            while True:
+                try:
+                    fn()
+                    break
+                except Exception as e:
+                    if retries is not None and attempt >= retries:
+                        logger.error(f"Warm-up failed after {attempt + 1} attempt(s), staying unready: {e}")
+                        return False
+                    logger.warning(f"Warm-up failed, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                attempt, delay = attempt + 1, min(delay * 2, 30.0)
+        ready.set()
+    report = breakdown()
+    # The log file handler keeps the record; stderr is what the person
+    # starting the server sees
+    logger.info(report)
+    print(f"[pid {os.getpid()}] {report}", file=sys.stderr, flush=True)
+    return True
+
+
+def warm_up_in_background(fn):
+    # A single process has nobody to replace it, so it keeps retrying
+    threading.Thread(target=warm_up, args=(fn, None), name="warm-up", daemon=True).start()
@@ -0,0 +1,231 @@
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from app.model import CSV_PATH, HYPERPARAMETERS, MODEL_NAME, PADDING, MAX_LENGTH, MAX_LENGTH_PERCENTILE
+
+logger = logging.getLogger(__name__)
+
+# Hyperparameter sweep over app.model.train(). Trials run in parallel
+# processes, each pinned to its own set of CPU cores with torch limited to
+# that many threads, so N trials share a training box without fighting over
+# cores. Every trial stops early once eval F1 plateaus. The best trial's
+# model is copied to <out>/best with its label maps, and leaderboard.csv
+# ranks all trials.
+#
+#   python -m app.sweep --param learning_rate=2e-5,3e-5,5e-5 --param batch_size=8,16 --parallel 4
+
+TRIALS_DIR = "trials"
+BEST_DIR = "best"
+RESULT_FILE = "result.json"
+BEST_MODEL_FILES = ("label2id.json", "id2label.json")
+
+
+def parse_value(text):
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+
+def parse_space(params):
+    # ["learning_rate=2e-5,3e-5", "batch_size=8,16"] -> {"learning_rate": [2e-05, 3e-05], ...}
+    space = {}
+    for param in params:
+        name, _, values = param.partition("=")
+        if name not in HYPERPARAMETERS:
+            raise ValueError(f"Unknown hyperparameter '{name}'. Choose from {', '.join(HYPERPARAMETERS)}.")
+        space[name] = [parse_value(value) for value in values.split(",") if value]
+    return space
+
+
+def build_trials(space, search="grid", num_trials=None, seed=0):
+    names = list(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+    if search == "random":
+        grid = random.Random(seed).sample(grid, min(num_trials or len(grid), len(grid)))
+    return [{**HYPERPARAMETERS, **params} for params in grid]
+
+
+def core_sets(parallel, cores_per_trial=None):
+    # Disjoint core subsets, one per concurrently running trial
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    per_trial = cores_per_trial or max(1, len(available) // parallel)
+    return [available[i * per_trial:(i + 1) * per_trial] or available for i in range(parallel)]
+
+
+def init_trial_worker(cores_queue):
+    # Runs once per worker process, before torch is imported there
+    cores = cores_queue.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    threads = str(len(cores))
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = threads
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    import torch
+
+    torch.set_num_threads(len(cores))
+    torch.set_num_interop_threads(1)
+
+
+def run_trial(trial_id, params, out_dir, csv_path, model_name, patience, threshold, data_options):
+    from app.model import train
+
+    trial_dir = Path(out_dir) / TRIALS_DIR / trial_id
+    trial_dir.mkdir(parents=True, exist_ok=True)
+    handler = logging.FileHandler(trial_dir / "training.log")
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    logging.getLogger().addHandler(handler)
+    logging.getLogger().setLevel(logging.INFO)
+
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    started = time.perf_counter()
+    result = {"trial": trial_id, "params": params, "cores": cores, "pid": os.getpid()}
+    try:
+        metrics = train(
+            save_dir=str(trial_dir), csv_path=csv_path, model_name=model_name, early_stopping_patience=patience,
+            early_stopping_threshold=threshold, logging_dir=str(trial_dir / "logs"), report_to="none",
+            **data_options, **params,
+        )
+        result.update({
+            "status": "ok",
+            "f1": metrics.get("eval_f1"),
+            "accuracy": metrics.get("eval_accuracy"),
+            "eval_loss": metrics.get("eval_loss"),
+            "epochs_run": metrics.get("epochs_run"),
+            "stopped_early": metrics.get("epochs_run", 0) < params["epochs"],
+        })
+    except Exception as e:
+        logger.exception(f"Trial {trial_id} failed")
+        result.update({"status": "failed", "error": str(e)})
+    finally:
+        logging.getLogger().removeHandler(handler)
+        handler.close()
+    result["seconds"] = round(time.perf_counter() - started, 1)
+
+    # Intermediate checkpoints aren't needed once the best epoch is saved
+    for checkpoint in trial_dir.glob("checkpoint-*"):
+        shutil.rmtree(checkpoint, ignore_errors=True)
+    with open(trial_dir / RESULT_FILE, "w") as f:
+        json.dump(result, f, indent=2)
+    return result
+
+
+def leaderboard(results):
+    rows = [{"trial": r["trial"], "status": r["status"], "f1": r.get("f1"), "accuracy": r.get("accuracy"),
+             "eval_loss": r.get("eval_loss"), "epochs_run": r.get("epochs_run"),
+             "stopped_early": r.get("stopped_early"), "seconds": r["seconds"], **r["params"]} for r in results]
+    df = pd.DataFrame(rows)
+    df["f1"] = df["f1"].astype(float)
+    return df.sort_values(["f1", "seconds"], ascending=[False, True], na_position="last").reset_index(drop=True)
+
+
+def promote_best(out_dir, trial_id, best_dir=None):
+    # Copy the winning model with its tokenizer and label maps
+    source = Path(out_dir) / TRIALS_DIR / trial_id
+    target = Path(best_dir or Path(out_dir) / BEST_DIR)
+    if target.exists():
+        shutil.rmtree(target)
+    shutil.copytree(source, target, ignore=shutil.ignore_patterns("logs", "training.log", "checkpoint-*"))
+    missing = [name for name in BEST_MODEL_FILES if not (target / name).exists()]
+    if missing:
+        raise FileNotFoundError(f"Best trial {trial_id} is missing {', '.join(missing)}")
+    return target
+
+
+def run_sweep(trials, out_dir, parallel=1, cores_per_trial=None, csv_path=CSV_PATH, model_name=MODEL_NAME,
+              patience=2, threshold=0.0, best_dir=None, data_options=None):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    data_options = data_options or {}
+    with open(out_dir / "sweep.json", "w") as f:
+        json.dump({"trials": trials, "parallel": parallel, "csv": csv_path, "model": model_name,
+                   "patience": patience, "threshold": threshold, **data_options}, f, indent=2)
+
+    # Tokenize once up front so the trials all start from the preprocessing cache
+    from transformers import AutoTokenizer
+    from app.preprocess import prepare_dataset
+
+    prepare_dataset(csv_path, AutoTokenizer.from_pretrained(model_name), data_options.get("max_length", MAX_LENGTH),
+                    data_options.get("max_length_percentile", MAX_LENGTH_PERCENTILE),
+                    data_options.get("padding", PADDING), test_size=0.2, seed=42)
+
+    # Spawned workers start without torch's thread pools, so the pinning in
+    # init_trial_worker takes effect
+    context = multiprocessing.get_context("spawn")
+    cores_queue = context.Queue()
+    for cores in core_sets(parallel, cores_per_trial):
+        cores_queue.put(cores)
+        logger.info(f"Trial slot pinned to cores {cores}")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=parallel, mp_context=context, initializer=init_trial_worker,
+                             initargs=(cores_queue,)) as executor:
+        futures = {
+            executor.submit(run_trial, f"trial-{index:03d}", params, str(out_dir), csv_path, model_name,
+                            patience, threshold, data_options): params
+            for index, params in enumerate(trials)
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            logger.info(f"{result['trial']} {result['status']}: f1={result.get('f1')} in {result['seconds']}s "
+                        f"({len(results)}/{len(trials)} done)")
+
+    board = leaderboard(results)
+    board.to_csv(out_dir / "leaderboard.csv", index=False)
+    best = board[board["status"] == "ok"].head(1)
+    best_path = promote_best(out_dir, best.iloc[0]["trial"], best_dir) if len(best) else None
+    return board, best_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep for the intent model")
+    parser.add_argument("--param", action="append", default=[],
+                        help="name=v1,v2,... (repeatable); one of " + ", ".join(HYPERPARAMETERS))
+    parser.add_argument("--search", default="grid", choices=["grid", "random"])
+    parser.add_argument("--trials", type=int, help="Combinations sampled by --search random")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for --search random")
+    parser.add_argument("--parallel", type=int, default=2, help="Trials run at the same time")
+    parser.add_argument("--cores-per-trial", type=int, help="Default: the available cores split evenly")
+    parser.add_argument("--patience", type=int, default=2, help="Epochs without an eval F1 gain before stopping")
+    parser.add_argument("--threshold", type=float, default=0.001, help="Smallest F1 gain that counts")
+    parser.add_argument("--csv", default=CSV_PATH)
+    parser.add_argument("--model-name", default=MODEL_NAME)
+    parser.add_argument("--padding", default=PADDING, choices=["dynamic", "max_length"])
+    parser.add_argument("--out", default="sweeps/sweep-" + time.strftime("%Y%m%d-%H%M%S"))
+    parser.add_argument("--best-dir", help="Where to copy the best model (default: <out>/best)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    trials = build_trials(parse_space(args.param), args.search, args.trials, args.seed)
+    logger.info(f"Running {len(trials)} trials, {args.parallel} at a time, into {args.out}")
+    board, best_path = run_sweep(
+        trials, args.out, args.parallel, args.cores_per_trial, args.csv, args.model_name, args.patience,
+        args.threshold, args.best_dir, {"padding": args.padding},
+    )
+    print(board.to_string(index=False))
+    if best_path is None:
+        print("Every trial failed; see the training.log of each trial")
+        return 1
+    print(f"\nBest model ({board.iloc[0]['trial']}, f1={board.iloc[0]['f1']:.4f}) copied to {best_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,37 @@
-import requests
-from langchain.tools import tool
+import functools
+import inspect
 
-API_BASE_URL = "http://localhost:5001"  # <-- Replace with your actual API base URL
+from app.banking_client import banking_client
+
+# Every tool goes through the shared banking client: pooled keep-alive
+# connections, per-endpoint timeouts/retries and a circuit breaker
+
+class Tool:
+    """
+    A plain callable with the parts of the LangChain tool interface the app
+    uses (`invoke`, `name`, `description`). LangChain takes seconds to
+    import, so it is only loaded when an agent asks for `as_langchain()`.
+    """
+
+    def __init__(self, fn):
+        functools.update_wrapper(self, fn)
+        self.fn = fn
+        self.name = fn.__name__
+        self.description = inspect.getdoc(fn)
+
+    def __call__(self, query):
+        return self.fn(query)
+
+    def invoke(self, input, config=None, **kwargs):
+        return self.fn(input["query"] if isinstance(input, dict) else input)
+
+    def as_langchain(self):
+        from langchain.tools import tool as langchain_tool
+
+        return langchain_tool(self.fn)
+
+def tool(fn):
+    return Tool(fn)
 
 @tool
 def check_balance_tool(query: str) -> str:
@@ -9,9 +39,7 @@ def check_balance_tool(query: str) -> str:
     Check the current account balance of the user.
     """
     try:
-        response = requests.post(f"{API_BASE_URL}/balance", json={"query": query})
-        response.raise_for_status()
-        data = response.json()
+        data = banking_client.post("/balance", query)
         return data.get("message", "Balance info not available.")
     except Exception as e:
         return "Unable to fetch account balance right now."
@@ -22,9 +50,7 @@ def transfer_money_tool(query: str) -> str:
     Initiate a money transfer to another account.
     """
     try:
-        response = requests.post(f"{API_BASE_URL}/transfer", json={"query": query})
-        response.raise_for_status()
-        data = response.json()
+        data = banking_client.post("/transfer", query)
         return data.get("message", "Transfer info not available.")
     except Exception as e:
         return "Unable to initiate money transfer at the moment."
@@ -35,9 +61,7 @@ def report_fraud_tool(query: str) -> str:
     Report a fraudulent or suspicious transaction.
     """
     try:
-        response = requests.post(f"{API_BASE_URL}/report-fraud", json={"query": query})
-        response.raise_for_status()
-        data = response.json()
+        data = banking_client.post("/report-fraud", query)
         return data.get("message", "Fraud report not processed.")
     except Exception as e:
         return "Unable to report fraud right now."
@@ -48,9 +72,7 @@ def open_account_tool(query: str) -> str:
     Send a link to open a new bank account.
     """
     try:
-        response = requests.post(f"{API_BASE_URL}/open-account", json={"query": query})
-        response.raise_for_status()
-        data = response.json()
+        data = banking_client.post("/open-account", query)
         return data.get("message", "Account opening link not sent.")
     except Exception as e:
         return "Unable to send account opening link."
@@ -61,9 +83,46 @@ def loan_status_tool(query: str) -> str:
     Retrieve the status of a loan application.
     """
     try:
-        response = requests.post(f"{API_BASE_URL}/loan-status", json={"query": query})
-        response.raise_for_status()
-        data = response.json()
+        data = banking_client.post("/loan-status", query)
         return data.get("message", "Loan status not available.")
     except Exception as e:
         return "Unable to retrieve loan status right now."
+
+def as_langchain_tools():
+    # For agent frameworks that expect LangChain tools
+    return [t.as_langchain() for t in (check_balance_tool, transfer_money_tool, report_fraud_tool,
+                                       open_account_tool, loan_status_tool)]
+
+def run_tools_concurrently(calls):
+    """
+    Run independent tool calls at the same time, e.g.
+    run_tools_concurrently([(check_balance_tool, query), (loan_status_tool, query)]).
+    Results come back in the same order as `calls`.
+    """
+    return banking_client.run_concurrently([(tool.invoke, query) for tool, query in calls])
+
+# Async variants used by the ASGI app. They share the client's breakers,
+# retry budget and metrics, over one pooled async connection pool. Transfers
+# have none: they go through the multi-turn flow in app/nlp.py, which calls
+# transfer_money_tool on an executor thread once the caller confirms.
+async def close_async_client():
+    await banking_client.aclose()
+
+async def _post_async(path, query, default_message, error_message):
+    try:
+        data = await banking_client.apost(path, query)
+        return data.get("message", default_message)
+    except Exception as e:
+        return error_message
+
+async def check_balance_async(query: str) -> str:
+    return await _post_async("/balance", query, "Balance info not available.", "Unable to fetch account balance right now.")
+
+async def report_fraud_async(query: str) -> str:
+    return await _post_async("/report-fraud", query, "Fraud report not processed.", "Unable to report fraud right now.")
+
+async def open_account_async(query: str) -> str:
+    return await _post_async("/open-account", query, "Account opening link not sent.", "Unable to send account opening link.")
+
+async def loan_status_async(query: str) -> str:
+    return await _post_async("/loan-status", query, "Loan status not available.", "Unable to retrieve loan status right now.")
@@ -0,0 +1,246 @@
+import argparse
+import atexit
+import contextvars
+import functools
+import glob
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from app import metrics
+from app.config import TRACE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Lightweight tracing for the IVR pipeline. Every span feeds the
+# stage_latency_seconds{stage=...} histogram on /metrics and, when
+# IVR_TRACE_DIR is set, is written to <dir>/trace-<pid>.json in the Chrome
+# trace event format (open in chrome://tracing or https://ui.perfetto.dev).
+# Context crosses process boundaries as a W3C-style "traceparent" string in
+# the request payload.
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+EXPORT_BATCH_SIZE = 256
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_histograms = {}
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attrs", "wall_start", "start")
+
+    def __init__(self, name, trace_id, parent_id, attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+
+    def set(self, key, value):
+        self.attrs[key] = value
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+def parse_traceparent(value):
+    # "00-<32 hex trace id>-<16 hex parent span id>-<flags>"
+    parts = value.split("-") if isinstance(value, str) else []
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2]
+
+
+def _stage_histogram(name):
+    histogram = _histograms.get(name)
+    if histogram is None:
+        histogram = _histograms[name] = metrics.histogram(
+            "stage_latency_seconds", "Time spent in each pipeline stage", STAGE_BUCKETS, labels={"stage": name}
+        )
+    return histogram
+
+
+@contextmanager
+def span(name, traceparent=None, **attrs):
+    """
+    Times a pipeline stage. Nested spans join the current trace; pass
+    `traceparent` to continue a trace started in another process.
+    """
+    parent = _current_span.get()
+    remote = parse_traceparent(traceparent) if traceparent else None
+    if remote:
+        trace_id, parent_id = remote
+    elif parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+
+    current = Span(name, trace_id, parent_id, attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        duration = time.perf_counter() - current.start
+        _stage_histogram(name).observe(duration)
+        if exporter is not None:
+            exporter.export(current, duration)
+
+
+def traced(name):
+    # Decorator form of span() for whole functions
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_traceparent():
+    current = _current_span.get()
+    return current.traceparent if current is not None else None
+
+
+def current_trace_id():
+    current = _current_span.get()
+    return current.trace_id if current is not None else None
+
+
+def bind(fn):
+    # Carry the current trace into a thread pool (run_in_executor doesn't)
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+class ChromeTraceExporter:
+    """
+    Appends finished spans to a per-process file from a background thread.
+    The file is a JSON array of "complete" events that is left open-ended,
+    which both trace viewers accept; `python -m app.tracing merge` joins the
+    files of several processes into one.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.drain)
+
+    def export(self, finished, duration):
+        self._ensure_writer()
+        self._queue.put({
+            "name": finished.name,
+            "cat": "ivr",
+            "ph": "X",
+            "ts": int(finished.wall_start * 1e6),
+            "dur": int(duration * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": {
+                "trace_id": finished.trace_id,
+                "span_id": finished.span_id,
+                "parent_id": finished.parent_id,
+                **finished.attrs,
+            },
+        })
+
+    def _ensure_writer(self):
+        if self._writer is not None and self._writer.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()  # Forked child starts with its own file and queue
+                self._pid = os.getpid()
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._writer.start()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"trace-{os.getpid()}.json")
+
+    def _take_batch(self, block):
+        batch = [self._queue.get(block=block)]
+        while len(batch) < EXPORT_BATCH_SIZE:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, events):
+        with open(self.path, "a", encoding="utf-8") as f:
+            if f.tell() == 0:
+                f.write("[\n")
+            f.write("".join(json.dumps(event, default=str) + ",\n" for event in events))
+
+    def _run(self):
+        while True:
+            try:
+                self._write(self._take_batch(block=True))
+            except Exception as e:
+                logger.error(f"Trace export failed: {e}")
+
+    def drain(self):
+        while True:
+            try:
+                batch = self._take_batch(block=False)
+            except queue.Empty:
+                return
+            self._write(batch)
+
+
+exporter = ChromeTraceExporter(TRACE_DIR) if TRACE_DIR else None
+
+
+def load_events(path):
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().rstrip().rstrip(",")
+    if not text:
+        return []
+    if not text.endswith("]"):
+        text += "]"
+    return json.loads(text)
+
+
+def merge(directory, output, trace_id=None):
+    events = []
+    for path in sorted(glob.glob(os.path.join(directory, "trace-*.json"))):
+        events.extend(load_events(path))
+    if trace_id:
+        events = [event for event in events if event["args"].get("trace_id") == trace_id]
+    events.sort(key=lambda event: event["ts"])
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge per-process trace files into one Chrome trace")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    merge_parser = subparsers.add_parser("merge")
+    merge_parser.add_argument("directory", nargs="?", default=TRACE_DIR or "traces")
+    merge_parser.add_argument("-o", "--output", default="trace.json")
+    merge_parser.add_argument("--trace-id", help="Keep only the spans of one trace")
+    args = parser.parse_args()
+    count = merge(args.directory, args.output, args.trace_id)
+    print(f"Wrote {count} spans to {args.output}")
@@ -1,20 +1,33 @@
+# Run from the repository root: python -m app.voice_assistant
 import speech_recognition as sr
 import pyttsx3
 import requests
-import pandas as pd
 import logging
+import numpy as np
 import whisper
 import os
+import queue
 import subprocess
+import threading
 import uuid  # To generate a unique session ID
+from datetime import datetime
+
+from app import tracing
+from app.call_log import CallLogWriter
 
 # Configuration
 API_URL = "http://localhost:5000/predict_intent"
 LOG_FILE = "D:/IVR Case-02/splunk.log"
 CSV_LOG = "D:/IVR Case-02/ivr_log.csv"
+CALL_LOG_FORMAT = "csv"  # csv, or jsonl (write to a .jsonl path)
+CALL_LOG_FLUSH_EVERY = 20  # Rows buffered before they are appended to the call log
 WHISPER_MODEL = "base"  # Options: tiny, base, small
 MICROPHONE_INDEX = 1  # Try 1, 3, 8, 18, or 25 based on test_mic_select.py
 USE_MANUAL_INPUT = True  # Set to True to bypass STT
+STREAMING_TRANSCRIPTION = False  # Print partial transcripts while the caller is still speaking
+STREAM_CHUNK_SECONDS = 1.0  # How often a partial transcript is produced
+STREAM_SILENCE_SECONDS = 0.8  # Trailing silence that ends an utterance
+WHISPER_SAMPLE_RATE = 16000
 FFMPEG_PATH = r"D:/IVR Case-02/ffmpeg/bin/ffmpeg.exe"
 
 # Generate a unique session ID for the session
@@ -37,7 +50,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Buffered call log; rows are appended in batches and synced when the session ends
+call_log = CallLogWriter(CSV_LOG, format=CALL_LOG_FORMAT, flush_every=CALL_LOG_FLUSH_EVERY)
+
 # Text-to-Speech
+@tracing.traced("voice.speak")
 def speak(text):
     try:
         engine = pyttsx3.init()
@@ -48,7 +65,140 @@ def speak(text):
         print(f"TTS error: {e}")
         logger.error(f"TTS error: {e}")
 
+# Long-lived Whisper engine: the model is loaded once and transcribes
+# in-memory PCM from speech_recognition, with no temp file or ffmpeg pass
+class TranscriptionEngine:
+    def __init__(self, model_name=WHISPER_MODEL):
+        logger.info(f"Loading Whisper model: {model_name}")
+        self.model = whisper.load_model(model_name)
+        self._lock = threading.Lock()  # partial and final transcripts share the model
+
+    @staticmethod
+    def to_samples(raw_data, sample_rate, sample_width):
+        # Whisper expects 16 kHz mono float32 in [-1, 1]
+        audio = sr.AudioData(raw_data, sample_rate, sample_width)
+        pcm = audio.get_raw_data(convert_rate=WHISPER_SAMPLE_RATE, convert_width=2)
+        return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+    def transcribe(self, samples):
+        if samples.size == 0:
+            return ""
+        with self._lock, tracing.span("voice.transcribe", audio_seconds=round(samples.size / WHISPER_SAMPLE_RATE, 2)):
+            result = self.model.transcribe(samples, fp16=False)
+        return result["text"].strip()
+
+    def transcribe_audio(self, audio):
+        return self.transcribe(self.to_samples(audio.get_raw_data(), audio.sample_rate, audio.sample_width))
+
+    def stream(self, source, energy_threshold, timeout=10, phrase_time_limit=10):
+        """
+        Reads the microphone in chunks and yields (text, is_final). Every
+        STREAM_CHUNK_SECONDS the audio heard so far is handed to a
+        PartialTranscriber, so the microphone keeps being read while Whisper
+        runs; partial transcripts are yielded as they finish. The utterance
+        ends after STREAM_SILENCE_SECONDS of silence or phrase_time_limit
+        seconds of speech, and the final transcript covers every frame read.
+        """
+        seconds_per_buffer = source.CHUNK / source.SAMPLE_RATE
+        frames = []
+        waited = 0.0
+        heard = 0.0
+        silence = 0.0
+        since_partial = 0.0
+        partials = PartialTranscriber(self)
+        try:
+            while True:
+                buffer = source.stream.read(source.CHUNK)
+                if not buffer:
+                    break
+                level = np.sqrt(np.mean(np.frombuffer(buffer, dtype=np.int16).astype(np.float32) ** 2))
+                if not frames:
+                    # Waiting for speech to start
+                    if level <= energy_threshold:
+                        waited += seconds_per_buffer
+                        if waited > timeout:
+                            raise sr.WaitTimeoutError("listening timed out while waiting for phrase to start")
+                        continue
+                frames.append(buffer)
+                heard += seconds_per_buffer
+                since_partial += seconds_per_buffer
+                silence = silence + seconds_per_buffer if level <= energy_threshold else 0.0
+                if silence >= STREAM_SILENCE_SECONDS or heard >= phrase_time_limit:
+                    break
+                if since_partial >= STREAM_CHUNK_SECONDS:
+                    since_partial = 0.0
+                    partials.submit(b"".join(frames), source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+                for text in partials.results():
+                    yield text, False
+        finally:
+            partials.close()
+        yield self.transcribe(self.to_samples(b"".join(frames), source.SAMPLE_RATE, source.SAMPLE_WIDTH)), True
+
+
+class PartialTranscriber:
+    """
+    Produces partial transcripts on a background thread. Whisper pads every
+    call to a 30 s window, so one call takes about as long however much audio
+    it gets; only the newest request is kept, and one that arrives while a
+    call is running replaces any older request still waiting. At most one
+    partial runs at a time and the reading loop never waits for it.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._pending = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._results = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="partial-transcriber", daemon=True)
+        self._thread.start()
+
+    def submit(self, raw_data, sample_rate, sample_width):
+        with self._condition:
+            self._pending = (raw_data, sample_rate, sample_width)
+            self._condition.notify()
+
+    def results(self):
+        # Transcripts finished since the last call, without waiting
+        while True:
+            try:
+                yield self._results.get_nowait()
+            except queue.Empty:
+                return
+
+    def close(self):
+        # A partial still running finishes in the background; its text is dropped
+        with self._condition:
+            self._closed = True
+            self._pending = None
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                request, self._pending = self._pending, None
+            try:
+                text = self.engine.transcribe(self.engine.to_samples(*request))
+            except Exception as e:
+                logger.error(f"Partial transcription failed: {e}")
+                continue
+            if text and not self._closed:
+                self._results.put(text)
+
+_engine = None
+
+def get_transcription_engine():
+    global _engine
+    if _engine is None:
+        _engine = TranscriptionEngine(WHISPER_MODEL)
+    return _engine
+
 # Speech-to-Text with OpenAI Whisper
+@tracing.traced("voice.listen")
 def listen():
     if USE_MANUAL_INPUT:
         query = input("Enter query (e.g., transfer money): ")
@@ -58,14 +208,24 @@ def listen():
             return query
         return None
 
+    engine = get_transcription_engine()
     r = sr.Recognizer()
+    query = None
     try:
         with sr.Microphone(device_index=MICROPHONE_INDEX) as source:
             print("Listening... Speak now.")
             r.adjust_for_ambient_noise(source, duration=2)
             try:
-                audio = r.listen(source, timeout=10, phrase_time_limit=10)
-                logger.info("Audio captured successfully")
+                if STREAMING_TRANSCRIPTION:
+                    for text, is_final in engine.stream(source, r.energy_threshold, timeout=10, phrase_time_limit=10):
+                        if is_final:
+                            query = text
+                        elif text:
+                            print(f"… {text}")
+                    logger.info("Audio captured and transcribed while streaming")
+                else:
+                    audio = r.listen(source, timeout=10, phrase_time_limit=10)
+                    logger.info("Audio captured successfully")
             except sr.WaitTimeoutError:
                 print("⏳ No speech detected within timeout.")
                 logger.warning("No speech detected within timeout")
@@ -79,26 +239,10 @@ def listen():
         logger.error(f"Microphone error: {e}")
         return None
 
-    # Save audio to WAV
+    # Whisper transcription straight from the captured PCM
     try:
-        audio_file = "temp_audio.wav"
-        with open(audio_file, "wb") as f:
-            f.write(audio.get_wav_data())
-        logger.info(f"Audio saved to {audio_file}")
-        if not os.path.exists(audio_file) or os.path.getsize(audio_file) == 0:
-            print(f"❌ Audio file {audio_file} is missing or empty.")
-            logger.error(f"Audio file {audio_file} is missing or empty")
-            return None
-    except Exception as e:
-        print(f"❌ Error saving audio: {e}")
-        logger.error(f"Error saving audio: {e}")
-        return None
-
-    # Whisper transcription
-    try:
-        model = whisper.load_model(WHISPER_MODEL)
-        result = model.transcribe(audio_file, fp16=False)
-        query = result["text"].strip()
+        if not STREAMING_TRANSCRIPTION:
+            query = engine.transcribe_audio(audio)
         if query:
             print(f"🗣️ You said: {query}")
             logger.info(f"Transcribed query: {query}")
@@ -113,6 +257,7 @@ def listen():
         return None
 
 # Talk to Flask API and log results
+@tracing.traced("voice.turn")
 def ask_bot():
     query = listen()
     if not query:
@@ -121,9 +266,12 @@ def ask_bot():
 
     payload = {"query": query, "session_id": session_id}  # Add session_id to payload
     try:
-        response = requests.post(API_URL, json=payload, timeout=10)
-        response.raise_for_status()
-        result = response.json()
+        with tracing.span("voice.api_call"):
+            # The API continues this trace, so server-side spans line up with ours
+            payload["traceparent"] = tracing.current_traceparent()
+            response = requests.post(API_URL, json=payload, timeout=10)
+            response.raise_for_status()
+            result = response.json()
 
         intent = result.get("intent", "Unknown")
         confidence = result.get("confidence", 0.0)
@@ -132,18 +280,15 @@ def ask_bot():
         print(f"🤖 Bot: {bot_response}")
         speak(bot_response)
 
-        # Log to CSV
-        message = {
+        # Log the turn to the call log
+        call_log.write({
             "query": query,
             "intent": intent,
             "confidence": confidence,
             "response": bot_response,
-            "timestamp": str(pd.Timestamp.now()),
+            "timestamp": str(datetime.now()),
             "session_id": session_id  # Include session ID in the log
-        }
-        log_entry = pd.DataFrame([message])
-        log_entry.to_csv(CSV_LOG, mode='a', header=not os.path.exists(CSV_LOG), index=False)
-        logger.info(f"Logged to CSV: {CSV_LOG}")
+        })
     except requests.exceptions.RequestException as e:
         print(f"❌ API call failed: {e}")
         speak("There was an error talking to the server.")
@@ -151,6 +296,12 @@ def ask_bot():
 
 # Main loop
 if __name__ == "__main__":
-    while True:
-        ask_bot()
-        print("-" * 50)
+    if not USE_MANUAL_INPUT:
+        get_transcription_engine()  # Load Whisper once, before the first turn
+    try:
+        while True:
+            ask_bot()
+            print("-" * 50)
+    finally:
+        call_log.close()  # Session ended: write buffered rows and fsync
+        logger.info(f"Call log written to {CSV_LOG}")
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Offline fixtures for the benchmarks: a tiny randomly initialised BERT
+# intent model with the real label set and a vocabulary built from the
+# training queries, and a cheap deterministic embedding function for Chroma.
+# Neither needs a network connection or a GPU.
+
+ROOT = Path(__file__).resolve().parent.parent
+DATA_CSV = ROOT / "app" / "data" / "banking_intents.csv"
+FIXTURE_VERSION = 1
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+
+
+def default_fixture_dir():
+    return Path(tempfile.gettempdir()) / f"ivr-fixture-model-v{FIXTURE_VERSION}"
+
+
+def build_fixture_model(path=None, data_csv=DATA_CSV, hidden_size=64, layers=2, seed=0):
+    """
+    Writes a small BERT sequence classifier (plus tokenizer and
+    label2id.json) that app.backends can load, and returns its directory.
+    The model is untrained; it has the shape of the real one, not its accuracy.
+    """
+    import torch
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+    path = Path(path or default_fixture_dir())
+    if (path / "label2id.json").exists():
+        return path
+    path.mkdir(parents=True, exist_ok=True)
+
+    df = pd.read_csv(data_csv)
+    words = set()
+    for query in df["query"].dropna():
+        words.update(query.lower().replace("?", " ").replace(".", " ").replace(",", " ").split())
+    (path / "vocab.txt").write_text("\n".join(SPECIAL_TOKENS + sorted(words)), encoding="utf-8")
+    tokenizer = BertTokenizerFast(str(path / "vocab.txt"))
+
+    labels = sorted(df["intent"].unique())
+    label2id = {label: index for index, label in enumerate(labels)}
+    torch.manual_seed(seed)
+    config = BertConfig(
+        vocab_size=tokenizer.vocab_size, hidden_size=hidden_size, num_hidden_layers=layers,
+        num_attention_heads=max(1, hidden_size // 32), intermediate_size=hidden_size * 4,
+        max_position_embeddings=512, num_labels=len(labels),
+        id2label={index: label for label, index in label2id.items()}, label2id=label2id,
+    )
+    model = BertForSequenceClassification(config)
+    model.save_pretrained(str(path))
+    tokenizer.save_pretrained(str(path))
+    with open(path / "label2id.json", "w") as f:
+        json.dump(label2id, f)
+    return path
+
+
+class HashingEmbeddingFunction:
+    """
+    Chroma embedding function that hashes tokens into a fixed-size vector,
+    so the vector store can be exercised without downloading a model.
+    """
+
+    def __init__(self, dim=64):
+        self.dim = dim
+
+    def __call__(self, input):
+        embeddings = []
+        for text in input:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            for token in text.lower().split():
+                vector[int(hashlib.md5(token.encode()).hexdigest(), 16) % self.dim] += 1.0
+            norm = np.linalg.norm(vector)
+            embeddings.append((vector / norm if norm else vector).tolist())
+        return embeddings
+
+
+def fixture_environment(model_path, threads=1):
+    # Settings for importing app.nlp against the fixture, without shared
+    # services or background tool calls
+    return {
+        "IVR_MODEL_PATH": str(model_path),
+        "IVR_INTENT_BACKEND": "pytorch",
+        "IVR_INFERENCE_THREADS": str(threads),
+        "IVR_CACHE_BACKEND": "off",
+        "IVR_PREFETCH_ENABLED": "0",
+        "IVR_SESSION_STORE": "memory",
+        "IVR_BATCH_WINDOW_MS": "0",
+    }
+
+
+def use_fixture(model_path, threads=1):
+    os.environ.update(fixture_environment(model_path, threads))
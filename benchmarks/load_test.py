@@ -0,0 +1,340 @@
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import psutil
+import requests
+
+# End-to-end load test for /predict_intent.
+#
+# Starts the API (Flask, ASGI or prefork) against an in-process copy of the
+# banking API stand-in, drives it with multi-turn sessions sampled from
+# banking_intents_expanded.csv plus transfer flows, and reports throughput,
+# latency percentiles and per-process CPU/RSS. Results can be saved as a
+# baseline and later runs compared against it:
+#
+#   python -m benchmarks.load_test --serve flask --concurrency 8 --duration 60 --save-baseline
+#   python -m benchmarks.load_test --serve flask --concurrency 8 --duration 60
+
+ROOT = Path(__file__).resolve().parent.parent
+DATA_CSV = ROOT / "app" / "data" / "banking_intents_expanded.csv"
+DEFAULT_BASELINE = ROOT / "benchmarks" / "baseline.json"
+
+# One utterance list per step of the transfer flow; each session picks one
+TRANSFER_FLOW = [
+    ["I want to transfer money", "Transfer funds to another account", "Send money to my friend", "Move money between my accounts"],
+    ["from savings", "savings account", "from my checking account", "account 4821 7730"],
+    ["to checking", "checking account", "to my salary account", "account ending in 9876"],
+    ["500", "₹2,500", "1000 rupees", "250.50"],
+    ["yes", "confirm", "go ahead", "no"],
+]
+
+# (metric, True when higher is better)
+COMPARED_METRICS = [
+    ("throughput_rps", True),
+    ("latency_ms.p50", False),
+    ("latency_ms.p95", False),
+    ("latency_ms.p99", False),
+    ("error_rate", False),
+]
+
+
+def load_queries(path=DATA_CSV):
+    return pd.read_csv(path)["query"].dropna().tolist()
+
+
+def build_session(rng, queries, max_turns, transfer_ratio, cancel_ratio):
+    """
+    A caller's session as a list of (kind, query): a few one-shot queries,
+    and with probability `transfer_ratio` a full transfer flow, sometimes
+    abandoned midway with "cancel".
+    """
+    turns = [("single", rng.choice(queries)) for _ in range(rng.randint(1, max_turns))]
+    if rng.random() < transfer_ratio:
+        steps = [rng.choice(options) for options in TRANSFER_FLOW]
+        if rng.random() < cancel_ratio:
+            steps = steps[:rng.randint(1, len(steps) - 1)] + ["cancel"]
+        turns += [("transfer", step) for step in steps]
+    return turns
+
+
+def run_user(user_id, args, queries, url, started, deadline, samples):
+    rng = random.Random(args.seed + user_id)
+    http = requests.Session()
+    warmup_until = started + args.warmup
+    session_number = 0
+    while time.monotonic() < deadline:
+        session_id = f"load-{args.seed}-{user_id}-{session_number}"
+        session_number += 1
+        for kind, query in build_session(rng, queries, args.max_turns, args.transfer_ratio, args.cancel_ratio):
+            if time.monotonic() >= deadline:
+                return
+            sent = time.monotonic()
+            try:
+                response = http.post(url, json={"query": query, "session_id": session_id}, timeout=args.timeout)
+                status = response.status_code
+            except requests.RequestException:
+                status = None
+            if sent >= warmup_until:
+                samples.append((kind, (time.monotonic() - sent) * 1000, status))
+
+
+class ResourceSampler:
+    """
+    Samples CPU and RSS of the server process and its children (workers)
+    every `interval` seconds while the load runs.
+    """
+
+    def __init__(self, pid, interval=0.5):
+        self.root = psutil.Process(pid)
+        self.interval = interval
+        self.usage = {}  # pid -> {"role", "cpu": [...], "rss": [...]}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _processes(self):
+        try:
+            return [self.root] + self.root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def _run(self):
+        for process in self._processes():
+            process.cpu_percent(None)  # First call only sets the reference point
+        while not self._stop.wait(self.interval):
+            for process in self._processes():
+                try:
+                    cpu = process.cpu_percent(None)
+                    rss = process.memory_info().rss / 2 ** 20
+                except psutil.NoSuchProcess:
+                    continue
+                role = "master" if process.pid == self.root.pid else "worker"
+                entry = self.usage.setdefault(process.pid, {"role": role, "cpu": [], "rss": []})
+                entry["cpu"].append(cpu)
+                entry["rss"].append(rss)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return [
+            {
+                "pid": pid,
+                "role": entry["role"],
+                "cpu_percent_mean": round(float(np.mean(entry["cpu"][1:] or entry["cpu"])), 1),
+                "rss_mb_max": round(max(entry["rss"]), 1),
+            }
+            for pid, entry in sorted(self.usage.items())
+        ]
+
+
+def start_banking_api(port, latency_ms):
+    # The same stand-in as app/banking_api.py, with an optional fixed delay
+    from werkzeug.serving import make_server
+    from app.banking_api import app as banking_app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # No access log line per call
+    if latency_ms:
+        banking_app.before_request(lambda: time.sleep(latency_ms / 1000))
+    server = make_server("127.0.0.1", port, banking_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_server(mode, port, env):
+    if mode == "flask":
+        cmd = [sys.executable, "-c", f"from app.main import app; app.run(port={port}, threaded=True)"]
+    elif mode == "asgi":
+        cmd = [sys.executable, "-m", "uvicorn", "app.asgi:app", "--port", str(port), "--log-level", "warning"]
+    elif mode == "prefork":
+        env = dict(env, IVR_BIND=f"127.0.0.1:{port}")
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app.main:app"]
+    else:
+        raise ValueError(f"Unknown server mode '{mode}'. Use flask, asgi or prefork.")
+    return subprocess.Popen(cmd, cwd=ROOT, env=env)
+
+
+def wait_until_ready(base_url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} during startup")
+        try:
+            if requests.get(f"{base_url}/metrics", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server at {base_url} not ready after {timeout}s")
+
+
+def summarize(samples, measured_seconds):
+    latencies = np.array([latency for _, latency, _ in samples]) if samples else np.zeros(1)
+    errors = sum(1 for _, _, status in samples if status != 200)
+
+    def percentiles(values):
+        return {f"p{q}": round(float(np.percentile(values, q)), 2) for q in (50, 95, 99)}
+
+    by_kind = {}
+    for kind in sorted({kind for kind, _, _ in samples}):
+        values = np.array([latency for k, latency, _ in samples if k == kind])
+        by_kind[kind] = {"requests": len(values), **percentiles(values)}
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "throughput_rps": round(len(samples) / measured_seconds, 2),
+        "latency_ms": {**percentiles(latencies), "mean": round(float(latencies.mean()), 2)},
+        "latency_ms_by_kind": by_kind,
+    }
+
+
+def _lookup(result, dotted):
+    value = result
+    for key in dotted.split("."):
+        value = value[key]
+    return value
+
+
+def compare(result, baseline, tolerance):
+    """
+    Returns (metric, baseline, current, change %, regressed) rows. A metric
+    regresses when it is worse than the baseline by more than `tolerance`
+    (a fraction); error_rate also regresses on any absolute increase above it.
+    """
+    rows = []
+    for metric, higher_is_better in COMPARED_METRICS:
+        before, after = _lookup(baseline["results"], metric), _lookup(result["results"], metric)
+        change = (after - before) / before if before else (0.0 if after == before else float("inf"))
+        worse = -change if higher_is_better else change
+        if metric == "error_rate":
+            regressed = after - before > tolerance
+        else:
+            regressed = worse > tolerance
+        rows.append((metric, before, after, round(change * 100, 1), regressed))
+    return rows
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test /predict_intent with multi-turn sessions")
+    parser.add_argument("--serve", choices=["flask", "asgi", "prefork"], help="Start this server mode for the run")
+    parser.add_argument("--url", default="http://127.0.0.1:5050", help="Base URL of the API (started or existing)")
+    parser.add_argument("--pid", type=int, help="Server pid to sample CPU/RSS from when using an existing server")
+    parser.add_argument("--banking-api-port", type=int, default=5099)
+    parser.add_argument("--banking-api-latency-ms", type=float, default=20.0, help="Delay added by the stand-in")
+    parser.add_argument("--concurrency", type=int, default=8, help="Simulated callers")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of load, including warm-up")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Seconds excluded from the results")
+    parser.add_argument("--max-turns", type=int, default=3, help="Most one-shot queries per session")
+    parser.add_argument("--transfer-ratio", type=float, default=0.3, help="Share of sessions with a transfer flow")
+    parser.add_argument("--cancel-ratio", type=float, default=0.2, help="Share of transfer flows abandoned midway")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--startup-timeout", type=float, default=180.0)
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Baseline to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed regression before failing (fraction)")
+    args = parser.parse_args(argv)
+
+    base_url = args.url.rstrip("/")
+    server = banking_api = None
+    if args.serve:
+        banking_api = start_banking_api(args.banking_api_port, args.banking_api_latency_ms)
+        port = int(base_url.rsplit(":", 1)[1])
+        env = dict(os.environ, IVR_BANKING_API_URL=f"http://127.0.0.1:{args.banking_api_port}")
+        server = start_server(args.serve, port, env)
+
+    try:
+        wait_until_ready(base_url, server, args.startup_timeout)
+        queries = load_queries()
+        pid = server.pid if server else args.pid
+        sampler = ResourceSampler(pid) if pid else None
+        if sampler:
+            sampler.start()
+
+        samples = []
+        started = time.monotonic()
+        deadline = started + args.duration
+        users = [
+            threading.Thread(target=run_user, args=(user_id, args, queries, f"{base_url}/predict_intent",
+                                                    started, deadline, samples), daemon=True)
+            for user_id in range(args.concurrency)
+        ]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        measured = max(1e-9, time.monotonic() - started - args.warmup)
+        processes = sampler.stop() if sampler else []
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if banking_api is not None:
+            banking_api.shutdown()
+
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "config": {
+            "serve": args.serve, "concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup,
+            "max_turns": args.max_turns, "transfer_ratio": args.transfer_ratio, "cancel_ratio": args.cancel_ratio,
+            "banking_api_latency_ms": args.banking_api_latency_ms, "seed": args.seed, "cpu_count": os.cpu_count(),
+        },
+        "results": summarize(samples, measured),
+        "processes": processes,
+    }
+
+    summary = result["results"]
+    print(f"{summary['requests']} requests, {summary['errors']} errors, {summary['throughput_rps']} req/s")
+    print("latency ms: " + ", ".join(f"{name}={value}" for name, value in summary["latency_ms"].items()))
+    for kind, stats in summary["latency_ms_by_kind"].items():
+        print(f"  {kind}: " + ", ".join(f"{name}={value}" for name, value in stats.items()))
+    for process in processes:
+        print(f"  {process['role']} {process['pid']}: cpu {process['cpu_percent_mean']}% rss {process['rss_mb_max']} MB")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(result, indent=2))
+        print(f"Baseline saved to {baseline_path}")
+        return 0
+    if not baseline_path.exists():
+        print(f"No baseline at {baseline_path}; run with --save-baseline to create one")
+        return 0
+
+    baseline = json.loads(baseline_path.read_text())
+    if baseline["config"] != result["config"]:
+        print("Warning: baseline was recorded with a different configuration")
+    rows = compare(result, baseline, args.tolerance)
+    print(f"\nCompared with baseline from {baseline['timestamp']} ({baseline.get('commit')}):")
+    for metric, before, after, change, regressed in rows:
+        print(f"  {metric:<16} {before:>10} -> {after:<10} {change:+.1f}%{'  REGRESSION' if regressed else ''}")
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.fixtures import ROOT, HashingEmbeddingFunction, build_fixture_model, use_fixture
+from benchmarks.load_test import git_commit, load_queries
+
+# Microbenchmarks for the hot paths in app/nlp.py, run against a tiny
+# offline fixture model on the CPU. Results are JSON, one entry per case
+# with the time per call, so runs from different commits can be diffed:
+#
+#   python -m benchmarks.microbench --output bench.json
+#   python -m benchmarks.microbench --compare bench.json
+
+BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64)
+LONG_QUERY = "please move 2500 rupees from my savings account number 123456789012 to checking " * 6
+
+
+def measure(fn, repeat=5, number=None, min_time=0.2, teardown=None):
+    """
+    Runs `fn` `number` times per repeat (calibrated with timeit's autorange
+    when not given) and returns per-call timings in microseconds.
+    `teardown` runs untimed after every repeat.
+    """
+    timer = timeit.Timer(fn)
+    if number is None:
+        number, elapsed = timer.autorange()
+        if elapsed < min_time:
+            number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    per_call = []
+    for _ in range(repeat):
+        elapsed = timer.timeit(number)
+        if teardown:
+            teardown()
+        per_call.append(elapsed / number * 1e6)
+    return {
+        "calls": number * repeat,
+        "min_us": round(min(per_call), 3),
+        "median_us": round(statistics.median(per_call), 3),
+        "mean_us": round(statistics.fmean(per_call), 3),
+        "stdev_us": round(statistics.stdev(per_call), 3) if repeat > 1 else 0.0,
+    }
+
+
+def run_cases(nlp, queries, repeat, selected):
+    from app.history import VectorStoreWriter
+    from app.session_store import create_session_store
+    import chromadb
+
+    cases = []
+
+    def case(name, fn, params=None, items=1, **kwargs):
+        if selected and not any(token in name for token in selected):
+            return
+        result = {"name": name, "params": params or {}, **measure(fn, repeat=repeat, **kwargs)}
+        if items > 1:
+            result["per_item_us"] = round(result["median_us"] / items, 3)
+        cases.append(result)
+        print(f"{name:<32} {json.dumps(params or {}):<24} {result['median_us']:>12.3f} us/call", file=sys.stderr)
+
+    short_query = queries[0]
+    case("sanitize_input", lambda: nlp.sanitize_input(short_query), {"chars": len(short_query)})
+    case("sanitize_input", lambda: nlp.sanitize_input(LONG_QUERY), {"chars": len(LONG_QUERY)})
+
+    tokenizer = nlp.backend.tokenizer
+    case("tokenizer.encode", lambda: tokenizer(short_query, truncation=True, max_length=128), {"batch_size": 1})
+    batch = queries[:32]
+    case("tokenizer.encode", lambda: tokenizer(batch, padding=True, truncation=True, max_length=128),
+         {"batch_size": len(batch)}, items=len(batch))
+
+    for batch_size in BATCH_SIZES:
+        texts = [nlp.sanitize_input(query) for query in queries[:batch_size]]
+        case("classifier.forward", lambda texts=texts: nlp.score_texts(texts), {"batch_size": batch_size},
+             items=batch_size)
+
+    # Chroma writes happen on the writer thread; after each repeat wait for
+    # them (untimed) so the queue doesn't grow across repeats
+    collection = chromadb.EphemeralClient().get_or_create_collection(
+        name="bench_context", embedding_function=HashingEmbeddingFunction()
+    )
+    nlp.vector_writer = VectorStoreWriter(collection)
+    barrier = lambda: nlp.vector_writer.delete(where={"session_id": "bench-none"}).result()
+    turn = iter(range(10 ** 9))
+    case("append_to_history", lambda: nlp.append_to_history("bench-history", "user", f"{short_query} {next(turn)}"),
+         number=200, teardown=barrier)
+    case("get_recent_context", lambda: nlp.get_recent_context("bench-history"),
+         {"messages": len(nlp.conversation_log.recent("bench-history"))})
+
+    for backend in ("memory", "sqlite"):
+        db_path = os.path.join(tempfile.mkdtemp(), "sessions.db")
+        nlp.session_store = create_session_store(backend, db_path)
+        case("reset_state", lambda: nlp.reset_state("bench-session"), {"session_store": backend},
+             number=200, teardown=barrier)
+    return cases
+
+
+def compare(current, previous):
+    before = {(case["name"], json.dumps(case["params"], sort_keys=True)): case for case in previous["results"]}
+    print(f"\n{'case':<56} {'before':>12} {'after':>12} {'change':>8}", file=sys.stderr)
+    for case in current["results"]:
+        key = (case["name"], json.dumps(case["params"], sort_keys=True))
+        if key not in before:
+            continue
+        old, new = before[key]["median_us"], case["median_us"]
+        label = f"{case['name']} {key[1] if case['params'] else ''}"
+        print(f"{label:<56} {old:>12.3f} {new:>12.3f} {(new - old) / old * 100:>+7.1f}%", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the app/nlp.py hot paths")
+    parser.add_argument("--model-path", help="Model to load instead of the generated fixture")
+    parser.add_argument("--threads", type=int, default=1, help="Inference threads")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", action="append", default=[], help="Run cases whose name contains this")
+    parser.add_argument("--output", help="Write results as JSON here (default: stdout)")
+    parser.add_argument("--compare", help="Earlier results to compare against")
+    args = parser.parse_args(argv)
+
+    output = Path(args.output).resolve() if args.output else None
+    previous = json.loads(Path(args.compare).read_text()) if args.compare else None
+    model_path = Path(args.model_path).resolve() if args.model_path else build_fixture_model()
+    use_fixture(model_path, args.threads)
+    sys.path.insert(0, str(ROOT))
+    os.chdir(tempfile.mkdtemp(prefix="ivr-microbench-"))  # Keep app log and store files out of the repo
+
+    started = time.perf_counter()
+    from app import nlp
+    import_seconds = time.perf_counter() - started
+
+    import torch
+    import transformers
+
+    cases = run_cases(nlp, load_queries(), args.repeat, args.only)
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "cpu_count": os.cpu_count(),
+            "threads": args.threads,
+            "model": str(model_path),
+        },
+        "import_seconds": round(import_seconds, 3),
+        "results": cases,
+    }
+
+    text = json.dumps(result, indent=2)
+    if output:
+        output.write_text(text)
+    else:
+        print(text)
+    if previous:
+        compare(result, previous)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
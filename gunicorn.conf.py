@@ -0,0 +1,41 @@
+import gc
+import os
+
+# Prefork serving mode: gunicorn -c gunicorn.conf.py app.main:app
+#
+# The app (and the intent model) is loaded once in the master and workers
+# are forked from it, so the weights are shared copy-on-write instead of
+# being loaded once per worker. Session state has to live outside the
+# workers for a caller's turns to land on any of them.
+os.environ.setdefault("IVR_SESSION_STORE", "sqlite")
+# Warm-up runs in each worker after the fork (app/prefork.py), not in the master
+os.environ.setdefault("IVR_WARM_UP", "off")
+
+from app.config import BIND, WORKERS, WORKER_THREADS
+
+bind = BIND
+workers = WORKERS
+threads = WORKER_THREADS
+worker_class = "gthread"
+preload_app = True
+
+
+def when_ready(server):
+    from app.prefork import log_memory_footprint
+
+    # Move everything allocated while preloading into the permanent
+    # generation so the collector never writes to (and un-shares) those pages
+    gc.freeze()
+    log_memory_footprint("master")
+
+
+def post_fork(server, worker):
+    from app.prefork import init_worker
+
+    init_worker(WORKERS)
+
+
+def post_worker_init(worker):
+    from app.prefork import log_memory_footprint
+
+    log_memory_footprint(f"worker {worker.age}")